@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Product, ProductImage, ProductVariant, Cart, Order, OrderItem, Review, Address
+from . import order_export
+from .models import Category, Product, ProductImage, ProductVariant, StockReservation, Cart, Order, OrderItem, Review, Address, EmailOutbox
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -21,6 +22,8 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['name', 'price', 'category', 'featured', 'rating', 'material']
     list_filter = ['category', 'featured', 'material']
     search_fields = ['name', 'description']
+    # Mean of the product's reviews, maintained by main.ratings
+    readonly_fields = ['rating']
     inlines = [ProductImageInline, ProductVariantInline]
 
 @admin.register(ProductImage)
@@ -30,10 +33,17 @@ class ProductImageAdmin(admin.ModelAdmin):
 
 @admin.register(ProductVariant)
 class ProductVariantAdmin(admin.ModelAdmin):
-    list_display = ['product', 'color', 'size', 'stock', 'sku', 'is_in_stock']
+    list_display = ['product', 'color', 'size', 'stock', 'reserved', 'sku', 'is_in_stock']
     list_filter = ['color', 'size', 'product']
     search_fields = ['product__name', 'sku']
     list_editable = ['stock']
+    readonly_fields = ['reserved']
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['variant', 'quantity', 'user', 'session_key', 'created_at', 'expires_at']
+    list_filter = ['expires_at']
+    search_fields = ['variant__sku', 'user__username', 'session_key']
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
@@ -45,6 +55,18 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['order_number', 'user', 'total_amount', 'status', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['order_number', 'user__username', 'email']
+    date_hierarchy = 'created_at'
+    actions = ['export_csv', 'export_jsonl']
+
+    # Exports stream the selection (narrowed with the date filters) with
+    # its items in one joined query, at constant memory
+    @admin.action(description='Export selected orders with items (CSV)')
+    def export_csv(self, request, queryset):
+        return order_export.streaming_response(queryset, 'csv')
+
+    @admin.action(description='Export selected orders with items (JSON Lines)')
+    def export_jsonl(self, request, queryset):
+        return order_export.streaming_response(queryset, 'jsonl')
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
@@ -61,4 +83,11 @@ class ReviewAdmin(admin.ModelAdmin):
 class AddressAdmin(admin.ModelAdmin):
     list_display = ['user', 'name', 'city', 'state', 'zip_code', 'is_default']
     list_filter = ['is_default', 'state']
-    search_fields = ['user__username', 'name', 'address_line1', 'city', 'zip_code']
\ No newline at end of file
+    search_fields = ['user__username', 'name', 'address_line1', 'city', 'zip_code']
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['claim_token', 'claimed_at', 'last_error']
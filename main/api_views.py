@@ -1,21 +1,29 @@
-from rest_framework import generics, filters, status, views
+from rest_framework import generics, status, views
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q
-from .models import Product, Category, Cart
-from .serializers import ProductSerializer, CategorySerializer, CartCreateSerializer
+from .models import Product, Category
+from .serializers import ProductSerializer, CategorySerializer, CartCreateSerializer, CartLineSerializer
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter
+from . import carts, facets
 
 class ProductListAPIView(generics.ListAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category', 'rating_summary')
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    # Ordering is applied by the keyset paginator, which needs to own it
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter]
+    pagination_class = KeysetPagination
     filterset_fields = ['category__slug', 'featured']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'description', 'material']
     ordering_fields = ['price', 'created_at', 'name']
     ordering = ['-created_at']
 
+    def get_facet_filters(self):
+        return facets.FacetFilters.from_params(self.request.query_params)
+
     def get_queryset(self):
         queryset = super().get_queryset()
         
@@ -28,17 +36,26 @@ class ProductListAPIView(generics.ListAPIView):
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
         
-        # Size filtering
-        size = self.request.query_params.get('size')
-        if size:
-            queryset = queryset.filter(variants__size=size).distinct()
-        
-        # Color filtering
-        color = self.request.query_params.get('color')
-        if color:
-            queryset = queryset.filter(variants__color=color).distinct()
-            
-        return queryset
+        # Size and color filtering through the facet index (no variant join or DISTINCT)
+        return facets.filter_products(queryset, self.get_facet_filters())
+
+    def get_facet_scope(self):
+        """Products the facet counts are drawn from: search and featured, not facet selections"""
+        params = self.request.query_params
+        if not params.get('search') and params.get('featured') is None:
+            return None
+        scope = FullTextSearchFilter().filter_queryset(self.request, Product.objects.all(), self)
+        featured = params.get('featured', '').lower()
+        if featured in ('true', '1'):
+            scope = scope.filter(featured=True)
+        elif featured in ('false', '0'):
+            scope = scope.filter(featured=False)
+        return scope
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = facets.facet_counts(self.get_facet_filters(), self.get_facet_scope())
+        return response
 
 class CategoryListAPIView(generics.ListAPIView):
     queryset = Category.objects.all()
@@ -56,37 +73,7 @@ class CartAPIView(views.APIView):
             size = serializer.validated_data.get('size', '')
             color = serializer.validated_data.get('color', '')
             
-            if request.user.is_authenticated:
-                # Database Cart for Logged-in Users
-                cart_item, created = Cart.objects.get_or_create(
-                    user=request.user,
-                    product=product,
-                    size=size,
-                    color=color,
-                    defaults={'quantity': quantity}
-                )
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
-            else:
-                # Session Cart for Anonymous Users
-                cart = request.session.get('cart', {})
-                # Create a unique key for product + size + color
-                item_key = f"{product.id}_{size}_{color}"
-                
-                if item_key in cart:
-                    cart[item_key]['quantity'] += quantity
-                else:
-                    cart[item_key] = {
-                        'product_id': product.id,
-                        'quantity': quantity,
-                        'size': size,
-                        'color': color
-                    }
-                
-                request.session['cart'] = cart
-                request.session.modified = True
-                
+            carts.for_request(request).add(product.id, quantity, size, color)
             return Response({'status': 'success', 'message': 'Product added to cart'}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -100,87 +87,23 @@ class CartAPIView(views.APIView):
             return Response({'error': 'Product ID and quantity required'}, status=status.HTTP_400_BAD_REQUEST)
             
         try:
+            product_id = int(product_id)
             quantity = int(quantity)
             if quantity < 1:
                 return Response({'error': 'Quantity must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
         except ValueError:
              return Response({'error': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if request.user.is_authenticated:
-            try:
-                # Find item by product, size, and color
-                cart_item = Cart.objects.get(
-                    user=request.user, 
-                    product_id=product_id,
-                    size=size,
-                    color=color
-                )
-                cart_item.quantity = quantity
-                cart_item.save()
-            except Cart.DoesNotExist:
-                return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            cart = request.session.get('cart', {})
-            item_key = f"{product_id}_{size}_{color}"
-            
-            # Fallback for old session structure (just product_id)
-            if item_key not in cart and str(product_id) in cart:
-                item_key = str(product_id)
-
-            if item_key in cart:
-                if isinstance(cart[item_key], dict):
-                    cart[item_key]['quantity'] = quantity
-                else:
-                    # Handle legacy simple int quantity
-                    cart[item_key] = quantity
-                    
-                request.session['cart'] = cart
-                request.session.modified = True
-            else:
-                return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
+        if not carts.for_request(request).set_quantity(product_id, quantity, size, color):
+            return Response({'error': 'Item not found in cart'}, status=status.HTTP_404_NOT_FOUND)
         
         return Response({'status': 'success', 'message': 'Cart updated'}, status=status.HTTP_200_OK)
 
     def get(self, request):
-        if request.user.is_authenticated:
-            cart_items = Cart.objects.filter(user=request.user)
-            from .serializers import CartItemSerializer
-            serializer = CartItemSerializer(cart_items, many=True)
-            return Response({'count': cart_items.count(), 'items': serializer.data})
-        else:
-            cart = request.session.get('cart', {})
-            items = []
-            
-            for key, item_data in cart.items():
-                # Handle both new dict structure and old int structure
-                if isinstance(item_data, dict):
-                    product_id = item_data['product_id']
-                    quantity = item_data['quantity']
-                    size = item_data.get('size', '')
-                    color = item_data.get('color', '')
-                else:
-                    product_id = key
-                    quantity = item_data
-                    size = ''
-                    color = ''
-                
-                try:
-                    product = Product.objects.get(id=product_id)
-                    items.append({
-                        'product': product.id,
-                        'product_id': product.id,
-                        'product_name': product.name,
-                        'product_price': float(product.price),
-                        'product_image': product.image.url if product.image else None,
-                        'quantity': quantity,
-                        'size': size,
-                        'color': color,
-                        'subtotal': float(product.price) * quantity
-                    })
-                except Product.DoesNotExist:
-                    continue
-                    
-            return Response({'count': len(items), 'items': items})
+        # One query for the lines and one for all their products
+        lines = carts.for_request(request).get_lines()
+        serializer = CartLineSerializer(lines, many=True)
+        return Response({'count': len(lines), 'items': serializer.data})
 
     def delete(self, request):
         product_id = request.data.get('product_id')
@@ -190,25 +113,19 @@ class CartAPIView(views.APIView):
         if not product_id:
             return Response({'error': 'Product ID required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if request.user.is_authenticated:
-            Cart.objects.filter(
-                user=request.user, 
-                product_id=product_id,
-                size=size,
-                color=color
-            ).delete()
-        else:
-            cart = request.session.get('cart', {})
-            item_key = f"{product_id}_{size}_{color}"
-            
-            # Fallback for old session structure
-            if item_key not in cart and str(product_id) in cart:
-                item_key = str(product_id)
-                
-            if item_key in cart:
-                del cart[item_key]
-                request.session['cart'] = cart
-                request.session.modified = True
-        
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid product ID'}, status=status.HTTP_400_BAD_REQUEST)
+
+        carts.for_request(request).remove(product_id, size, color)
         return Response({'status': 'success', 'message': 'Item removed'}, status=status.HTTP_200_OK)
 
+
+class CartSummaryAPIView(views.APIView):
+    """Line count, item count and total of the cart, e.g. for the header badge; never loads products"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        summary = carts.for_request(request).summary()
+        return Response({'lines': summary.lines, 'items': summary.items, 'total': str(summary.total)})
@@ -1,6 +1,43 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+
+
+def install_search_triggers(sender, using, **kwargs):
+    # Rebuilding main_product during a migration drops the FTS triggers
+    from django.db import connections
+    from .search import install_triggers
+    install_triggers(connections[using])
 
 
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
+
+    def ready(self):
+        from . import carts, facets, page_cache, ratings, renditions, variant_matrix
+        from .models import Category, Page, Product, ProductImage, ProductVariant, Review
+
+        post_migrate.connect(install_search_triggers, sender=self)
+
+        receivers = [
+            (Product, facets.product_changed),
+            (ProductVariant, facets.product_changed),
+            (ProductVariant, variant_matrix.variant_changed),
+            (ProductImage, variant_matrix.variant_changed),
+            (Product, page_cache.product_changed),
+            (Category, page_cache.category_changed),
+            (Page, page_cache.page_changed),
+        ]
+        for model, receiver in receivers:
+            post_save.connect(receiver, sender=model)
+            post_delete.connect(receiver, sender=model)
+
+        pre_save.connect(ratings.review_pre_save, sender=Review)
+        post_save.connect(ratings.review_saved, sender=Review)
+        post_delete.connect(ratings.review_deleted, sender=Review)
+
+        for model, _ in renditions.IMAGE_FIELDS:
+            post_save.connect(renditions.image_saved, sender=model)
+
+        user_logged_in.connect(carts.logged_in)
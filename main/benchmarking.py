@@ -0,0 +1,55 @@
+"""
+Small helpers shared by the bench_* management commands.
+"""
+import math
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """
+    Run a block inside a transaction that is always rolled back.
+
+    Benchmarks create thousands of throwaway rows; this keeps the real
+    database untouched no matter how the block exits.
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+class Timer:
+    """Accumulate wall-clock time over several `with timer:` blocks."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.count = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed += time.perf_counter() - self._start
+        self.count += 1
+        return False
+
+    @property
+    def per_second(self):
+        return self.count / self.elapsed if self.elapsed else 0.0
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
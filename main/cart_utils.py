@@ -0,0 +1,101 @@
+"""
+Cart lines shared by every cart store (see main.carts).
+
+Each kind of cart is first reduced to plain CartLine objects; products for
+all lines are then fetched with a single ``in_bulk`` query, so the number of
+queries does not depend on how many lines the cart has.
+
+Stores that keep a cart as one value (session, cache) use a compact dict of
+``{'[<product id>, "<size>", "<color>"]': quantity}``, keyed on the JSON list
+of the variant so that any size or color can be told apart.
+"""
+import json
+
+from .models import Product
+
+
+class CartLine:
+    """One cart line, independent of where the cart is stored"""
+    __slots__ = ('id', 'product_id', 'quantity', 'size', 'color', 'created_at', 'product')
+
+    def __init__(self, product_id, quantity, size='', color='', id=None, created_at=None):
+        self.id = id
+        self.product_id = product_id
+        self.quantity = quantity
+        self.size = size
+        self.color = color
+        self.created_at = created_at
+        self.product = None
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def key(self):
+        return line_key(self.product_id, self.size, self.color)
+
+    @property
+    def total_price(self):
+        return self.product.price * self.quantity
+
+
+def line_key(product_id, size='', color=''):
+    """Key of a line in a compact cart dict."""
+    return json.dumps([product_id, size, color])
+
+
+def db_lines(queryset):
+    """Read lines from a Cart queryset without loading products."""
+    return [
+        CartLine(product_id, quantity, size, color, id=pk, created_at=created_at)
+        for pk, product_id, quantity, size, color, created_at in queryset.values_list(
+            'id', 'product_id', 'quantity', 'size', 'color', 'created_at'
+        )
+    ]
+
+
+def keyed_lines(cart):
+    """
+    Read lines from a compact cart dict, e.g. ``request.session['cart']``.
+
+    Older carts use ``{"<id>_<size>_<color>": {"product_id": ..., ...}}``,
+    ``{"<product id>:<size>:<color>": quantity}`` or
+    ``{"<product id>": quantity}``; all are still read, the last as a line
+    without size or color.
+    """
+    lines = []
+    for key, item in cart.items():
+        try:
+            if isinstance(item, dict):
+                line = CartLine(int(item['product_id']), item['quantity'],
+                                item.get('size', ''), item.get('color', ''))
+            elif key.startswith('['):
+                product_id, size, color = json.loads(key)
+                line = CartLine(int(product_id), int(item), str(size), str(color))
+            elif ':' in key:
+                product_id, size, color = key.split(':', 2)
+                line = CartLine(int(product_id), int(item), size, color)
+            else:
+                line = CartLine(int(key), item)
+        except (KeyError, TypeError, ValueError):
+            # Unreadable entry; skip it rather than break the whole cart
+            continue
+        lines.append(line)
+    return lines
+
+
+def hydrate(lines):
+    """
+    Attach products to ``lines`` with one query.
+
+    Lines whose product no longer exists are dropped.
+    """
+    products = Product.objects.select_related('category').in_bulk({line.product_id for line in lines})
+
+    hydrated = []
+    for line in lines:
+        line.product = products.get(line.product_id)
+        if line.product is not None:
+            hydrated.append(line)
+    return hydrated
@@ -0,0 +1,532 @@
+"""
+Cart storage: one ``CartStore`` interface over the places a cart can live.
+
+* ``DbCartStore`` keeps lines as Cart rows owned by a user or, for guests,
+  by a session key. A cart holds at most one line per product, size and
+  color; partial unique constraints on Cart enforce this, and adds are a
+  single ``INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity + ?``,
+  so a double-click or two concurrent requests can neither create a
+  duplicate line nor lose an increment. Backends without upserts against a
+  conditional unique index (MySQL, SQLite before 3.24) fall back to an
+  ``F()`` increment, an insert in a savepoint, and the increment again if
+  another request inserted the line first.
+* ``SessionCartStore`` and ``CacheCartStore`` keep a whole cart as one
+  compact dict, ``{'[<product id>, "<size>", "<color>"]': quantity}``, in
+  the session or in the default cache. Writes are read-modify-write of that
+  value, so the last of two concurrent requests wins.
+
+Signed-in users always get the database store, so their cart follows them
+across devices; ``CART_GUEST_STORE`` ('db', 'session' or 'cache') picks the
+store for guests. Views and API endpoints get theirs from ``for_request()``
+and read every line, with products, in two queries at most through
+``get_lines()``. ``summary()`` returns the line count, item count and total
+for badges and order totals in one query, without loading products.
+
+Guest lines outlive the sessions they belong to; ``purge_stale()`` (run by
+``manage.py purge_stale_carts``) deletes them, along with expired sessions.
+"""
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, DecimalField, Exists, F, OuterRef, Sum
+from django.utils import timezone
+
+from .cart_utils import CartLine, db_lines, hydrate, keyed_lines, line_key
+from .models import Cart, Product
+
+
+GUEST_STORE = getattr(settings, 'CART_GUEST_STORE', 'db')
+CACHE_TIMEOUT = getattr(settings, 'CART_CACHE_SECONDS', 30 * 24 * 60 * 60)
+
+# Rows per upsert statement; six parameters each stays under SQLite's limit
+UPSERT_BATCH_SIZE = 150
+
+# Session data naming the session key a guest cart is stored under. Logging
+# in gives the session a new key but keeps its data, so this is how the
+# merge on login finds the guest's lines.
+GUEST_KEY = 'cart_session_key'
+
+# Guest lines unchanged for longer than this are abandoned; sessions last two
+# weeks by default
+STALE_DAYS = getattr(settings, 'CART_STALE_DAYS', 30)
+PURGE_BATCH_SIZE = 500
+
+# Session engines keeping sessions in django_session
+DB_SESSION_ENGINES = {'django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db'}
+
+# Type of quantity * price sums
+PRICE_FIELD = DecimalField(max_digits=12, decimal_places=2)
+CENTS = Decimal('0.01')
+
+
+def owner_filter(user=None, session_key=None):
+    """Lookup kwargs selecting the cart of a user or, failing that, a guest session."""
+    if user is not None:
+        return {'user': user}
+    if session_key:
+        return {'session_key': session_key}
+    raise ValueError('A cart needs a user or a session key')
+
+
+def add(product_id, quantity=1, size='', color='', user=None, session_key=None):
+    """
+    Add ``quantity`` units of a product variant to a database cart.
+
+    Args:
+        product_id: Product to add; the caller has checked that it exists
+        quantity: Units to add to the line, created when missing
+        size, color: Variant of the line ('' when not chosen)
+        user: Owner of the cart, or None for a guest
+        session_key: Session of a guest cart (ignored when ``user`` is given)
+    """
+    add_lines([CartLine(product_id, quantity, size, color)], user=user, session_key=session_key)
+
+
+def add_lines(lines, user=None, session_key=None):
+    """Add several lines (CartLine or Cart objects) to a database cart."""
+    owner = owner_filter(user, session_key)
+    quantities = defaultdict(int)
+    for line in lines:
+        quantities[(line.product_id, line.size, line.color)] += line.quantity
+    if not quantities:
+        return
+
+    if connection.features.supports_update_conflicts_with_target:
+        rows = list(quantities.items())
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            _upsert(owner, rows[start:start + UPSERT_BATCH_SIZE])
+    else:
+        for (product_id, size, color), quantity in quantities.items():
+            _increment_or_create(owner, product_id, quantity, size, color)
+
+
+def _columns(*fields):
+    qn = connection.ops.quote_name
+    return qn(Cart._meta.db_table), {name: qn(Cart._meta.get_field(name).column) for name in fields}
+
+
+def _on_conflict_add(owner_field):
+    """ON CONFLICT clause adding to the quantity of the owner's existing line (and marking it updated)."""
+    table, column = _columns(owner_field, 'product', 'size', 'color', 'quantity', 'updated_at')
+    # The WHERE clause picks the partial unique index the conflict is on
+    return (
+        f'ON CONFLICT ({column[owner_field]}, {column["product"]}, {column["size"]}, {column["color"]}) '
+        f'WHERE {column[owner_field]} IS NOT NULL '
+        f'DO UPDATE SET {column["quantity"]} = {table}.{column["quantity"]} + excluded.{column["quantity"]}, '
+        f'{column["updated_at"]} = excluded.{column["updated_at"]}'
+    )
+
+
+def _upsert(owner, rows):
+    [(owner_field, owner_value)] = owner.items()
+    owner_value = owner_value.pk if owner_field == 'user' else owner_value
+    now = _db_now()
+
+    fields = [owner_field, 'product', 'size', 'color', 'quantity', 'created_at', 'updated_at']
+    table, column = _columns(*fields)
+    placeholders = f'({", ".join(["%s"] * len(fields))})'
+    sql = (
+        f'INSERT INTO {table} ({", ".join(column.values())}) VALUES {", ".join([placeholders] * len(rows))} '
+        + _on_conflict_add(owner_field)
+    )
+    params = []
+    for (product_id, size, color), quantity in rows:
+        params += [owner_value, product_id, size, color, quantity, now, now]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _db_now():
+    return Cart._meta.get_field('updated_at').get_db_prep_value(timezone.now(), connection)
+
+
+def _increment_or_create(owner, product_id, quantity, size, color):
+    lines = Cart.objects.filter(**owner, product_id=product_id, size=size, color=color)
+    if lines.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            Cart.objects.create(**owner, product_id=product_id, quantity=quantity, size=size, color=color)
+    except IntegrityError:
+        # Another request created the line after our update; add to it
+        if not lines.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+            raise
+
+
+def _guest_session_key(session, create=False):
+    """
+    The session's key for a guest cart; None if there is none and ``create`` is false.
+
+    The key is recorded under ``GUEST_KEY`` on reads as well as writes, so
+    lines added before it was recorded (by older code) are merged on login too.
+    """
+    if not session.session_key:
+        if not create:
+            return None
+        session.create()
+    if session.get(GUEST_KEY) != session.session_key:
+        session[GUEST_KEY] = session.session_key
+    return session.session_key
+
+
+class CartSummary:
+    """Totals of a cart: number of lines, units over all lines, and price"""
+    __slots__ = ('lines', 'items', 'total')
+
+    def __init__(self, lines=0, items=0, total=Decimal('0.00')):
+        self.lines = lines
+        self.items = items
+        self.total = total
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Summary of lines already loaded with their products, e.g. from get_lines()."""
+        return cls(
+            len(lines),
+            sum(line.quantity for line in lines),
+            sum((line.total_price for line in lines), Decimal('0.00')),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, CartSummary):
+            return NotImplemented
+        return (self.lines, self.items, self.total) == (other.lines, other.items, other.total)
+
+    def __repr__(self):
+        return f'CartSummary(lines={self.lines}, items={self.items}, total={self.total})'
+
+
+class CartStore:
+    """
+    The cart of one shopper. Lines are identified by (product id, size, color).
+
+    Guest stores are given the request's session and only create a session
+    key when something is written, so browsing never creates sessions.
+    """
+
+    def get_lines(self):
+        """Every line, oldest first, with ``product`` attached; lines of deleted products are left out."""
+        raise NotImplementedError
+
+    def summary(self):
+        """
+        CartSummary of the lines ``get_lines()`` would return, in one query.
+
+        For callers that do not need the lines themselves, e.g. a cart badge;
+        pages showing the lines use CartSummary.from_lines() instead.
+        """
+        raise NotImplementedError
+
+    def add_lines(self, lines):
+        """Add the quantities of ``lines`` to the matching lines, creating missing ones."""
+        raise NotImplementedError
+
+    def set_quantity(self, product_id, quantity, size='', color=''):
+        """Replace the quantity of a line; False if the cart has no such line."""
+        raise NotImplementedError
+
+    def remove(self, product_id, size='', color=''):
+        """Delete a line; False if the cart has no such line."""
+        raise NotImplementedError
+
+    def discard(self, lines):
+        """Delete ``lines`` (from ``get_lines()``), e.g. once they have been ordered."""
+        raise NotImplementedError
+
+    def add(self, product_id, quantity=1, size='', color=''):
+        self.add_lines([CartLine(product_id, quantity, size, color)])
+
+
+class DbCartStore(CartStore):
+    def __init__(self, user=None, session=None):
+        self.user = user
+        self.session = session
+
+    def owner(self, create=False):
+        """owner_filter() kwargs, or None for a guest without a session yet."""
+        if self.user is not None:
+            return {'user': self.user}
+        session_key = _guest_session_key(self.session, create)
+        return {'session_key': session_key} if session_key else None
+
+    def lines(self):
+        owner = self.owner()
+        return Cart.objects.filter(**owner) if owner else Cart.objects.none()
+
+    def get_lines(self):
+        return hydrate(db_lines(self.lines().order_by('created_at', 'pk')))
+
+    def summary(self):
+        owner = self.owner()
+        if owner is None:
+            return CartSummary()
+        # The join on product leaves out lines of deleted products, as get_lines() does
+        totals = Cart.objects.filter(**owner).aggregate(
+            lines=Count('pk'),
+            items=Sum('quantity', default=0),
+            total=Sum(F('quantity') * F('product__price'), output_field=PRICE_FIELD, default=Decimal('0.00')),
+        )
+        # SQLite returns sums of decimals without their trailing zeros
+        return CartSummary(totals['lines'], totals['items'], totals['total'].quantize(CENTS))
+
+    def add_lines(self, lines):
+        add_lines(lines, **self.owner(create=True))
+
+    def set_quantity(self, product_id, quantity, size='', color=''):
+        return bool(self.lines().filter(product_id=product_id, size=size, color=color).update(
+            quantity=quantity, updated_at=timezone.now(),
+        ))
+
+    def remove(self, product_id, size='', color=''):
+        deleted, _ = self.lines().filter(product_id=product_id, size=size, color=color).delete()
+        return bool(deleted)
+
+    def discard(self, lines):
+        self.lines().filter(pk__in=[line.pk for line in lines]).delete()
+
+
+class KeyedCartStore(CartStore):
+    """A cart stored as one compact ``{line key: quantity}`` dict."""
+
+    def load(self):
+        raise NotImplementedError
+
+    def save(self, cart):
+        raise NotImplementedError
+
+    def get_lines(self):
+        return hydrate(keyed_lines(self.load()))
+
+    def summary(self):
+        lines = keyed_lines(self.load())
+        if not lines:
+            return CartSummary()
+        prices = dict(Product.objects.filter(
+            pk__in={line.product_id for line in lines}
+        ).values_list('pk', 'price'))
+        summary = CartSummary()
+        for line in lines:
+            if line.product_id in prices:
+                summary.lines += 1
+                summary.items += line.quantity
+                summary.total += prices[line.product_id] * line.quantity
+        return summary
+
+    def _cart(self):
+        # Normalizes entries in older formats as a side effect
+        return {line.key: line.quantity for line in keyed_lines(self.load())}
+
+    def add_lines(self, lines):
+        cart = self._cart()
+        for line in lines:
+            cart[line.key] = cart.get(line.key, 0) + line.quantity
+        self.save(cart)
+
+    def set_quantity(self, product_id, quantity, size='', color=''):
+        cart = self._cart()
+        key = line_key(product_id, size, color)
+        if key not in cart:
+            return False
+        cart[key] = quantity
+        self.save(cart)
+        return True
+
+    def remove(self, product_id, size='', color=''):
+        cart = self._cart()
+        if cart.pop(line_key(product_id, size, color), None) is None:
+            return False
+        self.save(cart)
+        return True
+
+    def discard(self, lines):
+        cart = self._cart()
+        for line in lines:
+            cart.pop(line.key, None)
+        self.save(cart)
+
+
+class SessionCartStore(KeyedCartStore):
+    def __init__(self, session):
+        self.session = session
+
+    def load(self):
+        return self.session.get('cart', {})
+
+    def save(self, cart):
+        self.session['cart'] = cart
+
+
+class CacheCartStore(KeyedCartStore):
+    """Guest carts in the default cache; signed-in users always get DbCartStore."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def cache_key(self, create=False):
+        session_key = _guest_session_key(self.session, create)
+        return f'cart:session:{session_key}' if session_key else None
+
+    def load(self):
+        key = self.cache_key()
+        return cache.get(key, {}) if key else {}
+
+    def save(self, cart):
+        cache.set(self.cache_key(create=True), cart, CACHE_TIMEOUT)
+
+
+GUEST_STORES = {
+    'db': DbCartStore,
+    'session': SessionCartStore,
+    'cache': CacheCartStore,
+}
+
+
+def for_request(request):
+    """The cart store of the request's shopper."""
+    if request.user.is_authenticated:
+        return DbCartStore(user=request.user)
+
+    store = GUEST_STORES[GUEST_STORE](session=request.session)
+    if not isinstance(store, SessionCartStore) and 'cart' in request.session:
+        # Carried over from when guest carts always lived in the session
+        store.add_lines(hydrate(keyed_lines(request.session.pop('cart'))))
+    return store
+
+
+def _move_db_lines(session_key, user):
+    """Add a guest's Cart rows to the user's cart, then delete them: one upsert and one delete."""
+    guest_lines = Cart.objects.filter(session_key=session_key)
+    with transaction.atomic():
+        if connection.features.supports_update_conflicts_with_target:
+            table, column = _columns('user', 'session_key', 'product', 'size', 'color', 'quantity', 'created_at',
+                                     'updated_at')
+            copied = ', '.join(column[name] for name in ['product', 'size', 'color', 'quantity', 'created_at'])
+            # The guest's lines are unique per variant already, so no row is
+            # updated twice
+            sql = (
+                f'INSERT INTO {table} ({column["user"]}, {copied}, {column["updated_at"]}) '
+                f'SELECT %s, {copied}, %s FROM {table} WHERE {column["session_key"]} = %s '
+                + _on_conflict_add('user')
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [user.pk, _db_now(), session_key])
+        else:
+            add_lines(db_lines(guest_lines), user=user)
+        guest_lines.delete()
+
+
+def merge_guest_cart(session, user, guest_store=None):
+    """
+    Fold the guest cart of ``session`` into ``user``'s cart.
+
+    A variant in both carts ends up with the sum of both quantities. The
+    guest cart is emptied. It is found through the session's ``GUEST_KEY``,
+    since the session key has already changed by the time users log in.
+
+    Args:
+        session: Session of the request that logged in
+        user: User who logged in
+        guest_store: Key of GUEST_STORES guest carts are kept in (default:
+            the CART_GUEST_STORE setting)
+    """
+    guest_store = guest_store or GUEST_STORE
+    guest_key = session.pop(GUEST_KEY, None)
+    lines = keyed_lines(session.pop('cart', {}))
+    if guest_key and guest_store == 'cache':
+        cache_key = f'cart:session:{guest_key}'
+        lines += keyed_lines(cache.get(cache_key, {}))
+        cache.delete(cache_key)
+    elif guest_key:
+        _move_db_lines(guest_key, user)
+
+    if lines:
+        # Lines from the session or cache may name deleted products
+        existing = set(Product.objects.filter(
+            pk__in={line.product_id for line in lines}
+        ).values_list('pk', flat=True))
+        add_lines([line for line in lines if line.product_id in existing], user=user)
+
+
+def logged_in(sender, request, user, **kwargs):
+    """user_logged_in receiver; logins without a request (e.g. in tests) have no guest cart."""
+    if request is not None and hasattr(request, 'session'):
+        merge_guest_cart(request.session, user)
+
+
+def delete_in_batches(queryset, batch_size=PURGE_BATCH_SIZE, pause=0):
+    """
+    Delete the rows of ``queryset``, ``batch_size`` at a time.
+
+    Every batch is its own short DELETE, which re-applies the filters of
+    ``queryset``, so live requests writing to the table wait for one batch
+    at most and a row that stopped matching in between is kept.
+
+    Args:
+        queryset: Rows to delete; the model must have no cascading relations
+        batch_size: Rows deleted per statement
+        pause: Seconds to sleep between batches, leaving room for other writers
+
+    Returns:
+        int: number of rows deleted
+    """
+    deleted, last = 0, None
+    while True:
+        # Walking the primary key keeps rows that are not deleted from being
+        # scanned again by every batch
+        remaining = queryset.order_by('pk') if last is None else queryset.filter(pk__gt=last).order_by('pk')
+        batch = list(remaining.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        last = batch[-1]
+        count, _ = queryset.filter(pk__in=batch).delete()
+        deleted += count
+        if pause and len(batch) == batch_size:
+            time.sleep(pause)
+
+
+def purge_stale(max_age_days=STALE_DAYS, batch_size=PURGE_BATCH_SIZE, pause=0):
+    """
+    Delete expired sessions, guest cart lines nobody can reach any more and
+    lines of deleted products.
+
+    Guest lines are orphaned once their session is gone, and abandoned once
+    last changed more than ``max_age_days`` ago. Sessions and orphans are only
+    looked at when sessions are stored in the database.
+
+    Args:
+        max_age_days: Age at which guest lines are abandoned
+        batch_size: Rows deleted per statement (see delete_in_batches())
+        pause: Seconds to sleep between batches
+
+    Returns:
+        list: ``(what, rows deleted, seconds taken)`` per kind of row
+    """
+    now = timezone.now()
+    guest_lines = Cart.objects.filter(user__isnull=True)
+    steps = []
+    if settings.SESSION_ENGINE in DB_SESSION_ENGINES:
+        steps += [
+            ('expired sessions', Session.objects.filter(expire_date__lt=now)),
+            ('orphaned guest lines', guest_lines.filter(
+                ~Exists(Session.objects.filter(session_key=OuterRef('session_key')))
+            )),
+        ]
+    steps += [
+        ('abandoned guest lines', guest_lines.filter(updated_at__lt=now - timedelta(days=max_age_days))),
+        ('lines of deleted products', Cart.objects.filter(
+            ~Exists(Product.objects.filter(pk=OuterRef('product_id')))
+        )),
+    ]
+
+    results = []
+    for what, queryset in steps:
+        started = time.perf_counter()
+        deleted = delete_in_batches(queryset, batch_size, pause)
+        results.append((what, deleted, time.perf_counter() - started))
+    return results
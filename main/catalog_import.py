@@ -0,0 +1,274 @@
+"""
+Streaming upsert of supplier catalog feeds (``manage.py import_catalog``).
+
+A feed is CSV (with a header row) or JSON Lines, one variant per row:
+
+    sku, product, category, color, size, stock[, price][, description]
+
+``product`` is the product name and ``category`` a category slug; together
+they identify the product, which is created when missing (``price`` is then
+required). ``color`` and ``size`` accept the values or the labels of
+ProductVariant.COLOR_CHOICES / SIZE_CHOICES ("navy" or "Navy Blue", "9" or
+"UK 9").
+
+Rows are read lazily and written in fixed-size batches, each in its own
+transaction, so memory does not grow with the file. Variants are upserted on
+``sku``; a row that is invalid, or whose product/color/size already belongs
+to a different SKU, is reported and skipped without failing its batch.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from . import facets, page_cache, variant_matrix
+from .models import Category, Product, ProductVariant
+
+
+BATCH_SIZE = 1000
+
+REQUIRED = ['sku', 'product', 'category', 'color', 'size', 'stock']
+
+
+def _choice_lookup(choices):
+    lookup = {}
+    for value, label in choices:
+        lookup[value.lower()] = value
+        lookup[label.lower()] = value
+    return lookup
+
+
+COLORS = _choice_lookup(ProductVariant.COLOR_CHOICES)
+SIZES = _choice_lookup(ProductVariant.SIZE_CHOICES)
+
+
+class RowError(ValueError):
+    """A feed row that cannot be imported"""
+
+
+def read_rows(file, fmt):
+    """
+    Yield (line number, row dict) from an open text file.
+
+    Args:
+        file: Text file object, read lazily
+        fmt: 'csv' or 'jsonl'
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_num, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, RowError(f'invalid JSON: {e}')
+                continue
+            yield line_num, row if isinstance(row, dict) else RowError('not a JSON object')
+    else:
+        raise ValueError(f'Unknown feed format: {fmt}')
+
+
+def clean_row(row):
+    """Validate one feed row and return it normalized."""
+    if isinstance(row, RowError):
+        raise row
+    missing = [field for field in REQUIRED if row.get(field) is None or str(row[field]).strip() == '']
+    if missing:
+        raise RowError(f'missing {", ".join(missing)}')
+
+    color = COLORS.get(str(row['color']).strip().lower())
+    if color is None:
+        raise RowError(f'unknown color {row["color"]!r}')
+    size = SIZES.get(str(row['size']).strip().lower())
+    if size is None:
+        raise RowError(f'unknown size {row["size"]!r}')
+    try:
+        stock = int(row['stock'])
+    except (TypeError, ValueError):
+        raise RowError(f'invalid stock {row["stock"]!r}')
+    if stock < 0:
+        raise RowError('negative stock')
+
+    price = row.get('price')
+    if price not in (None, ''):
+        try:
+            price = Decimal(str(price)).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f'invalid price {row["price"]!r}')
+    else:
+        price = None
+
+    return {
+        'sku': str(row['sku']).strip(),
+        'product': str(row['product']).strip(),
+        'category': str(row['category']).strip(),
+        'color': color,
+        'size': size,
+        'stock': stock,
+        'price': price,
+        'description': row.get('description') or '',
+    }
+
+
+class Importer:
+    """
+    Upserts batches of feed rows and keeps the counts.
+
+    Categories seen so far are remembered (there are few of them); nothing
+    else is kept between batches.
+    """
+
+    # Error rows kept in memory; the rest are only counted (and written to
+    # ``error_file`` when there is one)
+    MAX_ERRORS_KEPT = 100
+
+    def __init__(self, batch_size=BATCH_SIZE, error_file=None):
+        self.batch_size = batch_size
+        self.error_writer = csv.writer(error_file) if error_file else None
+        self.categories = {}
+        self.rows = self.created = self.updated = self.products_created = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line_num, message):
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS_KEPT:
+            self.errors.append((line_num, message))
+        if self.error_writer:
+            self.error_writer.writerow([line_num, message])
+
+    def run(self, rows):
+        """Import (line number, row) pairs, e.g. from ``read_rows()``."""
+        batch = []
+        for line_num, row in rows:
+            self.rows += 1
+            try:
+                batch.append((line_num, clean_row(row)))
+            except RowError as e:
+                self.error(line_num, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+
+    def _category_ids(self, slugs):
+        unknown = set(slugs) - set(self.categories)
+        if unknown:
+            for slug, pk in Category.objects.filter(slug__in=unknown).values_list('slug', 'id'):
+                self.categories[slug] = pk
+            for slug in unknown:
+                self.categories.setdefault(slug, None)
+        return self.categories
+
+    def import_batch(self, batch):
+        categories = self._category_ids({row['category'] for _, row in batch})
+
+        # Later rows win when a SKU repeats within the batch
+        rows = {}
+        for line_num, row in batch:
+            if categories[row['category']] is None:
+                self.error(line_num, f'unknown category {row["category"]!r}')
+            else:
+                rows[row['sku']] = (line_num, row)
+
+        with transaction.atomic():
+            products = self._upsert_products(rows)
+            variants = {}
+            for sku, (line_num, row) in list(rows.items()):
+                product_id = products.get((categories[row['category']], row['product']))
+                if product_id is None:
+                    self.error(line_num, 'new product without a price')
+                    del rows[sku]
+                    continue
+                variants[sku] = ProductVariant(
+                    product_id=product_id, color=row['color'], size=row['size'],
+                    stock=row['stock'], sku=sku,
+                )
+            self._upsert_variants(rows, variants)
+
+            product_ids = {variant.product_id for variant in variants.values()}
+            # Bulk writes skip the signals that keep these current
+            facets.refresh(product_ids)
+            transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+            slugs = {row['category'] for _, row in rows.values()}
+            transaction.on_commit(lambda: page_cache.invalidate(*[f'category:{slug}' for slug in slugs]))
+
+    def _upsert_products(self, rows):
+        """Create missing products and update changed prices; return {(category_id, name): id}."""
+        wanted = {}
+        for _, row in rows.values():
+            key = (self.categories[row['category']], row['product'])
+            wanted.setdefault(key, row)
+            if row['price'] is not None:
+                wanted[key] = row
+
+        products = {}
+        changed = []
+        for product in Product.objects.filter(
+            category_id__in={category_id for category_id, _ in wanted},
+            name__in={name for _, name in wanted},
+        ).only('id', 'category_id', 'name', 'price', 'description'):
+            key = (product.category_id, product.name)
+            if key not in wanted or key in products:
+                continue
+            products[key] = product.pk
+            row = wanted[key]
+            if row['price'] is not None and product.price != row['price']:
+                product.price = row['price']
+                changed.append(product)
+            if row['description'] and product.description != row['description']:
+                product.description = row['description']
+                changed.append(product)
+        if changed:
+            Product.objects.bulk_update(set(changed), ['price', 'description'])
+
+        new = [
+            Product(category_id=category_id, name=name, price=row['price'], description=row['description'])
+            for (category_id, name), row in wanted.items()
+            if (category_id, name) not in products and row['price'] is not None
+        ]
+        if new:
+            Product.objects.bulk_create(new)
+            self.products_created += len(new)
+            for product in Product.objects.filter(
+                category_id__in={p.category_id for p in new}, name__in={p.name for p in new},
+            ).values_list('id', 'category_id', 'name'):
+                products.setdefault((product[1], product[2]), product[0])
+        return products
+
+    def _upsert_variants(self, rows, variants):
+        # (product, color, size) is unique too: a row may not take over a
+        # combination that another SKU already holds
+        owners = {
+            (product_id, color, size): sku
+            for product_id, color, size, sku in ProductVariant.objects.filter(
+                product_id__in={variant.product_id for variant in variants.values()}
+            ).values_list('product_id', 'color', 'size', 'sku')
+        }
+        existing = set(ProductVariant.objects.filter(sku__in=list(variants)).values_list('sku', flat=True))
+
+        claimed = {}
+        for sku, variant in list(variants.items()):
+            key = (variant.product_id, variant.color, variant.size)
+            owner = claimed.get(key) or owners.get(key)
+            if owner not in (None, sku):
+                self.error(rows[sku][0], f'{variant.color}/{variant.size} already has SKU {owner}')
+                del variants[sku]
+                continue
+            claimed[key] = sku
+
+        ProductVariant.objects.bulk_create(
+            list(variants.values()),
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=['product', 'color', 'size', 'stock'],
+        )
+        self.updated += len(existing & set(variants))
+        self.created += len(set(variants) - existing)
@@ -1,13 +1,127 @@
 """
 Email utility functions for sending various notification emails.
+
+Emails are not sent during the request. They are written to the EmailOutbox
+table and delivered by the ``send_queued_emails`` management command, so a
+slow SMTP server can never hold up checkout or signup.
 """
-from django.core.mail import EmailMessage
+from datetime import timedelta
+import uuid
+
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
 from django.template.loader import render_to_string
 from django.conf import settings
+from django.utils import timezone
 import logging
 
+from .models import EmailOutbox
+
 logger = logging.getLogger(__name__)
 
+OUTBOX_BATCH_SIZE = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+OUTBOX_RETRY_SECONDS = getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60)
+
+# A message left in 'sending' longer than this belongs to a worker that died
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def queue_email(subject, html_message, to):
+    """
+    Store an HTML email in the outbox for the background worker.
+    
+    Args:
+        subject: Email subject
+        html_message: Rendered HTML body
+        to: List of recipient addresses
+        
+    Returns:
+        EmailOutbox: the queued message
+    """
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=html_message,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=','.join(to),
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff: 1, 2, 4, ... retry periods, capped at one day."""
+    return timedelta(seconds=min(OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1), 24 * 60 * 60))
+
+
+def _claim_batch(batch_size):
+    """Mark up to ``batch_size`` due messages as ours and return them."""
+    now = timezone.now()
+    due = EmailOutbox.objects.filter(
+        Q(status='pending', next_attempt_at__lte=now)
+        | Q(status='sending', claimed_at__lte=now - OUTBOX_CLAIM_TIMEOUT)
+    )
+    ids = list(due.order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    
+    token = uuid.uuid4().hex
+    due.filter(pk__in=ids).update(status='sending', claim_token=token, claimed_at=now)
+    return list(EmailOutbox.objects.filter(claim_token=token))
+
+
+def deliver_queued_emails(batch_size=OUTBOX_BATCH_SIZE):
+    """
+    Send one batch of queued emails over a single SMTP connection.
+    
+    Failed messages are retried with exponential backoff until they reach
+    EMAIL_OUTBOX_MAX_ATTEMPTS, after which they are marked as failed.
+    
+    Returns:
+        tuple: (sent, failed) message counts for this batch
+    """
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+    
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        for item in batch:
+            email = EmailMessage(
+                subject=item.subject,
+                body=item.body,
+                from_email=item.from_email,
+                to=item.recipients,
+                connection=connection,
+            )
+            email.content_subtype = item.content_subtype
+            
+            try:
+                email.send()
+            except Exception as e:
+                # The connection may be unusable after an SMTP error; reopen for the next one
+                connection.close()
+                item.attempts += 1
+                item.last_error = str(e)
+                if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    item.status = 'failed'
+                else:
+                    item.status = 'pending'
+                    item.next_attempt_at = timezone.now() + retry_delay(item.attempts)
+                failed += 1
+                logger.error(f'Failed to send "{item.subject}" to {item.to} (attempt {item.attempts}): {str(e)}')
+            else:
+                item.status = 'sent'
+                item.sent_at = timezone.now()
+                sent += 1
+            item.claim_token = ''
+    finally:
+        connection.close()
+    
+    EmailOutbox.objects.bulk_update(
+        batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'claim_token', 'sent_at']
+    )
+    return sent, failed
+
 
 def send_welcome_email(user):
     """
@@ -17,7 +131,7 @@ def send_welcome_email(user):
         user: User object
         
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if email queued successfully, False otherwise
     """
     try:
         subject = 'Welcome to Footwear Store!'
@@ -26,20 +140,13 @@ def send_welcome_email(user):
             'user': user,
         })
         
-        email = EmailMessage(
-            subject=subject,
-            body=html_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[user.email],
-        )
-        email.content_subtype = 'html'
-        email.send()
+        queue_email(subject, html_message, [user.email])
         
-        logger.info(f'Welcome email sent to {user.email}')
+        logger.info(f'Welcome email queued for {user.email}')
         return True
         
     except Exception as e:
-        logger.error(f'Failed to send welcome email to {user.email}: {str(e)}')
+        logger.error(f'Failed to queue welcome email to {user.email}: {str(e)}')
         return False
 
 
@@ -51,7 +158,7 @@ def send_order_confirmation_email(order):
         order: Order object
         
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if email queued successfully, False otherwise
     """
     try:
         subject = f'Order Confirmation - {order.order_number}'
@@ -60,20 +167,13 @@ def send_order_confirmation_email(order):
             'order': order,
         })
         
-        email = EmailMessage(
-            subject=subject,
-            body=html_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[order.email],
-        )
-        email.content_subtype = 'html'
-        email.send()
+        queue_email(subject, html_message, [order.email])
         
-        logger.info(f'Order confirmation sent for order {order.order_number} to {order.email}')
+        logger.info(f'Order confirmation queued for order {order.order_number} to {order.email}')
         return True
         
     except Exception as e:
-        logger.error(f'Failed to send order confirmation for {order.order_number}: {str(e)}')
+        logger.error(f'Failed to queue order confirmation for {order.order_number}: {str(e)}')
         return False
 
 
@@ -86,7 +186,7 @@ def send_order_status_email(order, new_status):
         new_status: New status of the order
         
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if email queued successfully, False otherwise
     """
     try:
         status_display = dict(order.ORDER_STATUS).get(new_status, new_status).title()
@@ -96,20 +196,13 @@ def send_order_status_email(order, new_status):
             'order': order,
         })
         
-        email = EmailMessage(
-            subject=subject,
-            body=html_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[order.email],
-        )
-        email.content_subtype = 'html'
-        email.send()
+        queue_email(subject, html_message, [order.email])
         
-        logger.info(f'Status update email sent for order {order.order_number} to {order.email}')
+        logger.info(f'Status update email queued for order {order.order_number} to {order.email}')
         return True
         
     except Exception as e:
-        logger.error(f'Failed to send status update for {order.order_number}: {str(e)}')
+        logger.error(f'Failed to queue status update for {order.order_number}: {str(e)}')
         return False
 
 
@@ -122,7 +215,7 @@ def send_password_reset_email(user, reset_link):
         reset_link: Password reset link URL
         
     Returns:
-        bool: True if email sent successfully, False otherwise
+        bool: True if email queued successfully, False otherwise
     """
     try:
         subject = 'Password Reset Request - Footwear Store'
@@ -132,18 +225,11 @@ def send_password_reset_email(user, reset_link):
             'reset_link': reset_link,
         })
         
-        email = EmailMessage(
-            subject=subject,
-            body=html_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            to=[user.email],
-        )
-        email.content_subtype = 'html'
-        email.send()
+        queue_email(subject, html_message, [user.email])
         
-        logger.info(f'Password reset email sent to {user.email}')
+        logger.info(f'Password reset email queued for {user.email}')
         return True
         
     except Exception as e:
-        logger.error(f'Failed to send password reset email to {user.email}: {str(e)}')
+        logger.error(f'Failed to queue password reset email to {user.email}: {str(e)}')
         return False
@@ -0,0 +1,241 @@
+"""
+Facet counts (size, color, category, price range) for product listings.
+
+Each product has one ProductFacet row holding its category, price bucket and
+bitmasks of the sizes and colors it has in stock. Counting a facet value is
+then a bit test while scanning that small table, so every count for a
+listing comes from one aggregate query plus one GROUP BY for categories,
+however many sizes and colors there are.
+
+Rows are refreshed when a product or variant is saved or deleted, and by
+checkout when it sells the last unit of a variant. Bulk writes that skip
+signals should call ``refresh()`` or run ``manage.py rebuild_facets``.
+
+Counts are disjunctive: the counts for one facet apply every selected
+filter except that facet's own, so selecting "UK 9" still shows how many
+products the other sizes would add.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Product, ProductFacet, ProductVariant
+
+
+SIZES = [value for value, _ in ProductVariant.SIZE_CHOICES]
+COLORS = [value for value, _ in ProductVariant.COLOR_CHOICES]
+
+# (lower, upper) bounds of each price bucket, lower inclusive
+PRICE_BUCKETS = [(None, 50), (50, 100), (100, 150), (150, None)]
+
+BATCH_SIZE = 500
+
+
+def bits(values, choices):
+    """Bitmask with bit i set for each of ``values`` found at choices[i]."""
+    mask = 0
+    for value in values:
+        if value in choices:
+            mask |= 1 << choices.index(value)
+    return mask
+
+
+def price_bucket(price):
+    for index, (lower, upper) in enumerate(PRICE_BUCKETS):
+        if upper is None or price < upper:
+            return index
+    return len(PRICE_BUCKETS) - 1
+
+
+def refresh(product_ids):
+    """
+    Recompute the facet rows of the given products.
+
+    Uses two reads and one upsert per batch of products; products that no
+    longer exist are skipped (their row was cascade-deleted with them).
+    """
+    product_ids = list(set(product_ids))
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        _refresh_batch(product_ids[start:start + BATCH_SIZE])
+
+
+def _refresh_batch(product_ids):
+    in_stock = defaultdict(lambda: (set(), set()))
+    variants = ProductVariant.objects.filter(product_id__in=product_ids, stock__gt=0)
+    for product_id, size, color in variants.values_list('product_id', 'size', 'color'):
+        sizes, colors = in_stock[product_id]
+        sizes.add(size)
+        colors.add(color)
+
+    rows = []
+    for pk, category_id, price in Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'category_id', 'price'
+    ):
+        sizes, colors = in_stock.get(pk, ((), ()))
+        rows.append(ProductFacet(
+            product_id=pk,
+            category_id=category_id,
+            price=price,
+            price_bucket=price_bucket(price),
+            size_mask=bits(sizes, SIZES),
+            color_mask=bits(colors, COLORS),
+        ))
+
+    ProductFacet.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['category', 'price', 'price_bucket', 'size_mask', 'color_mask'],
+    )
+
+
+def refresh_sold_out(variant_ids):
+    """Refresh products where any of ``variant_ids`` has just run out of stock."""
+    refresh(ProductVariant.objects.filter(pk__in=variant_ids, stock=0).values_list('product_id', flat=True))
+
+
+def rebuild():
+    """Recompute every facet row and return how many products were indexed."""
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    refresh(product_ids)
+    return len(product_ids)
+
+
+def product_changed(sender, instance, raw=False, **kwargs):
+    """post_save / post_delete receiver for Product, ProductVariant"""
+    if raw:
+        return
+    product_id = instance.pk if sender is Product else instance.product_id
+    # Deferred so a product deleted together with its variants is gone by then
+    transaction.on_commit(lambda: refresh([product_id]))
+
+
+def _decimal(value):
+    try:
+        return Decimal(value) if value not in (None, '') else None
+    except InvalidOperation:
+        return None
+
+
+class FacetFilters:
+    """The facet selections of one listing request"""
+
+    def __init__(self, category=None, sizes=(), colors=(), min_price=None, max_price=None):
+        self.category = category or None
+        self.sizes = [size for size in sizes if size in SIZES]
+        self.colors = [color for color in colors if color in COLORS]
+        self.min_price = min_price
+        self.max_price = max_price
+
+    @classmethod
+    def from_params(cls, params):
+        """Read selections from request query parameters (a QueryDict)."""
+        return cls(
+            # The parameter ProductListAPIView's filterset filters the listing on
+            category=params.get('category__slug'),
+            sizes=params.getlist('size'),
+            colors=params.getlist('color'),
+            min_price=_decimal(params.get('min_price')),
+            max_price=_decimal(params.get('max_price')),
+        )
+
+    def conditions(self):
+        """Q object per facet, written against annotated ProductFacet rows."""
+        price = Q()
+        if self.min_price is not None:
+            price &= Q(price__gte=self.min_price)
+        if self.max_price is not None:
+            price &= Q(price__lte=self.max_price)
+        return {
+            'category': Q(category__slug=self.category) if self.category else Q(),
+            'size': Q(size_hit__gt=0) if self.sizes else Q(),
+            'color': Q(color_hit__gt=0) if self.colors else Q(),
+            'price': price,
+        }
+
+
+def filter_products(queryset, filters):
+    """Restrict a Product queryset to the selected sizes and colors (in stock)."""
+    if filters.sizes:
+        queryset = queryset.alias(
+            size_hit=F('facet__size_mask').bitand(bits(filters.sizes, SIZES))
+        ).filter(size_hit__gt=0)
+    if filters.colors:
+        queryset = queryset.alias(
+            color_hit=F('facet__color_mask').bitand(bits(filters.colors, COLORS))
+        ).filter(color_hit__gt=0)
+    return queryset
+
+
+def facet_counts(filters, products=None):
+    """
+    Count products per size, color, category and price bucket.
+
+    Args:
+        filters: FacetFilters selected by the shopper
+        products: Optional Product queryset limiting the scope (e.g. search
+            results); facet selections should not be applied to it
+
+    Returns:
+        dict with 'total', 'sizes', 'colors', 'categories' and 'price' lists
+    """
+    rows = ProductFacet.objects.annotate(
+        size_hit=F('size_mask').bitand(bits(filters.sizes, SIZES)),
+        color_hit=F('color_mask').bitand(bits(filters.colors, COLORS)),
+    )
+    if products is not None:
+        rows = rows.filter(product__in=products.values('pk'))
+
+    conditions = filters.conditions()
+
+    def excluding(facet, *extra):
+        combined = Q(*extra)
+        for name, condition in conditions.items():
+            if name != facet:
+                combined &= condition
+        # An empty Q() would compile to an invalid FILTER (WHERE ) clause
+        return combined or None
+
+    aggregates = {'total': Count('pk', filter=excluding(None))}
+    for index in range(len(SIZES)):
+        aggregates[f'size_{index}'] = Sum(
+            F('size_mask').bitrightshift(index).bitand(1), filter=excluding('size')
+        )
+    for index in range(len(COLORS)):
+        aggregates[f'color_{index}'] = Sum(
+            F('color_mask').bitrightshift(index).bitand(1), filter=excluding('color')
+        )
+    for index in range(len(PRICE_BUCKETS)):
+        aggregates[f'price_{index}'] = Count(
+            'pk', filter=excluding('price', Q(price_bucket=index))
+        )
+    counts = rows.aggregate(**aggregates)
+
+    categories = (
+        rows.filter(excluding('category') or Q())
+        .values('category__slug', 'category__name')
+        .annotate(count=Count('pk'))
+        .order_by('category__name')
+    )
+
+    return {
+        'total': counts['total'],
+        'sizes': [
+            {'value': value, 'label': label, 'count': counts[f'size_{index}'] or 0}
+            for index, (value, label) in enumerate(ProductVariant.SIZE_CHOICES)
+        ],
+        'colors': [
+            {'value': value, 'label': label, 'count': counts[f'color_{index}'] or 0}
+            for index, (value, label) in enumerate(ProductVariant.COLOR_CHOICES)
+        ],
+        'categories': [
+            {'slug': row['category__slug'], 'name': row['category__name'], 'count': row['count']}
+            for row in categories
+        ],
+        'price': [
+            {'min': lower, 'max': upper, 'count': counts[f'price_{index}']}
+            for index, (lower, upper) in enumerate(PRICE_BUCKETS)
+        ],
+    }
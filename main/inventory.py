@@ -0,0 +1,226 @@
+"""
+Checkout stock reservations.
+
+When a shopper opens checkout their cart lines are held for a few minutes so
+nobody else can buy the last pair from under them. Held units are counted in
+``ProductVariant.reserved``, which keeps available stock a plain column
+subtraction (``stock - reserved``) instead of a SUM over reservation rows.
+
+Expired holds stop blocking sales as soon as anyone reserves the same variant
+(they are released first), and ``sweep_reservations`` clears the rest. Holds
+outlive the user who placed them (the user becomes NULL), so their units are
+released on expiry too; ``reconcile_reserved()`` (``sweep_reservations
+--reconcile``) repairs counters that drifted anyway.
+"""
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import variant_matrix
+from .models import ProductVariant, StockReservation
+
+
+RESERVATION_MINUTES = getattr(settings, 'STOCK_RESERVATION_MINUTES', 15)
+
+
+class OutOfStockError(Exception):
+    """Raised when a cart line asks for more units than the variant has left."""
+
+    def __init__(self, variant, requested):
+        self.variant = variant
+        self.requested = requested
+        super().__init__(
+            f'Only {variant.available_stock} left of {variant} (requested {requested})'
+        )
+
+
+def per_variant(amounts):
+    """Build a CASE expression mapping variant pk -> amount for a bulk UPDATE."""
+    return Case(
+        *[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+        output_field=IntegerField(),
+    )
+
+
+class Shortage(Exception):
+    """
+    Raised inside a transaction when a guarded stock UPDATE matched fewer
+    rows than expected, to roll it back before reporting which variant ran out.
+    """
+
+    def __init__(self, requested):
+        self.requested = requested
+        super().__init__(requested)
+
+
+def raise_for_shortage(requested):
+    """
+    Raise OutOfStockError for the variant that could not cover its request.
+
+    Must be called after the failed transaction has been rolled back, so
+    the stock figures read here are the ones the UPDATE was checked against.
+    """
+    variants = ProductVariant.objects.select_related('product').filter(pk__in=requested)
+    variant = min(variants, key=lambda v: v.available_stock - requested[v.pk])
+    raise OutOfStockError(variant, requested[variant.pk])
+
+
+def variant_quantities(lines):
+    """
+    Return {variant pk: quantity} for the given cart lines in one query.
+
+    Several cart lines can point at the same variant, so quantities are summed.
+    Lines for products without a matching variant are not stock tracked.
+    """
+    requested = defaultdict(int)
+    for line in lines:
+        requested[(line.product_id, line.color, line.size)] += line.quantity
+    if not requested:
+        return {}
+
+    # Filtering on product ids keeps the SQL short; a long OR of
+    # (product, color, size) triples is much slower to plan on SQLite.
+    variants = ProductVariant.objects.filter(
+        product_id__in={product_id for product_id, _, _ in requested}
+    ).values_list('pk', 'product_id', 'color', 'size')
+
+    return {
+        pk: requested[(product_id, color, size)]
+        for pk, product_id, color, size in variants
+        if (product_id, color, size) in requested
+    }
+
+
+def _holder_filter(user=None, session_key=None):
+    if user is not None:
+        return {'user': user}
+    return {'session_key': session_key}
+
+
+def _release(queryset):
+    """
+    Release the holds in ``queryset`` and return how many units were freed.
+
+    Rows are first claimed with a random token, so when a sweeper and a
+    checkout race for the same expired hold only one of them gives the
+    units back.
+    """
+    token = uuid.uuid4().hex
+
+    with transaction.atomic():
+        if not queryset.filter(claim_token='').update(claim_token=token):
+            return 0
+
+        claimed = StockReservation.objects.filter(claim_token=token)
+        released, product_ids = {}, set()
+        for variant_id, product_id, total in claimed.order_by().values_list(
+            'variant_id', 'variant__product_id'
+        ).annotate(total=Sum('quantity')):
+            released[variant_id] = total
+            product_ids.add(product_id)
+        amount = per_variant(released)
+        ProductVariant.objects.filter(pk__in=released).update(reserved=F('reserved') - amount)
+        claimed.delete()
+        transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+
+    return sum(released.values())
+
+
+def release_expired(variant_ids=None, batch_size=500):
+    """
+    Release expired holds in batches of ``batch_size`` rows.
+
+    Args:
+        variant_ids: Only look at these variants (default: all)
+        batch_size: Rows released per transaction
+
+    Returns:
+        int: number of units given back to stock
+    """
+    expired = StockReservation.objects.filter(expires_at__lte=timezone.now(), claim_token='')
+    if variant_ids is not None:
+        expired = expired.filter(variant_id__in=variant_ids)
+
+    total = 0
+    while True:
+        batch = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return total
+        total += _release(StockReservation.objects.filter(pk__in=batch))
+
+
+def reconcile_reserved():
+    """
+    Reset ``ProductVariant.reserved`` to the units held by existing reservations.
+
+    For repairing counters after an outage or a bug; a hold placed or
+    released while this runs can be counted wrongly, so run it when
+    checkout is quiet.
+
+    Returns:
+        int: number of variants whose counter was wrong
+    """
+    held = StockReservation.objects.filter(variant=OuterRef('pk')).order_by().values('variant').annotate(
+        total=Sum('quantity'),
+    ).values('total')
+    expected = Coalesce(Subquery(held), Value(0))
+    with transaction.atomic():
+        drifted = ProductVariant.objects.annotate(expected=expected).exclude(reserved=F('expected'))
+        product_ids = set(drifted.values_list('product_id', flat=True))
+        fixed = ProductVariant.objects.filter(pk__in=drifted.values('pk')).update(reserved=expected)
+        transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+    return fixed
+
+
+def release_holds(user=None, session_key=None):
+    """Release every hold placed by a user or guest session."""
+    if user is None and not session_key:
+        return 0
+    return _release(StockReservation.objects.filter(**_holder_filter(user, session_key)))
+
+
+def reserve_cart(cart_items, user=None, session_key=None):
+    """
+    Hold stock for every cart line, replacing the holder's previous holds.
+
+    Calling this again (e.g. on a checkout page reload) extends the hold.
+
+    Raises:
+        OutOfStockError: if a variant cannot cover its line. No holds are
+            placed in that case.
+    """
+    try:
+        with transaction.atomic():
+            release_holds(user, session_key)
+
+            wanted = variant_quantities(cart_items)
+            if not wanted:
+                return []
+
+            release_expired(variant_ids=list(wanted))
+
+            amount = per_variant(wanted)
+            updated = ProductVariant.objects.filter(
+                pk__in=wanted, stock__gte=F('reserved') + amount
+            ).update(reserved=F('reserved') + amount)
+
+            if updated != len(wanted):
+                raise Shortage(wanted)
+
+            product_ids = {line.product_id for line in cart_items}
+            transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+
+            expires_at = timezone.now() + timedelta(minutes=RESERVATION_MINUTES)
+            return StockReservation.objects.bulk_create([
+                StockReservation(variant_id=pk, quantity=quantity, expires_at=expires_at,
+                                 **_holder_filter(user, session_key))
+                for pk, quantity in wanted.items()
+            ])
+    except Shortage as e:
+        raise_for_shortage(e.requested)
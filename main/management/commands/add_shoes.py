@@ -1,14 +1,123 @@
-from django.core.management.base import BaseCommand
+import io
+import time
+
 from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image, ImageDraw
+from main import facets, page_cache, renditions
 from main.models import Category, Product
-import io
-from PIL import Image
+
+
+BATCH_SIZE = 1000
+
+# The 10 shoes of the catalog; --scale N loads N numbered copies of each
+SHOES = [
+    {
+        'name': 'Classic Leather Sneakers',
+        'description': 'Premium leather sneakers with comfortable cushioning. Perfect for casual wear and everyday activities. Features breathable lining and durable rubber sole.',
+        'price': 89.99,
+        'rating': 4.5,
+        'featured': True,
+    },
+    {
+        'name': 'Running Sports Shoes',
+        'description': 'Lightweight running shoes designed for maximum performance. Advanced cushioning technology and breathable mesh upper for optimal comfort during workouts.',
+        'price': 129.99,
+        'rating': 4.7,
+        'featured': True,
+    },
+    {
+        'name': 'Formal Oxford Shoes',
+        'description': 'Elegant Oxford shoes crafted from genuine leather. Perfect for business meetings and formal occasions. Classic design with modern comfort.',
+        'price': 149.99,
+        'rating': 4.6,
+        'featured': False,
+    },
+    {
+        'name': 'Casual Canvas Slip-Ons',
+        'description': 'Comfortable canvas slip-on shoes for everyday wear. Easy to put on and take off. Available in multiple colors with cushioned insole.',
+        'price': 49.99,
+        'rating': 4.3,
+        'featured': False,
+    },
+    {
+        'name': 'High-Top Basketball Shoes',
+        'description': 'Professional basketball shoes with ankle support and superior grip. Designed for court performance with responsive cushioning and durable construction.',
+        'price': 159.99,
+        'rating': 4.8,
+        'featured': True,
+    },
+    {
+        'name': 'Hiking Boots',
+        'description': 'Waterproof hiking boots built for outdoor adventures. Rugged construction with excellent traction and ankle support. Perfect for trails and rough terrain.',
+        'price': 179.99,
+        'rating': 4.7,
+        'featured': False,
+    },
+    {
+        'name': 'Stylish Loafers',
+        'description': 'Sophisticated leather loafers for smart-casual occasions. Slip-on design with premium craftsmanship. Versatile style that pairs well with any outfit.',
+        'price': 99.99,
+        'rating': 4.4,
+        'featured': False,
+    },
+    {
+        'name': 'Training Cross-Trainers',
+        'description': 'Versatile cross-training shoes for gym workouts. Stable platform for weightlifting with flexibility for cardio. Breathable and supportive design.',
+        'price': 119.99,
+        'rating': 4.6,
+        'featured': True,
+    },
+    {
+        'name': 'Chelsea Boots',
+        'description': 'Classic Chelsea boots with elastic side panels. Premium suede or leather construction. Perfect for both casual and semi-formal wear.',
+        'price': 139.99,
+        'rating': 4.5,
+        'featured': False,
+    },
+    {
+        'name': 'Minimalist Walking Shoes',
+        'description': 'Lightweight walking shoes with minimalist design. Flexible sole promotes natural foot movement. Ideal for daily walks and light activities.',
+        'price': 79.99,
+        'rating': 4.4,
+        'featured': False,
+    },
+]
+
+
+def image_name(shoe):
+    return f"products/{shoe['name'].lower().replace(' ', '_')}.png"
+
+
+def placeholder_image(text):
+    """800x800 grey PNG with the product name in the middle."""
+    img = Image.new('RGB', (800, 800), color=(200, 200, 200))
+    draw = ImageDraw.Draw(img)
+    bbox = draw.textbbox((0, 0), text)
+    position = ((800 - (bbox[2] - bbox[0])) // 2, (800 - (bbox[3] - bbox[1])) // 2)
+    draw.text(position, text, fill=(50, 50, 50))
+
+    img_io = io.BytesIO()
+    img.save(img_io, format='PNG')
+    return img_io.getvalue()
+
+
+def copy_name(shoe, copy):
+    return shoe['name'] if copy == 0 else f"{shoe['name']} #{copy + 1}"
 
 
 class Command(BaseCommand):
-    help = 'Add 10 shoe products to the database'
+    help = 'Add the 10 shoe products (or --scale N copies of them) to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1,
+                            help='Copies of the catalog to load (default: 1, i.e. 10 products)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
 
-    def handle(self, *args, **kwargs):
         # Create or get Shoes category
         shoes_category, created = Category.objects.get_or_create(
             slug='shoes',
@@ -20,127 +129,50 @@ class Command(BaseCommand):
         else:
             self.stdout.write(self.style.WARNING('Shoes category already exists'))
 
-        # Define 10 shoe products
-        shoes_data = [
-            {
-                'name': 'Classic Leather Sneakers',
-                'description': 'Premium leather sneakers with comfortable cushioning. Perfect for casual wear and everyday activities. Features breathable lining and durable rubber sole.',
-                'price': 89.99,
-                'rating': 4.5,
-                'featured': True,
-            },
-            {
-                'name': 'Running Sports Shoes',
-                'description': 'Lightweight running shoes designed for maximum performance. Advanced cushioning technology and breathable mesh upper for optimal comfort during workouts.',
-                'price': 129.99,
-                'rating': 4.7,
-                'featured': True,
-            },
-            {
-                'name': 'Formal Oxford Shoes',
-                'description': 'Elegant Oxford shoes crafted from genuine leather. Perfect for business meetings and formal occasions. Classic design with modern comfort.',
-                'price': 149.99,
-                'rating': 4.6,
-                'featured': False,
-            },
-            {
-                'name': 'Casual Canvas Slip-Ons',
-                'description': 'Comfortable canvas slip-on shoes for everyday wear. Easy to put on and take off. Available in multiple colors with cushioned insole.',
-                'price': 49.99,
-                'rating': 4.3,
-                'featured': False,
-            },
-            {
-                'name': 'High-Top Basketball Shoes',
-                'description': 'Professional basketball shoes with ankle support and superior grip. Designed for court performance with responsive cushioning and durable construction.',
-                'price': 159.99,
-                'rating': 4.8,
-                'featured': True,
-            },
-            {
-                'name': 'Hiking Boots',
-                'description': 'Waterproof hiking boots built for outdoor adventures. Rugged construction with excellent traction and ankle support. Perfect for trails and rough terrain.',
-                'price': 179.99,
-                'rating': 4.7,
-                'featured': False,
-            },
-            {
-                'name': 'Stylish Loafers',
-                'description': 'Sophisticated leather loafers for smart-casual occasions. Slip-on design with premium craftsmanship. Versatile style that pairs well with any outfit.',
-                'price': 99.99,
-                'rating': 4.4,
-                'featured': False,
-            },
-            {
-                'name': 'Training Cross-Trainers',
-                'description': 'Versatile cross-training shoes for gym workouts. Stable platform for weightlifting with flexibility for cardio. Breathable and supportive design.',
-                'price': 119.99,
-                'rating': 4.6,
-                'featured': True,
-            },
-            {
-                'name': 'Chelsea Boots',
-                'description': 'Classic Chelsea boots with elastic side panels. Premium suede or leather construction. Perfect for both casual and semi-formal wear.',
-                'price': 139.99,
-                'rating': 4.5,
-                'featured': False,
-            },
-            {
-                'name': 'Minimalist Walking Shoes',
-                'description': 'Lightweight walking shoes with minimalist design. Flexible sole promotes natural foot movement. Ideal for daily walks and light activities.',
-                'price': 79.99,
-                'rating': 4.4,
-                'featured': False,
-            },
-        ]
-
-        # Create products
+        # Copies share their shoe's image, so at most 10 files are written
+        images_written = 0
+        for shoe in SHOES:
+            name = image_name(shoe)
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(placeholder_image(shoe['name'])))
+                renditions.generate(name)
+                images_written += 1
+
+        # Product names are the natural key: existing ones are skipped, so
+        # re-running (or raising --scale) only adds what is missing
+        wanted = [(copy_name(shoe, copy), shoe) for copy in range(options['scale']) for shoe in SHOES]
         created_count = 0
-        for shoe_data in shoes_data:
-            # Check if product already exists
-            if not Product.objects.filter(name=shoe_data['name']).exists():
-                # Create a simple placeholder image
-                img = Image.new('RGB', (800, 800), color=(200, 200, 200))
-                
-                # Add text to image (product name)
-                from PIL import ImageDraw, ImageFont
-                draw = ImageDraw.Draw(img)
-                
-                # Use default font
-                text = shoe_data['name']
-                # Draw text in center
-                bbox = draw.textbbox((0, 0), text)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                position = ((800 - text_width) // 2, (800 - text_height) // 2)
-                draw.text(position, text, fill=(50, 50, 50))
-                
-                # Save image to bytes
-                img_io = io.BytesIO()
-                img.save(img_io, format='PNG')
-                img_io.seek(0)
-                
-                # Create product
-                product = Product.objects.create(
-                    name=shoe_data['name'],
-                    description=shoe_data['description'],
-                    price=shoe_data['price'],
-                    category=shoes_category,
-                    rating=shoe_data['rating'],
-                    featured=shoe_data['featured'],
-                )
-                
-                # Save image
-                product.image.save(
-                    f"{shoe_data['name'].lower().replace(' ', '_')}.png",
-                    ContentFile(img_io.getvalue()),
-                    save=True
-                )
-                
-                created_count += 1
-                self.stdout.write(self.style.SUCCESS(f'Created product: {shoe_data["name"]}'))
-            else:
-                self.stdout.write(self.style.WARNING(f'Product already exists: {shoe_data["name"]}'))
-
-        self.stdout.write(self.style.SUCCESS(f'\nSuccessfully created {created_count} shoe products!'))
+        for start in range(0, len(wanted), BATCH_SIZE):
+            batch = dict(wanted[start:start + BATCH_SIZE])
+            with transaction.atomic():
+                existing = set(Product.objects.filter(
+                    category=shoes_category, name__in=list(batch)
+                ).values_list('name', flat=True))
+                new = [
+                    Product(
+                        name=name,
+                        description=shoe['description'],
+                        price=shoe['price'],
+                        category=shoes_category,
+                        rating=shoe['rating'],
+                        featured=shoe['featured'] and name == shoe['name'],
+                        image=image_name(shoe),
+                    )
+                    for name, shoe in batch.items() if name not in existing
+                ]
+                Product.objects.bulk_create(new)
+                # bulk_create skips the signals that keep the facet index current
+                facets.refresh(Product.objects.filter(
+                    category=shoes_category, name__in=[product.name for product in new]
+                ).values_list('pk', flat=True))
+            created_count += len(new)
+
+        if created_count:
+            page_cache.invalidate(f'category:{shoes_category.slug}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'\nSuccessfully created {created_count} shoe products '
+            f'({len(wanted) - created_count} already existed, {images_written} images written) in {elapsed:.2f}s'
+        ))
         self.stdout.write(self.style.SUCCESS(f'Total shoes in database: {Product.objects.filter(category=shoes_category).count()}'))
@@ -0,0 +1,80 @@
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from main import carts
+from main.benchmarking import Timer, rolled_back
+from main.cart_utils import CartLine
+from main.models import Cart, Category, Product
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the cart stores (adds/sec and get_lines() calls/sec) and the guest cart merge on '
+            'login at different cart sizes (changes are rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50],
+                            help='Cart sizes (number of lines) to benchmark')
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Reads and merges per cart size and store')
+
+    def handle(self, *args, **options):
+        max_lines = max(options['lines'])
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+
+        with rolled_back():
+            category = Category.objects.create(name='Bench', slug='bench-cart')
+            products = Product.objects.bulk_create([
+                Product(name=f'Bench Shoe {i}', description='', price='99.99', category=category)
+                for i in range(max_lines)
+            ])
+            user = User.objects.create(username='bench-cart-user')
+
+            stores = {
+                'db (user)': lambda: carts.DbCartStore(user=user),
+                'db (guest)': lambda: carts.DbCartStore(session=session_store()),
+                'session': lambda: carts.SessionCartStore(session_store()),
+                'cache': lambda: carts.CacheCartStore(session=session_store()),
+            }
+            self.stdout.write(f'{"store":<12}{"lines":>6}{"adds/sec":>12}{"reads/sec":>12}{"ms/read":>9}')
+            for name, make_store in stores.items():
+                for line_count in options['lines']:
+                    store = make_store()
+                    adds, reads = Timer(), Timer()
+                    for product in products[:line_count]:
+                        with adds:
+                            store.add(product.pk, 1, '9', 'black')
+                    for _ in range(options['repeat']):
+                        with reads:
+                            lines = store.get_lines()
+                    assert len(lines) == line_count
+                    store.discard(lines)
+
+                    self.stdout.write(
+                        f'{name:<12}{line_count:>6}{adds.per_second:>12.0f}{reads.per_second:>12.0f}'
+                        f'{reads.elapsed / reads.count * 1000:>9.2f}'
+                    )
+
+            # Half of every guest cart overlaps the user's cart
+            self.stdout.write(f'\n{"guest store":<12}{"lines":>6}{"ms/merge":>12}')
+            for guest_store in ['db', 'session', 'cache']:
+                for line_count in options['lines']:
+                    merges = Timer()
+                    for _ in range(options['repeat']):
+                        carts.DbCartStore(user=user).add_lines([
+                            CartLine(product.pk, 1, '9', 'black') for product in products[:line_count // 2]
+                        ])
+                        session = session_store()
+                        carts.GUEST_STORES[guest_store](session=session).add_lines([
+                            CartLine(product.pk, 1, '9', 'black') for product in products[:line_count]
+                        ])
+                        with merges:
+                            carts.merge_guest_cart(session, user, guest_store)
+                        Cart.objects.filter(user=user).delete()
+
+                    self.stdout.write(
+                        f'{guest_store:<12}{line_count:>6}{merges.elapsed / merges.count * 1000:>12.3f}'
+                    )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, all changes rolled back'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from main.benchmarking import Timer, rolled_back
+from main.models import Cart, Category, Product, ProductVariant
+from main.orders import place_order
+
+
+class Command(BaseCommand):
+    help = 'Benchmark orders/sec of the checkout service at different cart sizes (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 50],
+                            help='Cart sizes (number of lines) to benchmark')
+        parser.add_argument('--orders', type=int, default=200,
+                            help='Orders to place per cart size')
+
+    def handle(self, *args, **options):
+        max_lines = max(options['lines'])
+
+        with rolled_back():
+            category = Category.objects.create(name='Bench', slug='bench-checkout')
+            products = Product.objects.bulk_create([
+                Product(name=f'Bench Shoe {i}', description='', price='99.99', category=category)
+                for i in range(max_lines)
+            ])
+            ProductVariant.objects.bulk_create([
+                ProductVariant(product=product, color='black', size='9',
+                               stock=10 ** 9, sku=f'bench-checkout-{product.id}')
+                for product in products
+            ])
+
+            for line_count in options['lines']:
+                timer = Timer()
+                for n in range(options['orders']):
+                    session_key = f'bench-{line_count}-{n}'
+                    Cart.objects.bulk_create([
+                        Cart(session_key=session_key, product=product,
+                             quantity=1, color='black', size='9')
+                        for product in products[:line_count]
+                    ])
+                    cart_items = Cart.objects.filter(session_key=session_key).select_related('product')
+
+                    with timer:
+                        place_order(cart_items, full_name='Bench', email='bench@example.com',
+                                    phone='0', address='-', city='-', state='-', zip_code='0')
+
+                self.stdout.write(
+                    f'{line_count:>4} lines: {timer.per_second:8.1f} orders/sec '
+                    f'({timer.elapsed / timer.count * 1000:.2f} ms/order)'
+                )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished, all changes rolled back'))
@@ -0,0 +1,71 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from main.benchmarking import Timer, rolled_back
+from main.models import Category, Product
+from main.pagination import encode_cursor, keyset_page
+
+
+class Command(BaseCommand):
+    help = 'Compare OFFSET and keyset pagination latency from page 1 to page 1000 (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=15000,
+                            help='Synthetic products to create')
+        parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='Page numbers to measure')
+        parser.add_argument('--page-size', type=int, default=12)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Timed fetches per page')
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        rng = random.Random(42)
+
+        with rolled_back():
+            category = Category.objects.create(name='Bench', slug='bench-pagination')
+            now = timezone.now()
+            products = Product.objects.bulk_create([
+                Product(name=f'Bench Shoe {rng.randrange(10 ** 6):06d}', description='',
+                        price=f'{rng.randrange(2000, 20000) / 100:.2f}', category=category)
+                for _ in range(options['products'])
+            ], batch_size=1000)
+            # auto_now_add stamps every row with the same time; spread them out
+            for offset, product in enumerate(products):
+                product.created_at = now - timedelta(seconds=offset // 3)
+            Product.objects.bulk_update(products, ['created_at'], batch_size=1000)
+
+            queryset = Product.objects.all()
+            for ordering in ['-created_at', 'price', 'name']:
+                self.stdout.write(f'\nordering={ordering}')
+                field = ordering.lstrip('-')
+                prefix = '-' if ordering.startswith('-') else ''
+                ordered = queryset.order_by(ordering, f'{prefix}pk')
+
+                for page in options['pages']:
+                    offset = (page - 1) * page_size
+                    if offset >= options['products']:
+                        continue
+
+                    offset_timer = Timer()
+                    for _ in range(options['repeat']):
+                        with offset_timer:
+                            list(ordered[offset:offset + page_size])
+
+                    cursor = None
+                    if offset:
+                        previous = ordered[offset - 1]
+                        cursor = encode_cursor(ordering, getattr(previous, field), previous.pk)
+                    keyset_timer = Timer()
+                    for _ in range(options['repeat']):
+                        with keyset_timer:
+                            keyset_page(queryset, ordering, cursor=cursor, page_size=page_size)
+
+                    self.stdout.write(
+                        f'  page {page:>5}: offset {offset_timer.elapsed / offset_timer.count * 1000:7.2f} ms'
+                        f'   keyset {keyset_timer.elapsed / keyset_timer.count * 1000:7.2f} ms'
+                    )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark finished, all changes rolled back'))
@@ -0,0 +1,73 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from main import search
+from main.benchmarking import Timer, rolled_back
+from main.models import Category, Product
+
+
+ADJECTIVES = ['classic', 'wool', 'tree', 'trail', 'lounger', 'runner', 'dasher', 'cruiser',
+              'breezer', 'piper', 'mizzle', 'courier', 'glider', 'skipper', 'plus', 'high']
+MATERIALS = ['Leather', 'Canvas', 'Mesh', 'Merino Wool', 'Tree Fiber', 'Suede', 'Knit', 'Rubber']
+FILLER = ('soft light breathable durable everyday comfort cushioned sustainable natural '
+          'waterproof grippy flexible supportive lightweight washable recycled').split()
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text search with the LIKE search on a synthetic catalog (changes are rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Timed searches per query')
+        parser.add_argument('--queries', nargs='+',
+                            default=['wool', 'trail runner', 'merino', 'waterproof suede', 'glid',
+                                     '4242', 'sandal'])
+
+    def handle(self, *args, **options):
+        if not search.fts_available():
+            raise CommandError('Full-text search needs SQLite with FTS5')
+
+        rng = random.Random(42)
+
+        with rolled_back():
+            category = Category.objects.create(name='Bench', slug='bench-search')
+            # The FTS triggers index these as they are inserted
+            indexing = Timer()
+            with indexing:
+                Product.objects.bulk_create([
+                    Product(
+                        name=' '.join(rng.sample(ADJECTIVES, 2)).title() + f' {i}',
+                        description=' '.join(rng.choices(FILLER, k=25)),
+                        material=rng.choice(MATERIALS),
+                        price='50.00',
+                        category=category,
+                    )
+                    for i in range(options['products'])
+                ], batch_size=1000)
+            self.stdout.write(f'Inserted and indexed {options["products"]} products in {indexing.elapsed:.1f}s\n')
+
+            products = Product.objects.all()
+            for query in options['queries']:
+                like, fts = Timer(), Timer()
+                for _ in range(options['repeat']):
+                    with like:
+                        list(self.like_search(products, query).order_by('-created_at', '-pk')[:12])
+                    with fts:
+                        list(search.search_products(products, query).order_by(search.SEARCH_RANK, 'pk')[:12])
+
+                self.stdout.write(
+                    f'  {query!r:>20}: LIKE {like.elapsed / like.count * 1000:8.2f} ms'
+                    f'   FTS5 {fts.elapsed / fts.count * 1000:8.2f} ms'
+                )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark finished, all changes rolled back'))
+
+    def like_search(self, queryset, query):
+        # Same SQL DRF's SearchFilter produced before the FTS index. It is
+        # unranked, so common terms stop scanning after the first 12 hits;
+        # rare terms and misses read the whole table.
+        for term in query.split():
+            queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+        return queryset
@@ -0,0 +1,232 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from main.benchmarking import percentile, rolled_back
+from main.models import Cart, EmailOTP, Product, ProductVariant
+
+
+# Let the test client talk to the site as configured for production
+CLIENT_SETTINGS = {
+    'ALLOWED_HOSTS': ['testserver'],
+    'SECURE_SSL_REDIRECT': False,
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+    'STATICFILES_STORAGE': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+}
+
+CART_LINES = 5
+OTP_EMAIL = 'bench-otp@example.com'
+
+
+class Scenario:
+    """One request to measure, with optional untimed preparation before each run"""
+
+    def __init__(self, name, send, expect=200, setup=None):
+        self.name = name
+        self.send = send
+        self.expect = expect
+        self.setup = setup or (lambda: None)
+
+    def run(self):
+        response = self.send()
+        if response.status_code != self.expect:
+            raise CommandError(
+                f'{self.name}: expected HTTP {self.expect}, got {response.status_code}'
+                f' {response.get("Location", "")}'
+            )
+        return response
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the storefront hot paths through the Django test client on synthetic data '
+        '(latency percentiles, queries and allocations per request; all changes are rolled back)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000,
+                            help='Size of the generated catalog; other volumes scale with it')
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Timed requests per scenario')
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help='Run only scenarios whose name contains one of these strings')
+        parser.add_argument('--output', default='bench-results.json',
+                            help='Where to write the results as JSON')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Fail when a p50 latency grows by more than this fraction of the baseline')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        with override_settings(**CLIENT_SETTINGS), rolled_back():
+            started = time.perf_counter()
+            self.prepare(options['products'])
+            self.stdout.write(f'Synthetic data ready in {time.perf_counter() - started:.1f}s\n')
+
+            scenarios = self.scenarios()
+            if options['only']:
+                scenarios = [s for s in scenarios if any(word in s.name for word in options['only'])]
+
+            results = {}
+            self.stdout.write(f'{"scenario":<34}{"p50 ms":>9}{"p95 ms":>9}{"queries":>9}{"alloc KiB":>11}')
+            for scenario in scenarios:
+                result = results[scenario.name] = self.measure(scenario, options['iterations'])
+                self.stdout.write(
+                    f'{scenario.name:<34}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                    f'{result["queries"]:>9}{result["alloc_peak_kib"]:>11.0f}'
+                )
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'products': options['products'],
+            'iterations': options['iterations'],
+            'scenarios': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f'\nResults written to {options["output"]}')
+
+        if baseline is not None:
+            self.compare(results, baseline['scenarios'], options['threshold'])
+
+    def prepare(self, product_count):
+        call_command(
+            'generate_load_data', prefix='bench', products=product_count, categories=20,
+            users=max(product_count // 2, 10), carts=max(product_count // 5, 10), orders=product_count * 2,
+            reviews=product_count * 3, wishlists=product_count, stdout=StringIO(),
+        )
+
+        # The most ordered product stands in for a bestseller page
+        self.product = Product.objects.filter(category__slug__startswith='bench-').annotate(
+            sales=Count('orderitem')
+        ).order_by('-sales').first()
+        self.category = self.product.category
+        self.variants = list(ProductVariant.objects.filter(
+            product__category__slug__startswith='bench-'
+        ).order_by('-stock', 'pk')[:CART_LINES])
+        # Enough stock that repeated checkouts never run out
+        ProductVariant.objects.filter(pk__in=[v.pk for v in self.variants]).update(stock=10 ** 7)
+
+        self.user = User.objects.filter(username__startswith='bench-user-').order_by('pk').first()
+        self.anonymous = Client()
+        self.signed_in = Client()
+        self.signed_in.force_login(self.user)
+        self.fill_cart()
+
+    def fill_cart(self):
+        Cart.objects.filter(user=self.user).delete()
+        Cart.objects.bulk_create([
+            Cart(user=self.user, product_id=variant.product_id, quantity=1, color=variant.color, size=variant.size)
+            for variant in self.variants
+        ])
+
+    def new_otp(self):
+        EmailOTP.objects.filter(email=OTP_EMAIL).delete()
+        EmailOTP.objects.create(email=OTP_EMAIL, otp='246810')
+
+    def scenarios(self):
+        anonymous, signed_in = self.anonymous, self.signed_in
+        variant = self.variants[0]
+        api_cart = reverse('api_cart')
+        products = reverse('products')
+        shipping = {
+            'first_name': 'Bench', 'last_name': 'User', 'email': 'bench@example.com', 'phone': '555-0100',
+            'address': '1 Bench Street', 'city': 'London', 'state': 'London', 'zip_code': 'N1',
+        }
+        cart_line = {'product_id': variant.product_id, 'size': variant.size, 'color': variant.color}
+
+        return [
+            Scenario('home (anonymous, page cache)', lambda: anonymous.get(reverse('home'))),
+            Scenario('home (signed in)', lambda: signed_in.get(reverse('home'))),
+            Scenario('products', lambda: signed_in.get(products)),
+            Scenario('products ?category&ordering', lambda: signed_in.get(
+                products, {'category': self.category.slug, 'ordering': 'price'})),
+            Scenario('products ?search', lambda: signed_in.get(products, {'search': 'runner'})),
+            Scenario('api products ?size&color&price', lambda: signed_in.get(reverse('api_products'), {
+                'size': ['9', '10'], 'color': 'black', 'min_price': 50, 'max_price': 150, 'ordering': 'price',
+            })),
+            Scenario('product_detail', lambda: signed_in.get(reverse('product_detail', args=[self.product.pk]))),
+            Scenario('cart api GET', lambda: signed_in.get(api_cart), setup=self.fill_cart),
+            Scenario('cart api POST', lambda: signed_in.post(api_cart, {**cart_line, 'product': variant.product_id,
+                                                                        'quantity': 1}, content_type='application/json')),
+            Scenario('cart api PATCH', lambda: signed_in.patch(api_cart, {**cart_line, 'quantity': 2},
+                                                               content_type='application/json'),
+                     setup=self.fill_cart),
+            Scenario('checkout GET', lambda: signed_in.get(reverse('checkout')), setup=self.fill_cart),
+            Scenario('checkout POST', lambda: signed_in.post(reverse('checkout'), shipping),
+                     expect=302, setup=self.fill_cart),
+            Scenario('otp request', lambda: Client().post(reverse('request_email_otp'), {'email': OTP_EMAIL},
+                                                          content_type='application/json')),
+            Scenario('otp verify', lambda: Client().post(reverse('verify_email_otp'),
+                                                         {'email': OTP_EMAIL, 'otp': '246810'},
+                                                         content_type='application/json'),
+                     setup=self.new_otp),
+        ]
+
+    def measure(self, scenario, iterations):
+        for _ in range(3):
+            scenario.setup()
+            scenario.run()
+
+        timings, queries = [], []
+        for _ in range(iterations):
+            scenario.setup()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                scenario.run()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+
+        # Allocations in a separate run: tracing slows everything down
+        scenario.setup()
+        tracemalloc.start()
+        try:
+            scenario.run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': int(statistics.median(queries)),
+            'queries_max': max(queries),
+            'alloc_peak_kib': round(peak / 1024, 1),
+        }
+
+    def compare(self, results, baseline, threshold):
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            # Half a millisecond of slack so tiny timings do not flap
+            if result['p50_ms'] > before['p50_ms'] * (1 + threshold) + 0.5:
+                regressions.append(f'{name}: p50 {before["p50_ms"]:.2f} -> {result["p50_ms"]:.2f} ms')
+            if result['queries'] > before['queries']:
+                regressions.append(f'{name}: queries {before["queries"]} -> {result["queries"]}')
+
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(f'  {line}'))
+            raise CommandError(f'{len(regressions)} regression(s) against the baseline')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against the baseline (threshold {threshold:.0%})'))
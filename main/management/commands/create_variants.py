@@ -1,56 +1,89 @@
+import random
+import time
+
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from main import facets, variant_matrix
 from main.models import Product, ProductVariant, ProductImage
-import random
+
+
+BATCH_SIZE = 500
+
+COLORS = ['black', 'white', 'grey', 'navy', 'beige']
+SIZES = ['6', '7', '8', '9', '10', '11', '12']
+
 
 class Command(BaseCommand):
     help = 'Create variants and images for existing products'
 
-    def handle(self, *args, **kwargs):
-        products = Product.objects.all()
-        
-        colors = ['black', 'white', 'grey', 'navy', 'beige']
-        sizes = ['6', '7', '8', '9', '10', '11', '12']
-        
-        for product in products:
-            self.stdout.write(f'Processing {product.name}...')
-            
-            # Create Variants
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int,
+                            help='First load N copies of the shoe catalog (add_shoes --scale N)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the random colors and stock levels')
+
+    def handle(self, *args, **options):
+        if options['scale']:
+            call_command('add_shoes', scale=options['scale'], stdout=self.stdout)
+
+        started = time.perf_counter()
+        variant_count = image_count = 0
+        products = Product.objects.order_by('pk').values_list('pk', 'name', 'image')
+        last_pk = 0
+        while True:
+            batch = list(products.filter(pk__gt=last_pk)[:BATCH_SIZE])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            created_variants, created_images = self.create_batch(batch, options['seed'])
+            variant_count += created_variants
+            image_count += created_images
+
+        elapsed = time.perf_counter() - started
+        rate = variant_count / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully created {variant_count} variants and {image_count} images '
+            f'in {elapsed:.2f}s ({rate:.0f} variants/s)'
+        ))
+
+    def create_batch(self, batch, seed):
+        product_ids = [pk for pk, _, _ in batch]
+        variants = []
+        for pk, _, _ in batch:
+            # Seeded per product, so a re-run proposes the same rows and the
+            # unique (product, color, size) constraint turns them into no-ops
+            rng = random.Random(f'{seed}:{pk}')
             # Each product gets 2-3 random colors
-            product_colors = random.sample(colors, k=random.randint(2, 3))
-            
-            for color in product_colors:
-                for size in sizes:
-                    # Random stock between 0 and 20
-                    stock = random.randint(0, 20)
-                    
-                    # Create variant
-                    variant, created = ProductVariant.objects.get_or_create(
-                        product=product,
+            for color in rng.sample(COLORS, k=rng.randint(2, 3)):
+                for size in SIZES:
+                    variants.append(ProductVariant(
+                        product_id=pk,
                         color=color,
                         size=size,
-                        defaults={
-                            'stock': stock,
-                            'sku': f'{product.id}-{color}-{size}'
-                        }
-                    )
-                    
-                    if created:
-                        self.stdout.write(f'  Created variant: {color} - UK {size} (Stock: {stock})')
-            
-            # Create Additional Images (Simulated by reusing main image)
-            if not product.images.exists() and product.image:
-                ProductImage.objects.create(
-                    product=product,
-                    image=product.image,
-                    alt_text=f"{product.name} - Side View",
-                    order=1
-                )
-                ProductImage.objects.create(
-                    product=product,
-                    image=product.image,
-                    alt_text=f"{product.name} - Top View",
-                    order=2
-                )
-                self.stdout.write('  Created additional images')
-                
-        self.stdout.write(self.style.SUCCESS('Successfully created variants for all products'))
+                        # Random stock between 0 and 20
+                        stock=rng.randint(0, 20),
+                        sku=f'{pk}-{color}-{size}',
+                    ))
+
+        # Additional images (simulated by reusing the main image) for
+        # products that have none yet
+        with_images = set(ProductImage.objects.filter(
+            product_id__in=product_ids
+        ).values_list('product_id', flat=True).distinct())
+        images = [
+            ProductImage(product_id=pk, image=image, alt_text=f'{name} - {view} View', order=order)
+            for pk, name, image in batch if image and pk not in with_images
+            for order, view in [(1, 'Side'), (2, 'Top')]
+        ]
+
+        with transaction.atomic():
+            before = ProductVariant.objects.filter(product_id__in=product_ids).count()
+            ProductVariant.objects.bulk_create(variants, ignore_conflicts=True)
+            created = ProductVariant.objects.filter(product_id__in=product_ids).count() - before
+            ProductImage.objects.bulk_create(images)
+            if created:
+                # bulk_create skips the signals that keep these up to date
+                facets.refresh(product_ids)
+                transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+        return created, len(images)
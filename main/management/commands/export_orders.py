@@ -0,0 +1,47 @@
+import sys
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from main.models import Order
+from main.order_export import CHUNK_SIZE, export_lines, filter_orders
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise CommandError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+
+
+class Command(BaseCommand):
+    help = 'Stream orders and their items as CSV (one line per item) or JSON Lines (one line per order)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--from', dest='date_from', type=parse_date,
+                            help='First day to export (YYYY-MM-DD, inclusive)')
+        parser.add_argument('--to', dest='date_to', type=parse_date,
+                            help='Last day to export (YYYY-MM-DD, inclusive)')
+        parser.add_argument('--status', choices=[value for value, _ in Order.ORDER_STATUS])
+        parser.add_argument('--output', '-o', help='File to write (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        orders = filter_orders(date_from=options['date_from'], date_to=options['date_to'], status=options['status'])
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+
+        started = time.perf_counter()
+        lines = 0
+        try:
+            for line in export_lines(orders, options['format'], options['chunk_size']):
+                output.write(line)
+                lines += 1
+        finally:
+            if options['output']:
+                output.close()
+        elapsed = time.perf_counter() - started
+
+        # On stderr so that it never ends up in an export written to stdout
+        self.stderr.write(f'Exported {lines} lines in {elapsed:.2f}s', style_func=self.style.SUCCESS)
@@ -0,0 +1,225 @@
+import random
+import time
+from bisect import bisect
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from main import facets, page_cache, ratings
+from main.models import (
+    Cart, Category, Order, OrderItem, Product, ProductVariant, Review, Wishlist,
+)
+
+
+ADJECTIVES = ['Classic', 'Urban', 'Trail', 'Cloud', 'Merino', 'Canvas', 'Suede', 'Tempo', 'Summit', 'Harbor',
+              'Metro', 'Coastal', 'Alpine', 'Everyday', 'Studio', 'Breeze', 'Nomad', 'Ridge', 'Lounge', 'Dash']
+NOUNS = ['Runner', 'Walker', 'Loafer', 'Sneaker', 'Boot', 'Slip-On', 'Trainer', 'High-Top', 'Oxford', 'Mule']
+MATERIALS = ['Leather', 'Canvas', 'Mesh', 'Suede', 'Wool', 'Knit']
+
+COLORS = [value for value, _ in ProductVariant.COLOR_CHOICES]
+SIZES = [value for value, _ in ProductVariant.SIZE_CHOICES]
+STATUSES = [value for value, _ in Order.ORDER_STATUS]
+
+
+class Zipf:
+    """Draw indexes 0..n-1 where index k has weight 1 / (k + 1) ** s."""
+
+    def __init__(self, rng, n, s):
+        self.rng = rng
+        self.cum_weights = list(accumulate(1 / (k + 1) ** s for k in range(n)))
+
+    def draw(self):
+        return bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, reproducible synthetic catalog with users, carts, orders, reviews and wishlists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--carts', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--reviews', type=int, default=30000)
+        parser.add_argument('--wishlists', type=int, default=10000)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the Zipf distribution of product popularity')
+        parser.add_argument('--seed', type=int, default=42,
+                            help='Random seed; the same seed on an empty database gives the same data')
+        parser.add_argument('--prefix', default='load',
+                            help='Prefix of generated usernames, slugs, SKUs and order numbers')
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Rows inserted per transaction')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.prefix = options['prefix']
+        self.batch_size = options['batch_size']
+        if User.objects.filter(username__startswith=f'{self.prefix}-user-').exists():
+            raise CommandError(f'Data with prefix "{self.prefix}" already exists; pass another --prefix')
+
+        started = time.perf_counter()
+        categories = self.stage('categories', self.create_categories, options['categories'])
+        products = self.stage('products', self.create_products, options['products'], categories)
+        # Popularity ranks are a shuffled copy, so the most popular products
+        # are not simply the first ones created
+        ranked = products[:]
+        self.rng.shuffle(ranked)
+        self.popular = Zipf(self.rng, len(ranked), options['zipf'])
+        self.ranked = ranked
+
+        self.variants = {}
+        self.stage('variants', self.create_variants, products)
+        users = self.stage('users', self.create_users, options['users'])
+        self.stage('cart lines', self.create_carts, options['carts'], users)
+        self.stage('orders', self.create_orders, options['orders'], users)
+        self.stage('reviews', self.create_reviews, options['reviews'], users)
+        self.stage('wishlist entries', self.create_wishlists, options['wishlists'], users)
+
+        self.stage('facet and rating rows', self.refresh_derived, products)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Load data generated in {time.perf_counter() - started:.1f}s (seed {options["seed"]})'
+        ))
+
+    def refresh_derived(self, products):
+        # Bulk inserts skip the signals that maintain these
+        product_ids = [product.pk for product in products]
+        facets.refresh(product_ids)
+        ratings.rebuild(product_ids)
+        page_cache.invalidate('page:*', 'category:*')
+        return len(product_ids)
+
+    def stage(self, label, create, *args):
+        started = time.perf_counter()
+        result = create(*args)
+        count = result if isinstance(result, int) else len(result)
+        self.stdout.write(f'  {count:>8} {label} in {time.perf_counter() - started:.2f}s')
+        return result
+
+    def bulk_create(self, model, objs, **kwargs):
+        for start in range(0, len(objs), self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(objs[start:start + self.batch_size], **kwargs)
+        return objs
+
+    def pick_product(self):
+        return self.ranked[self.popular.draw()]
+
+    def cart_size(self):
+        """Heavy-tailed number of lines: mostly 1-2, occasionally dozens."""
+        return min(int(self.rng.paretovariate(1.3)), 40)
+
+    def pick_variant(self, product):
+        return self.rng.choice(self.variants[product.pk])
+
+    def create_categories(self, count):
+        return self.bulk_create(Category, [
+            Category(name=f'{self.rng.choice(ADJECTIVES)} Collection {i}', slug=f'{self.prefix}-category-{i}')
+            for i in range(count)
+        ])
+
+    def create_products(self, count, categories):
+        # Category sizes are skewed too: a few big departments, a long tail
+        category_pick = Zipf(self.rng, len(categories), 0.8)
+        products = []
+        for i in range(count):
+            price = Decimal(min(max(self.rng.lognormvariate(4.4, 0.45), 15), 400)).quantize(Decimal('1')) - Decimal('0.01')
+            products.append(Product(
+                name=f'{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {i}',
+                description=f'{self.rng.choice(MATERIALS)} upper with a cushioned sole. Generated load data.',
+                price=price,
+                category=categories[category_pick.draw()],
+                featured=self.rng.random() < 0.02,
+                material=self.rng.choice(MATERIALS),
+                image='products/classic_leather_sneakers.png',
+            ))
+        return self.bulk_create(Product, products)
+
+    def create_variants(self, products):
+        variants = []
+        for product in products:
+            colors = self.rng.sample(COLORS, k=self.rng.randint(1, 4))
+            self.variants[product.pk] = [(color, size) for color in colors for size in SIZES]
+            for color in colors:
+                for size in SIZES:
+                    variants.append(ProductVariant(
+                        product=product, color=color, size=size,
+                        stock=self.rng.choice([0, 0, 1, 3, 5, 10, 20, 50]),
+                        sku=f'{self.prefix}-{product.pk}-{color}-{size}',
+                    ))
+        return self.bulk_create(ProductVariant, variants)
+
+    def create_users(self, count):
+        # Hashing a password per user would dominate the run
+        password = make_password('load-data')
+        return self.bulk_create(User, [
+            User(username=f'{self.prefix}-user-{i}', email=f'{self.prefix}-user-{i}@example.com', password=password)
+            for i in range(count)
+        ])
+
+    def create_carts(self, count, users):
+        lines = []
+        for i in range(count):
+            # Half the carts belong to signed-in users, half to guest sessions
+            owner = {'user': self.rng.choice(users)} if i % 2 else {'session_key': f'{self.prefix}-cart-{i}'}
+            seen = set()
+            for _ in range(self.cart_size()):
+                product = self.pick_product()
+                color, size = self.pick_variant(product)
+                if (product.pk, color, size) in seen:
+                    continue
+                seen.add((product.pk, color, size))
+                lines.append(Cart(product=product, quantity=self.rng.choice([1, 1, 1, 2, 3]),
+                                  color=color, size=size, **owner))
+        return self.bulk_create(Cart, lines)
+
+    def create_orders(self, count, users):
+        orders, items = [], []
+        for i in range(count):
+            user = self.rng.choice(users) if self.rng.random() < 0.7 else None
+            lines = []
+            for _ in range(self.cart_size()):
+                product = self.pick_product()
+                color, size = self.pick_variant(product)
+                lines.append((product, self.rng.choice([1, 1, 1, 2]), color, size))
+            orders.append(Order(
+                user=user, is_guest=user is None, order_number=f'{self.prefix}-{i}',
+                total_amount=sum(product.price * quantity for product, quantity, _, _ in lines),
+                status=self.rng.choices(STATUSES, weights=[10, 10, 20, 55, 5])[0],
+                full_name=user.username if user else 'Guest Shopper',
+                email=user.email if user else f'guest-{i}@example.com',
+                phone='555-0100', address='1 Load Street', city='London', state='London', zip_code='N1',
+            ))
+            items.append(lines)
+        self.bulk_create(Order, orders)
+        self.bulk_create(OrderItem, [
+            OrderItem(order=order, product=product, quantity=quantity, price=product.price, color=color, size=size)
+            for order, lines in zip(orders, items)
+            for product, quantity, color, size in lines
+        ])
+        return orders
+
+    def create_reviews(self, count, users):
+        reviews = []
+        for _ in range(count):
+            rating = self.rng.choices([1, 2, 3, 4, 5], weights=[4, 5, 12, 34, 45])[0]
+            reviews.append(Review(
+                user=self.rng.choice(users), product=self.pick_product(), rating=rating, comment='Generated review.',
+                comfort_rating=max(1, min(5, rating + self.rng.choice([-1, 0, 0, 1]))),
+                true_to_size=self.rng.choices(['', 'small', 'true', 'large'], weights=[20, 15, 55, 10])[0],
+                width_feedback=self.rng.choices(['', 'narrow', 'perfect', 'wide'], weights=[30, 15, 45, 10])[0],
+                would_recommend=rating >= 3,
+            ))
+        return self.bulk_create(Review, reviews)
+
+    def create_wishlists(self, count, users):
+        entries = {}
+        for _ in range(count):
+            user, product = self.rng.choice(users), self.pick_product()
+            entries[(user.pk, product.pk)] = Wishlist(user=user, product=product)
+        return self.bulk_create(Wishlist, list(entries.values()), ignore_conflicts=True)
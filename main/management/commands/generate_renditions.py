@@ -0,0 +1,49 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connections
+from main import renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate missing WebP/JPEG renditions for every stored product image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Encoder processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-encode renditions that already exist')
+
+    def handle(self, *args, **options):
+        names = renditions.stored_names()
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+
+        started = time.perf_counter()
+        written = size = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(renditions.generate, names, [options['force']] * len(names), chunksize=8)
+            for files, bytes_written in results:
+                written += files
+                size += bytes_written
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(names)} images, {written} renditions written ({size / 1024:.0f} KiB) in {elapsed:.2f}s'
+        ))
+
+        # What a listing card (~400px wide) downloads now compared with the original
+        original = small = 0
+        for name in names:
+            rendition = renditions.rendition_name(name, 400, 'webp')
+            if default_storage.exists(name) and default_storage.exists(rendition):
+                original += default_storage.size(name)
+                small += default_storage.size(rendition)
+        if original:
+            self.stdout.write(
+                f'400w WebP renditions are {100 * small / original:.1f}% of the original bytes '
+                f'({small / 1024:.0f} KiB vs {original / 1024:.0f} KiB)'
+            )
@@ -0,0 +1,51 @@
+import os
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from main.catalog_import import BATCH_SIZE, Importer, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Upsert products and variants from a CSV or JSON Lines supplier feed, keyed on SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Feed file (.csv or .jsonl)')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Feed format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Rows upserted per transaction')
+        parser.add_argument('--errors', metavar='PATH',
+                            help='Write every rejected row (line, reason) to this CSV file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError(f'Cannot tell the format of {path}; pass --format csv or --format jsonl')
+
+        error_file = open(options['errors'], 'w', newline='') if options['errors'] else None
+        importer = Importer(batch_size=options['batch_size'], error_file=error_file)
+        started = time.perf_counter()
+        try:
+            with open(path, newline='', encoding='utf-8') as feed:
+                importer.run(read_rows(feed, fmt))
+        finally:
+            if error_file:
+                error_file.close()
+        elapsed = time.perf_counter() - started
+
+        for line_num, message in importer.errors[:20]:
+            self.stdout.write(self.style.WARNING(f'  line {line_num}: {message}'))
+        if importer.error_count > 20:
+            self.stdout.write(self.style.WARNING(f'  ... {importer.error_count - 20} more'))
+
+        rate = importer.rows / elapsed if elapsed else 0
+        # ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f'{importer.rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s): '
+            f'{importer.created} variants created, {importer.updated} updated, '
+            f'{importer.products_created} products created, {importer.error_count} errors '
+            f'(peak memory {peak:.0f} MiB)'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from main import page_cache
+
+
+class Command(BaseCommand):
+    help = ('Show full-page cache hit rate or invalidate tags. With the default locmem '
+            'backend each process has its own cache; use a shared backend (file, Redis) '
+            'for this command to see and affect the web workers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invalidate', nargs='+', metavar='TAG', default=[],
+                            help='Tags to invalidate, e.g. page:* category:men product:42')
+        parser.add_argument('--reset-stats', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['invalidate']:
+            page_cache.invalidate(*options['invalidate'])
+            self.stdout.write(self.style.SUCCESS(f'Invalidated {", ".join(options["invalidate"])}'))
+
+        stats = page_cache.stats()
+        self.stdout.write(
+            f'hits={stats["hits"]} misses={stats["misses"]} hit rate={stats["hit_rate"]:.1%}'
+        )
+        if options['reset_stats']:
+            page_cache.reset_stats()
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main.carts import PURGE_BATCH_SIZE, STALE_DAYS, purge_stale
+
+
+class Command(BaseCommand):
+    help = ('Delete expired sessions, guest cart lines of sessions that are gone or older than --days, '
+            'and cart lines of deleted products, in small batches (safe to run while serving traffic)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=STALE_DAYS,
+                            help='Age in days at which guest cart lines are abandoned')
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help='Rows deleted per statement')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, purging every N seconds (default: purge once)')
+
+    def handle(self, *args, **options):
+        while True:
+            results = purge_stale(options['days'], options['batch_size'], options['pause'])
+
+            self.stdout.write(f'{"rows":<28}{"deleted":>9}{"rows/sec":>12}')
+            for what, deleted, seconds in results:
+                rate = deleted / seconds if seconds else 0.0
+                self.stdout.write(f'{what:<28}{deleted:>9}{rate:>12.0f}')
+            self.stdout.write(self.style.SUCCESS(f'Deleted {sum(deleted for _, deleted, _ in results)} rows'))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from main.benchmarking import percentile
+from main.models import QueryFingerprint
+
+
+SORT_KEYS = {
+    'total': lambda row: row.total_ms,
+    'count': lambda row: row.count,
+    'mean': lambda row: row.mean_ms,
+    'p95': lambda row: row.p95_ms,
+    'max': lambda row: row.max_ms,
+}
+
+
+class Command(BaseCommand):
+    help = ('Show the SQL statements that cost the most time, per view, from the statistics '
+            'collected by QueryStatsMiddleware (enable with QUERY_STATS=1)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total',
+                            help='What "worst" means (default: total time)')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--view', help='Only statements run by this view (URL name)')
+        parser.add_argument('--width', type=int, default=120,
+                            help='Truncate statements to this many characters (0: no limit)')
+        parser.add_argument('--reset', action='store_true',
+                            help='Delete the collected statistics after printing them')
+
+    def handle(self, *args, **options):
+        rows = QueryFingerprint.objects.all()
+        if options['view']:
+            rows = rows.filter(view=options['view'])
+        rows = list(rows)
+        for row in rows:
+            row.p95_ms = percentile(row.samples, 95) if row.samples else 0.0
+        rows.sort(key=SORT_KEYS[options['sort']], reverse=True)
+
+        if not rows:
+            self.stdout.write('No query statistics collected yet')
+        else:
+            self.stdout.write(f'{"view":<24}{"count":>9}{"total ms":>11}{"mean ms":>9}{"p95 ms":>9}{"max ms":>9}  statement')
+        for row in rows[:options['limit']]:
+            sql = row.fingerprint
+            if options['width'] and len(sql) > options['width']:
+                sql = sql[:options['width'] - 3] + '...'
+            self.stdout.write(
+                f'{row.view[:23]:<24}{row.count:>9}{row.total_ms:>11.1f}{row.mean_ms:>9.2f}'
+                f'{row.p95_ms:>9.2f}{row.max_ms:>9.2f}  {sql}'
+            )
+
+        if options['reset']:
+            deleted, _ = QueryFingerprint.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} statistics rows'))
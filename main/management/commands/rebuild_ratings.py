@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main import ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized review aggregates (and Product.rating) from the Review table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, nargs='+',
+                            help='Only rebuild these product ids')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuilt = ratings.rebuild(options['products'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ratings for {rebuilt} products in {elapsed:.2f}s'))
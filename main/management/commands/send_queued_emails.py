@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main.email_utils import OUTBOX_BATCH_SIZE, deliver_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Deliver emails waiting in the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE,
+                            help='Emails sent per SMTP connection')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, polling the outbox every N seconds (default: drain once)')
+
+    def handle(self, *args, **options):
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = deliver_queued_emails(batch_size=options['batch_size'])
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options['batch_size']:
+                    break
+
+            if total_sent or total_failed or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} emails, {total_failed} failed'))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
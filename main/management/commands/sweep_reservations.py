@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main.inventory import reconcile_reserved, release_expired
+
+
+class Command(BaseCommand):
+    help = 'Release expired checkout stock reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Reservations released per transaction')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Keep running, sweeping every N seconds (default: sweep once)')
+        parser.add_argument('--reconcile', action='store_true',
+                            help='First reset reserved counts to the units held by existing reservations')
+
+    def handle(self, *args, **options):
+        if options['reconcile']:
+            fixed = reconcile_reserved()
+            self.stdout.write(self.style.SUCCESS(f'Reconciled the reserved count of {fixed} variants'))
+
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Released {released} reserved units'))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
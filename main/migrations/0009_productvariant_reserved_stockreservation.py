@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0008_emailotp_phoneotp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, help_text='Units held by checkout reservations'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(blank=True, max_length=40, null=True)),
+                ('quantity', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('claim_token', models.CharField(blank=True, db_index=True, default='', max_length=32)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='main.productvariant')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+from main import search
+
+
+def create_index(apps, schema_editor):
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.SCHEMA + search.TRIGGERS:
+        schema_editor.execute(statement)
+    schema_editor.execute(f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_index(apps, schema_editor):
+    if not search.fts_available(schema_editor.connection):
+        return
+    for statement in search.DROP:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_product_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from main.facets import COLORS, SIZES, bits, price_bucket
+
+
+def populate(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductVariant = apps.get_model('main', 'ProductVariant')
+    ProductFacet = apps.get_model('main', 'ProductFacet')
+
+    sizes, colors = {}, {}
+    for product_id, size, color in ProductVariant.objects.filter(stock__gt=0).values_list(
+        'product_id', 'size', 'color'
+    ):
+        sizes.setdefault(product_id, set()).add(size)
+        colors.setdefault(product_id, set()).add(color)
+
+    ProductFacet.objects.bulk_create([
+        ProductFacet(
+            product_id=pk,
+            category_id=category_id,
+            price=price,
+            price_bucket=price_bucket(price),
+            size_mask=bits(sizes.get(pk, ()), SIZES),
+            color_mask=bits(colors.get(pk, ()), COLORS),
+        )
+        for pk, category_id, price in Product.objects.values_list('pk', 'category_id', 'price')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='facet', serialize=False, to='main.product')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('price_bucket', models.PositiveSmallIntegerField()),
+                ('size_mask', models.PositiveIntegerField(default=0)),
+                ('color_mask', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.category')),
+            ],
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
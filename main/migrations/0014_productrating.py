@@ -0,0 +1,65 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q, Sum
+
+
+def populate(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductRating = apps.get_model('main', 'ProductRating')
+    Review = apps.get_model('main', 'Review')
+
+    totals = {
+        row['product_id']: row
+        for row in Review.objects.values('product_id').annotate(
+            review_count=Count('pk'),
+            rating_sum=Sum('rating'),
+            comfort_sum=Sum('comfort_rating'),
+            recommend_count=Count('pk', filter=Q(would_recommend=True)),
+            fit_small=Count('pk', filter=Q(true_to_size='small')),
+            fit_true=Count('pk', filter=Q(true_to_size='true')),
+            fit_large=Count('pk', filter=Q(true_to_size='large')),
+            width_narrow=Count('pk', filter=Q(width_feedback='narrow')),
+            width_perfect=Count('pk', filter=Q(width_feedback='perfect')),
+            width_wide=Count('pk', filter=Q(width_feedback='wide')),
+        ).order_by()
+    }
+
+    rows, products = [], list(Product.objects.only('pk'))
+    for product in products:
+        row = totals.get(product.pk, {})
+        rows.append(ProductRating(product_id=product.pk, **{
+            name: value for name, value in row.items() if name != 'product_id'
+        }))
+        # Product.rating now mirrors the real mean rating
+        product.rating = row['rating_sum'] / row['review_count'] if row else 0.0
+    ProductRating.objects.bulk_create(rows, batch_size=500)
+    Product.objects.bulk_update(products, ['rating'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_productfacet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='main.product')),
+                ('review_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.PositiveIntegerField(default=0)),
+                ('comfort_sum', models.PositiveIntegerField(default=0)),
+                ('recommend_count', models.PositiveIntegerField(default=0)),
+                ('fit_small', models.PositiveIntegerField(default=0)),
+                ('fit_true', models.PositiveIntegerField(default=0)),
+                ('fit_large', models.PositiveIntegerField(default=0)),
+                ('width_narrow', models.PositiveIntegerField(default=0)),
+                ('width_perfect', models.PositiveIntegerField(default=0)),
+                ('width_wide', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
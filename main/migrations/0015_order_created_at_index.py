@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_productrating'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='main_order_created_4be535_idx'),
+        ),
+    ]
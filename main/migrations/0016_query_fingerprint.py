@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_order_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=200)),
+                ('digest', models.CharField(max_length=40)),
+                ('fingerprint', models.TextField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('samples', models.JSONField(default=list)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('view', 'digest')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:58
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """Fold duplicate lines into the oldest one, adding up their quantities."""
+    Cart = apps.get_model('main', 'Cart')
+
+    for owner in ['user', 'session_key']:
+        duplicates = Cart.objects.filter(**{f'{owner}__isnull': False}).values(
+            owner, 'product', 'size', 'color'
+        ).annotate(lines=Count('pk'), keep=Min('pk'), total=Sum('quantity')).filter(lines__gt=1).order_by()
+        for row in duplicates:
+            lines = Cart.objects.filter(**{owner: row[owner]}, product=row['product'],
+                                        size=row['size'], color=row['color'])
+            lines.filter(pk=row['keep']).update(quantity=row['total'])
+            lines.exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_query_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'product', 'size', 'color'), name='unique_user_cart_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('session_key__isnull', False)), fields=('session_key', 'product', 'size', 'color'), name='unique_session_cart_line'),
+        ),
+    ]
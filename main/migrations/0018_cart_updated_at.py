@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:22
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_created_at(apps, schema_editor):
+    """Existing lines were last written no later than they were added, as far as we know."""
+    Cart = apps.get_model('main', 'Cart')
+    Cart.objects.update(updated_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_cart_line_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(copy_created_at, migrations.RunPython.noop),
+    ]
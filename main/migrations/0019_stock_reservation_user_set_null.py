@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0018_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockreservation',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
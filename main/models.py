@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -25,6 +26,14 @@ class Product(models.Model):
     is_water_resistant = models.BooleanField(default=False)
     care_instructions = models.TextField(blank=True)
     
+    class Meta:
+        # Composite indexes for keyset pagination over each listing order
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['name', 'id']),
+        ]
+    
     def __str__(self):
         return self.name
     
@@ -80,6 +89,7 @@ class ProductVariant(models.Model):
     color = models.CharField(max_length=50, choices=COLOR_CHOICES)
     size = models.CharField(max_length=10, choices=SIZE_CHOICES)
     stock = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0, help_text="Units held by checkout reservations")
     sku = models.CharField(max_length=100, unique=True, help_text="Stock Keeping Unit")
     
     # Optional: Color-specific image
@@ -92,11 +102,51 @@ class ProductVariant(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.get_color_display()} - {self.get_size_display()}"
     
+    @property
+    def available_stock(self):
+        """Units that can still be sold, i.e. stock not held by other shoppers"""
+        return max(self.stock - self.reserved, 0)
+    
     def is_in_stock(self):
-        return self.stock > 0
+        return self.available_stock > 0
     
     def is_low_stock(self):
-        return 0 < self.stock <= 5
+        return 0 < self.available_stock <= 5
+
+class ProductFacet(models.Model):
+    """
+    Filter attributes of one product, kept up to date by main.facets.
+
+    Sizes and colors with stock are stored as bitmasks (bit i is
+    ProductVariant.SIZE_CHOICES[i] / COLOR_CHOICES[i]), so the facet counts
+    for a whole listing come from a single scan of this table.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='facet')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    price_bucket = models.PositiveSmallIntegerField()
+    size_mask = models.PositiveIntegerField(default=0)
+    color_mask = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Facets for product {self.product_id}"
+
+class StockReservation(models.Model):
+    """Time-limited hold on variant units while a shopper is checking out"""
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, related_name='reservations')
+    # Not CASCADE: deleting the row would skip releasing its units; orphaned
+    # holds expire and are released like any other
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True)  # For guest checkouts
+    quantity = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    # Set while a release is in progress so the same hold is never released twice
+    claim_token = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.variant.sku} until {self.expires_at:%H:%M}"
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE,null=True, blank=True)  # Optional for guests
@@ -109,6 +159,17 @@ class Cart(models.Model):
     color = models.CharField(max_length=50, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last change of the line; main.carts bumps it on every upsert and update
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # One line per owner and variant; main.carts.add() upserts against these
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product', 'size', 'color'],
+                                    condition=models.Q(user__isnull=False), name='unique_user_cart_line'),
+            models.UniqueConstraint(fields=['session_key', 'product', 'size', 'color'],
+                                    condition=models.Q(session_key__isnull=False), name='unique_session_cart_line'),
+        ]
 
     @property
     def total_price(self):
@@ -140,6 +201,10 @@ class Order(models.Model):
     zip_code = models.CharField(max_length=10)
     payment_method = models.CharField(max_length=50, default='credit-card')
 
+    class Meta:
+        # Date-range exports scan orders in this order
+        indexes = [models.Index(fields=['created_at', 'id'])]
+
     def __str__(self):
         return self.order_number
 
@@ -184,200 +249,60 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.rating})"
 
-class NewsletterSubscription(models.Model):
-    email = models.EmailField(unique=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    def __str__(self):
-        return self.email
-
-class Page(models.Model):
-    slug = models.SlugField(unique=True)
-    title = models.CharField(max_length=200)
-    content = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
-
-    def __str__(self):
-        return self.title
-
-class SocialMediaLink(models.Model):
-    platform = models.CharField(max_length=50)
-    url = models.URLField()
-    icon = models.CharField(max_length=50, help_text="FontAwesome class, e.g., 'fab fa-facebook'")
-
-    def __str__(self):
-        return self.platform
-
-class Address(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='addresses')
-    name = models.CharField(max_length=100)
-    phone = models.CharField(max_length=15)
-    address_line1 = models.CharField(max_length=255)
-    address_line2 = models.CharField(max_length=255, blank=True)
-    city = models.CharField(max_length=100)
-    state = models.CharField(max_length=100)
-    zip_code = models.CharField(max_length=10)
-    is_default = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
-
-    class Meta:
-        verbose_name_plural = 'Addresses'
-
-    def __str__(self):
-        return f"{self.name} - {self.city}"
-
-def get_available_sizes(self, color=None):
-    """Returns available sizes, optionally filtered by color"""
-    queryset = ProductVariant.objects.filter(product=self)
-    if color:
-        queryset = queryset.filter(color=color)
-    return queryset.values_list('size', flat=True).distinct().order_by('size')
-
-class ProductImage(models.Model):
-    """Multiple images for a product"""
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='products/gallery/')
-    alt_text = models.CharField(max_length=200, blank=True)
-    order = models.PositiveIntegerField(default=0, help_text="Display order")
-    
-    class Meta:
-        ordering = ['order']
-    
-    def __str__(self):
-        return f"{self.product.name} - Image {self.order}"
-
-class ProductVariant(models.Model):
-    """Product variants for different color and size combinations"""
-    SIZE_CHOICES = [
-        ('6', 'UK 6'),
-        ('7', 'UK 7'),
-        ('8', 'UK 8'),
-        ('9', 'UK 9'),
-        ('10', 'UK 10'),
-        ('11', 'UK 11'),
-        ('12', 'UK 12'),
-    ]
-    
-    COLOR_CHOICES = [
-        ('black', 'Black'),
-        ('white', 'White'),
-        ('brown', 'Brown'),
-        ('navy', 'Navy Blue'),
-        ('grey', 'Grey'),
-        ('beige', 'Beige'),
-        ('red', 'Red'),
-        ('blue', 'Blue'),
-        ('green', 'Green'),
-    ]
-    
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='variants')
-    color = models.CharField(max_length=50, choices=COLOR_CHOICES)
-    size = models.CharField(max_length=10, choices=SIZE_CHOICES)
-    stock = models.PositiveIntegerField(default=0)
-    sku = models.CharField(max_length=100, unique=True, help_text="Stock Keeping Unit")
-    
-    # Optional: Color-specific image
-    color_image = models.ImageField(upload_to='products/colors/', blank=True, null=True)
-    
-    class Meta:
-        unique_together = ['product', 'color', 'size']
-        ordering = ['color', 'size']
+class ProductRating(models.Model):
+    """
+    Review aggregates of one product, maintained incrementally by main.ratings.
+
+    Sums and counts are stored rather than means so that a review can be
+    added, edited or removed with a single UPDATE.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    comfort_sum = models.PositiveIntegerField(default=0)
+    recommend_count = models.PositiveIntegerField(default=0)
+    
+    # true_to_size histogram
+    fit_small = models.PositiveIntegerField(default=0)
+    fit_true = models.PositiveIntegerField(default=0)
+    fit_large = models.PositiveIntegerField(default=0)
+    
+    # width_feedback histogram
+    width_narrow = models.PositiveIntegerField(default=0)
+    width_perfect = models.PositiveIntegerField(default=0)
+    width_wide = models.PositiveIntegerField(default=0)
     
     def __str__(self):
-        return f"{self.product.name} - {self.get_color_display()} - {self.get_size_display()}"
+        return f"Rating summary for product {self.product_id}"
     
-    def is_in_stock(self):
-        return self.stock > 0
-    
-    def is_low_stock(self):
-        return 0 < self.stock <= 5
-
-class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE,null=True, blank=True)  # Optional for guests
-    session_key = models.CharField(max_length=40, null=True, blank=True)  # For guest carts
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField(default=1)
+    def _mean(self, total):
+        return round(total / self.review_count, 1) if self.review_count else None
     
-    # Variant information
-    size = models.CharField(max_length=10, blank=True)
-    color = models.CharField(max_length=50, blank=True)
-    
-    created_at = models.DateTimeField(auto_now_add=True)
-
     @property
-    def total_price(self):
-        return self.product.price * self.quantity
-
-class Order(models.Model):
-    ORDER_STATUS = [
-        ('pending', 'Pending'),
-        ('processing', 'Processing'),
-        ('shipped', 'Shipped'),
-        ('delivered', 'Delivered'),
-        ('cancelled', 'Cancelled'),
-    ]
-    
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)  # Optional for guests
-    is_guest = models.BooleanField(default=False)  # Track if this is a guest order
-    order_number = models.CharField(max_length=20, unique=True)
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
-    status = models.CharField(max_length=20, choices=ORDER_STATUS, default='pending')
-    created_at = models.DateTimeField(auto_now_add=True)
+    def mean_rating(self):
+        return self._mean(self.rating_sum)
     
-    # Shipping information
-    full_name = models.CharField(max_length=100)
-    email = models.EmailField()
-    phone = models.CharField(max_length=15)
-    address = models.TextField()
-    city = models.CharField(max_length=50)
-    state = models.CharField(max_length=50)
-    zip_code = models.CharField(max_length=10)
-    payment_method = models.CharField(max_length=50, default='credit-card')
-
-    def __str__(self):
-        return self.order_number
-
-class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    quantity = models.PositiveIntegerField()
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    @property
+    def mean_comfort(self):
+        return self._mean(self.comfort_sum)
     
-    # Variant information
-    size = models.CharField(max_length=10, blank=True)
-    color = models.CharField(max_length=50, blank=True)
-
-    def __str__(self):
-        return f"{self.quantity} x {self.product.name}"
-
-class Review(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    rating = models.IntegerField(choices=[(i, i) for i in range(1, 6)])
-    comment = models.TextField()
-    created_at = models.DateTimeField(auto_now_add=True)
+    @property
+    def recommend_ratio(self):
+        return self.recommend_count / self.review_count if self.review_count else None
     
-    # Footwear-specific review fields
-    TRUE_TO_SIZE_CHOICES = [
-        ('small', 'Runs Small'),
-        ('true', 'True to Size'),
-        ('large', 'Runs Large'),
-    ]
+    def _histogram(self, choices, prefix):
+        counts = [(label, getattr(self, f'{prefix}_{value}')) for value, label in choices]
+        answered = sum(count for _, count in counts)
+        return [
+            {'label': label, 'count': count, 'percent': round(100 * count / answered) if answered else 0}
+            for label, count in counts
+        ]
     
-    WIDTH_CHOICES = [
-        ('narrow', 'Too Narrow'),
-        ('perfect', 'Perfect Width'),
-        ('wide', 'Too Wide'),
-    ]
+    def fit_histogram(self):
+        return self._histogram(Review.TRUE_TO_SIZE_CHOICES, 'fit')
     
-    true_to_size = models.CharField(max_length=10, choices=TRUE_TO_SIZE_CHOICES, blank=True)
-    width_feedback = models.CharField(max_length=10, choices=WIDTH_CHOICES, blank=True)
-    comfort_rating = models.IntegerField(choices=[(i, i) for i in range(1, 6)], default=5)
-    would_recommend = models.BooleanField(default=True)
-
-    def __str__(self):
-        return f"{self.user.username} - {self.product.name} ({self.rating})"
+    def width_histogram(self):
+        return self._histogram(Review.WIDTH_CHOICES, 'width')
 
 class NewsletterSubscription(models.Model):
     email = models.EmailField(unique=True)
@@ -435,6 +360,74 @@ class Wishlist(models.Model):
         return f"{self.user.username} - {self.product.name}"
 
 
+class EmailOutbox(models.Model):
+    """Outgoing email queued by a request and delivered by send_queued_emails"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.TextField(help_text="Comma separated recipients")
+    content_subtype = models.CharField(max_length=20, default='html')
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    # Set by the worker that picked the message up, so two workers never send it twice
+    claim_token = models.CharField(max_length=32, blank=True, default='', db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+        verbose_name = 'Outgoing email'
+        verbose_name_plural = 'Email outbox'
+    
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
+    
+    @property
+    def recipients(self):
+        return [address for address in self.to.split(',') if address]
+
+
+
+class QueryFingerprint(models.Model):
+    """
+    Statistics of one SQL statement shape run by one view, collected by
+    main.query_stats (literals are normalized away, see fingerprint()).
+    """
+    view = models.CharField(max_length=200)
+    digest = models.CharField(max_length=40)
+    fingerprint = models.TextField()
+    count = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    # A bounded random sample of durations, for percentiles
+    samples = models.JSONField(default=list)
+    last_seen = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['view', 'digest']
+    
+    def __str__(self):
+        return f"{self.view}: {self.fingerprint[:60]}"
+    
+    @property
+    def mean_ms(self):
+        return self.total_ms / self.count if self.count else 0.0
+
+
 # OTP Authentication Models
 class EmailOTP(models.Model):
     """Email OTP for passwordless login"""
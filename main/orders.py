@@ -0,0 +1,104 @@
+"""
+Order placement service used by the checkout view.
+
+The whole order is written inside one transaction: the Order row, a single
+bulk INSERT for its items and one conditional UPDATE covering every variant,
+so stock can never go below zero, even when two shoppers check out the same
+size at once.
+"""
+import random
+import string
+
+from django.db import transaction
+from django.db.models import F
+
+from . import facets, variant_matrix
+from .inventory import (
+    OutOfStockError, Shortage, per_variant, raise_for_shortage, release_holds, variant_quantities,
+)
+from .models import Cart, Order, OrderItem, ProductVariant
+
+
+def generate_order_number(user=None):
+    """Build a unique-looking order number, prefixed by user id for members."""
+    prefix = f"ORD-{user.id}" if user is not None else "ORD-GUEST"
+    suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+    return f"{prefix}-{suffix}"
+
+
+def place_order(cart_items, user=None, session_key=None, store=None, **shipping):
+    """
+    Turn cart lines into an Order, decrement stock and clear the cart.
+
+    Any stock the shopper reserved when opening checkout is released in the
+    same transaction, so their own holds never block their purchase.
+
+    Args:
+        cart_items: Cart lines (with product attached) to check out, e.g.
+            from ``CartStore.get_lines()`` or a Cart queryset
+        user: User placing the order, or None for guest checkout
+        session_key: Guest session the checkout reservations belong to
+        store: CartStore the lines came from; without one they are
+            deleted as Cart rows
+        **shipping: Order fields such as full_name, email, address, ...
+
+    Returns:
+        Order: the created order
+
+    Raises:
+        OutOfStockError: if any variant does not have enough stock. Nothing
+            is written in that case.
+    """
+    lines = list(cart_items)
+    total = sum(line.product.price * line.quantity for line in lines)
+
+    try:
+        with transaction.atomic():
+            release_holds(user, session_key)
+
+            decrements = variant_quantities(lines)
+            if decrements:
+                # One UPDATE for every variant; a row only matches if it still
+                # has enough unreserved stock, so a short row count means
+                # something would oversell.
+                amount = per_variant(decrements)
+                updated = ProductVariant.objects.filter(
+                    pk__in=decrements, stock__gte=F('reserved') + amount
+                ).update(stock=F('stock') - amount)
+
+                if updated != len(decrements):
+                    raise Shortage(decrements)
+
+                facets.refresh_sold_out(decrements)
+                product_ids = {line.product_id for line in lines}
+                transaction.on_commit(lambda: variant_matrix.invalidate(product_ids))
+
+            order = Order.objects.create(
+                user=user,
+                is_guest=user is None,
+                order_number=generate_order_number(user),
+                total_amount=total,
+                **shipping
+            )
+
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=line.product,
+                    quantity=line.quantity,
+                    price=line.product.price,
+                    size=line.size,
+                    color=line.color,
+                )
+                for line in lines
+            ])
+
+            # Only delete the lines we priced; anything added meanwhile stays in the cart
+            if store is None:
+                Cart.objects.filter(pk__in=[line.pk for line in lines]).delete()
+            else:
+                store.discard(lines)
+    except Shortage as e:
+        raise_for_shortage(e.requested)
+
+    return order
@@ -0,0 +1,193 @@
+"""
+Full-page cache for catalog pages seen by anonymous visitors.
+
+Anonymous GET requests for a cached view are answered from the ``pages``
+cache (any Django cache backend; locmem by default, see CACHES in settings),
+keyed on host, path and the query parameters the view declares as relevant.
+
+Invalidation is by tag. Views tag what they render ("page:about",
+"category:men", "product:42") and model signals call ``invalidate()``.
+A tag ending in ``:*`` has two meanings:
+
+* on a page, "depends on every object of this kind" -- the unfiltered
+  listing is tagged "category:*" and is dropped when any category tag is
+  invalidated;
+* passed to ``invalidate()``, "drop every page tagged with this kind",
+  e.g. ``invalidate('page:*')`` after a deploy.
+
+Nothing is deleted on invalidation: each tag has a version token, every
+entry stores the tokens it was rendered with, and an entry whose tokens no
+longer match is treated as a miss and overwritten.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+
+CACHE_ALIAS = getattr(settings, 'PAGE_CACHE_ALIAS', 'pages')
+TIMEOUT = getattr(settings, 'PAGE_CACHE_SECONDS', 10 * 60)
+
+HITS_KEY = 'page-cache:hits'
+MISSES_KEY = 'page-cache:misses'
+
+
+def backend():
+    return caches[CACHE_ALIAS]
+
+
+def _version_keys(tag):
+    """Version keys a page tagged ``tag`` depends on."""
+    kind, _, name = tag.partition(':')
+    if name == '*':
+        return [f'page-cache:any:{kind}']
+    return [f'page-cache:tag:{tag}', f'page-cache:all:{kind}']
+
+
+def _bumped_keys(tag):
+    """Version keys that change when ``tag`` is invalidated."""
+    kind, _, name = tag.partition(':')
+    if name == '*':
+        return [f'page-cache:any:{kind}', f'page-cache:all:{kind}']
+    return [f'page-cache:tag:{tag}', f'page-cache:any:{kind}']
+
+
+def _new_token():
+    return uuid.uuid4().hex[:12]
+
+
+def invalidate(*tags):
+    """Invalidate every cached page carrying any of ``tags``."""
+    keys = {key for tag in tags for key in _bumped_keys(tag)}
+    # A fresh random token, not a counter: an evicted version key can then
+    # never come back with a value an old entry was stored with.
+    backend().set_many({key: _new_token() for key in keys}, timeout=None)
+
+
+def _current_versions(keys):
+    cache = backend()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            token = _new_token()
+            versions[key] = token if cache.add(key, token, timeout=None) else cache.get(key)
+    return versions
+
+
+def _count(key):
+    cache = backend()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); losing one count is fine
+        pass
+
+
+def stats():
+    """Return hits, misses and hit rate counted by this cache backend."""
+    counts = backend().get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counts.get(HITS_KEY, 0), counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def reset_stats():
+    backend().delete_many([HITS_KEY, MISSES_KEY])
+
+
+def add_tags(request, *tags):
+    """Tag the page being rendered for ``request`` (no-op when not cached)."""
+    if hasattr(request, 'page_cache_tags'):
+        request.page_cache_tags.update(tags)
+
+
+def page_key(request, params=()):
+    query = '&'.join(
+        f'{name}={value}'
+        for name in sorted(params)
+        for value in request.GET.getlist(name)
+    )
+    raw = f'{request.get_host()}{request.path}?{query}'
+    return 'page-cache:page:' + hashlib.md5(raw.encode()).hexdigest()
+
+
+def _cacheable_request(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def _cacheable_response(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    if 'private' in response.get('Cache-Control', '') or response.has_header('Vary'):
+        return False
+    # The page would set a session or CSRF cookie on its way out
+    if getattr(request, 'session', None) is not None and request.session.modified:
+        return False
+    return not request.META.get('CSRF_COOKIE_USED')
+
+
+def cache_anonymous(tags=(), params=()):
+    """
+    Cache a view's page for anonymous visitors.
+
+    Args:
+        tags: Tags every page of this view carries; the view can add more
+            with ``add_tags(request, ...)``
+        params: Query parameters that change the page; the rest are
+            ignored when building the cache key
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _cacheable_request(request):
+                return view(request, *args, **kwargs)
+
+            cache = backend()
+            key = page_key(request, params)
+            entry = cache.get(key)
+            if entry is not None and _current_versions(list(entry['versions'])) == entry['versions']:
+                _count(HITS_KEY)
+                response = HttpResponse(entry['content'], content_type=entry['content_type'])
+                response['X-Page-Cache'] = 'hit'
+                return response
+
+            _count(MISSES_KEY)
+            request.page_cache_tags = set(tags)
+            response = view(request, *args, **kwargs)
+
+            if _cacheable_response(request, response):
+                keys = sorted({k for tag in request.page_cache_tags for k in _version_keys(tag)})
+                cache.set(key, {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'versions': _current_versions(keys),
+                }, TIMEOUT)
+                response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
+
+
+def product_changed(sender, instance, raw=False, **kwargs):
+    """post_save / post_delete receiver for Product"""
+    if raw:
+        return
+    from .models import Category
+    slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+    invalidate(f'product:{instance.pk}', f'category:{slug or "*"}')
+
+
+def category_changed(sender, instance, raw=False, **kwargs):
+    """post_save / post_delete receiver for Category"""
+    if not raw:
+        invalidate(f'category:{instance.slug}')
+
+
+def page_changed(sender, instance, raw=False, **kwargs):
+    """post_save / post_delete receiver for Page"""
+    if not raw:
+        invalidate(f'page:{instance.slug}')
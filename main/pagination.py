@@ -0,0 +1,196 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Instead of ``OFFSET n`` the next page is fetched with
+``WHERE (field, id) > (last field, last id)``, which is an index range scan
+no matter how deep the shopper pages. Ties on the ordering field are broken
+on ``id`` so no product is skipped or shown twice.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .search import SEARCH_RANK
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ordering, value, pk, reverse=False):
+    payload = {'o': ordering, 'v': str(value), 'id': pk}
+    if reverse:
+        payload['r'] = 1
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """Return (value, pk, reverse) for a cursor produced by encode_cursor for ``ordering``."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['o'] != ordering:
+            # Made for another ordering; its value means nothing here
+            raise InvalidCursor(cursor)
+        return payload['v'], int(payload['id']), bool(payload.get('r'))
+    except (TypeError, ValueError, KeyError):
+        raise InvalidCursor(cursor)
+
+
+def cursor_value(queryset, field, value):
+    """Convert a cursor's string ``value`` to the Python type of ``field`` (a model field or annotation)."""
+    try:
+        if field in queryset.query.annotations:
+            output_field = queryset.query.annotations[field].output_field
+        elif field == 'pk':
+            output_field = queryset.model._meta.pk
+        else:
+            output_field = queryset.model._meta.get_field(field)
+        return output_field.to_python(value)
+    except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+        raise InvalidCursor(value)
+
+
+class KeysetPage:
+    """One page of results plus the cursors for its neighbours"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=12):
+    """
+    Fetch one page of ``queryset`` ordered by ``ordering`` then ``id``.
+
+    Args:
+        queryset: Queryset to paginate
+        ordering: Field name, optionally prefixed with '-' for descending
+        cursor: Cursor string from a previous page, or None for the first page
+        page_size: Number of items per page
+
+    Returns:
+        KeysetPage
+
+    Raises:
+        InvalidCursor: if the cursor cannot be decoded, was made for another
+            ordering or holds a value of the wrong type
+    """
+    field = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+    reverse = False
+
+    if cursor:
+        value, pk, reverse = decode_cursor(cursor, ordering)
+        value = cursor_value(queryset, field, value)
+        # Walking backwards flips the comparison as well as the sort order
+        after = descending == reverse
+        op = 'gt' if after else 'lt'
+        # The redundant >= / <= bound lets SQLite turn the OR into an index
+        # range scan instead of filtering every row
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}e': value}),
+            Q(**{f'{field}__{op}': value}) | Q(**{f'pk__{op}': pk}),
+        )
+
+    sort_descending = descending != reverse
+    prefix = '-' if sort_descending else ''
+    items = list(queryset.order_by(f'{prefix}{field}', f'{prefix}pk')[:page_size + 1])
+
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if reverse:
+        items.reverse()
+
+    if not items:
+        return KeysetPage(items)
+
+    first, last = items[0], items[-1]
+    if reverse:
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(ordering, getattr(last, field), last.pk) if has_next else None,
+        previous_cursor=encode_cursor(ordering, getattr(first, field), first.pk, reverse=True) if has_previous else None,
+    )
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination class built on keyset_page.
+
+    The ordering comes from the ``ordering`` query parameter and must be one
+    of the view's ``ordering_fields`` (optionally prefixed with '-'). Search
+    results without an explicit ordering are ordered by relevance.
+    """
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 12)
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = request.query_params.get(self.ordering_query_param, '')
+        if ordering and ordering.lstrip('-') in getattr(view, 'ordering_fields', []):
+            return ordering
+        if SEARCH_RANK in queryset.query.annotations:
+            return SEARCH_RANK
+        return getattr(view, 'ordering', ['-pk'])[0]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        try:
+            self.page = keyset_page(
+                queryset,
+                self.get_ordering(request, queryset, view),
+                cursor=request.query_params.get(self.cursor_query_param),
+                page_size=self.page_size,
+            )
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.items
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(remove_query_param(self.base_url, 'page'), self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self._link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
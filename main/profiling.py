@@ -0,0 +1,168 @@
+"""
+Opt-in per-request profiling (``RequestProfilingMiddleware``).
+
+Enabled with ``REQUEST_PROFILING=True`` in the environment, which adds the
+middleware right after AuthenticationMiddleware (see settings). For every
+request it measures
+
+* ``db``: time spent in database queries, and how many were run,
+* ``tpl``: time spent rendering templates (top-level renders only, so an
+  ``{% include %}`` is not counted twice),
+* ``app``: the rest of the time in the view, e.g. Python code or SMTP,
+* ``total``: everything below the middleware,
+
+and reports them in a ``Server-Timing`` header, which browser developer
+tools show under the request's "Timing" tab. A sample of requests
+(``SAMPLE_RATE``) is also logged as one JSON line to the
+``main.profiling`` logger.
+
+Staff can add ``?_profile=1`` to a URL to run that one request under
+cProfile; the stats are written to ``PROFILE_DIR`` and the file name is
+returned in an ``X-Profile`` header (open it with ``python -m pstats`` or
+snakeviz).
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends import django as django_backend
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.01)
+PROFILE_PARAM = getattr(settings, 'REQUEST_PROFILING_PARAM', '_profile')
+PROFILE_DIR = getattr(settings, 'REQUEST_PROFILING_DIR', os.path.join(settings.BASE_DIR, 'cache', 'profiles'))
+
+# Timings of the request being handled in this thread or task, if any
+_current = ContextVar('request_timings', default=None)
+
+
+class Timings:
+    """What one request spent its time on, in milliseconds."""
+
+    def __init__(self):
+        self.db_ms = 0.0
+        self.queries = 0
+        self.template_ms = 0.0
+        self.total_ms = 0.0
+        self._rendering = 0
+
+    @property
+    def app_ms(self):
+        return max(self.total_ms - self.db_ms - self.template_ms, 0.0)
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.db_ms:.2f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_ms:.2f};desc="templates"',
+            f'app;dur={self.app_ms:.2f};desc="view code"',
+            f'total;dur={self.total_ms:.2f}',
+        ])
+
+    def __call__(self, execute, sql, params, many, context):
+        """``connection.execute_wrapper()`` hook timing every query."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - started) * 1000
+            self.queries += 1
+
+
+def _timed_render(render):
+    def wrapper(self, *args, **kwargs):
+        timings = _current.get()
+        if timings is None or timings._rendering:
+            return render(self, *args, **kwargs)
+        timings._rendering += 1
+        started = time.perf_counter()
+        try:
+            return render(self, *args, **kwargs)
+        finally:
+            timings._rendering -= 1
+            timings.template_ms += (time.perf_counter() - started) * 1000
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument_templates():
+    """Time every render of a Django template (idempotent)."""
+    template = django_backend.Template
+    if not getattr(template.render, 'profiled', False):
+        template.render = _timed_render(template.render)
+
+
+class RequestProfilingMiddleware:
+    """
+    Adds ``Server-Timing`` to every response, logs a sample of requests and
+    profiles a request on demand for staff.
+
+    Must come after AuthenticationMiddleware, which sets ``request.user``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        timings = Timings()
+        token = _current.set(timings)
+        profiler = cProfile.Profile() if self.wants_profile(request) else None
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                if profiler:
+                    response = profiler.runcall(self.get_response, request)
+                else:
+                    response = self.get_response(request)
+        finally:
+            timings.total_ms = (time.perf_counter() - started) * 1000
+            _current.reset(token)
+
+        response['Server-Timing'] = timings.server_timing()
+        if profiler:
+            response['X-Profile'] = self.dump_profile(profiler, request)
+        if random.random() < SAMPLE_RATE:
+            self.log(request, response, timings)
+        return response
+
+    def wants_profile(self, request):
+        if PROFILE_PARAM not in request.GET:
+            return False
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_staff)
+
+    def dump_profile(self, profiler, request):
+        """Write the stats to PROFILE_DIR and return the file name."""
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        match = request.resolver_match
+        view = match.view_name.replace(':', '-') if match else 'request'
+        name = f'{timezone.now():%Y%m%d-%H%M%S}-{view}-{uuid.uuid4().hex[:8]}.prof'
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        return name
+
+    def log(self, request, response, timings):
+        match = request.resolver_match
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(timings.total_ms, 2),
+            'db_ms': round(timings.db_ms, 2),
+            'queries': timings.queries,
+            'template_ms': round(timings.template_ms, 2),
+            'app_ms': round(timings.app_ms, 2),
+        }))
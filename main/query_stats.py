@@ -0,0 +1,211 @@
+"""
+SQL statistics per view and statement shape, and a slow-query log.
+
+``QueryStatsMiddleware`` (enabled with ``QUERY_STATS=True`` in the
+environment, see settings) installs a ``connection.execute_wrapper`` for
+each request that times every query and files it under the view's URL name
+and the query's fingerprint: its SQL with literals, placeholders, IN lists
+and multi-row VALUES collapsed, so ``WHERE id = 1`` and ``WHERE id = 2`` are
+the same statement.
+
+Counts, total time and a bounded random sample of durations (for the p95)
+are kept in memory and merged into QueryFingerprint rows at most every
+``FLUSH_SECONDS``; ``manage.py query_stats`` prints the worst offenders.
+
+Queries slower than ``SLOW_QUERY_MS`` are also logged to the
+``main.query_stats`` logger with their view and the line of project code
+that ran them.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .models import QueryFingerprint
+
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = getattr(settings, 'SLOW_QUERY_MS', 100)
+FLUSH_SECONDS = getattr(settings, 'QUERY_STATS_FLUSH_SECONDS', 60)
+MAX_SAMPLES = getattr(settings, 'QUERY_STATS_MAX_SAMPLES', 200)
+FLUSH_ATTEMPTS = 3
+
+PROJECT_DIR = str(settings.BASE_DIR)
+
+UNRESOLVED = '(unresolved)'
+
+_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%s|\b\d+(?:\.\d+)?\b'), '?'),
+    # Savepoint names are unique per transaction
+    (re.compile(r'"s\w+_x\w+"'), '"s?"'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'(?:\s*,\s*\(\.\.\.\))+'), ''),
+    # Bulk updates: CASE WHEN ... THEN ? repeated once per row
+    (re.compile(r'(WHEN \(?[^()]*?= \?\)? THEN \?)(?:\s*WHEN \(?[^()]*?= \?\)? THEN \?)+'), r'\1 ...'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(sql):
+    """``sql`` with every literal and parameter replaced by ``?`` and lists collapsed."""
+    for pattern, replacement in _PATTERNS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def call_site():
+    """'path:line (function)' of the innermost project frame, outside this module."""
+    for frame in reversed(traceback.extract_stack()[:-1]):
+        path = frame.filename
+        if path.startswith(PROJECT_DIR) and 'site-packages' not in path and path != __file__:
+            return f'{os.path.relpath(path, PROJECT_DIR)}:{frame.lineno} ({frame.name})'
+    return 'unknown'
+
+
+class Stat:
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = []
+
+    def add(self, duration_ms):
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        # Reservoir sampling keeps every duration equally likely to stay
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(duration_ms)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = duration_ms
+
+
+class Collector:
+    """In-memory statistics of this process, keyed on (view, fingerprint)."""
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+
+    def add(self, view, sql, duration_ms):
+        key = (view, fingerprint(sql))
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = Stat(key[1])
+            stat.add(duration_ms)
+
+    def flush_due(self):
+        return time.monotonic() - self.flushed_at >= FLUSH_SECONDS
+
+    def flush(self):
+        """Merge the collected statistics into QueryFingerprint rows."""
+        with self.lock:
+            stats, self.stats = self.stats, {}
+            self.flushed_at = time.monotonic()
+        if not stats:
+            return 0
+
+        keys = {(view, hashlib.sha1(sql.encode()).hexdigest()): stat for (view, sql), stat in stats.items()}
+        for attempt in range(FLUSH_ATTEMPTS):
+            try:
+                self._merge(keys)
+                return len(keys)
+            except IntegrityError:
+                # Another process created one of our new rows first; the next
+                # attempt finds it and adds to it
+                if attempt == FLUSH_ATTEMPTS - 1:
+                    raise
+
+    def _merge(self, keys):
+        now = timezone.now()
+        with transaction.atomic():
+            rows = {
+                (row.view, row.digest): row
+                for row in QueryFingerprint.objects.select_for_update().filter(
+                    view__in={view for view, _ in keys}, digest__in={digest for _, digest in keys},
+                )
+            }
+            new = []
+            for (view, digest), stat in keys.items():
+                row = rows.get((view, digest))
+                if row is None:
+                    new.append(QueryFingerprint(
+                        view=view, digest=digest, fingerprint=stat.sql, count=stat.count,
+                        total_ms=stat.total_ms, max_ms=stat.max_ms, samples=stat.samples,
+                    ))
+                    continue
+                row.last_seen = now
+                row.count += stat.count
+                row.total_ms += stat.total_ms
+                row.max_ms = max(row.max_ms, stat.max_ms)
+                samples = row.samples + stat.samples
+                row.samples = random.sample(samples, MAX_SAMPLES) if len(samples) > MAX_SAMPLES else samples
+            QueryFingerprint.objects.bulk_update(
+                list(rows.values()), ['count', 'total_ms', 'max_ms', 'samples', 'last_seen'],
+            )
+            QueryFingerprint.objects.bulk_create(new)
+
+
+collector = Collector()
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper()`` hook filing every query of one request."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def view(self):
+        # Unresolved until URL routing; 404s stay unresolved, and are not
+        # filed by path so that random URLs cannot grow the table
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match else UNRESOLVED
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            collector.add(self.view, sql, duration_ms)
+            if duration_ms >= SLOW_QUERY_MS:
+                logger.warning('slow query %.1fms in %s at %s: %s', duration_ms, self.view, call_site(), sql)
+
+
+class QueryStatsMiddleware:
+    """Collects the statistics of every query run while handling a request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(request)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        if collector.flush_due():
+            try:
+                collector.flush()
+            except Exception:
+                # Statistics are best-effort; never fail the request for them
+                logger.exception('Could not save query statistics')
+        return response
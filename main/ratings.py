@@ -0,0 +1,154 @@
+"""
+Denormalized review aggregates per product.
+
+ProductRating keeps running sums and counts (not means) for each product,
+so a review being created, edited or deleted is applied as a delta with a
+single UPDATE instead of re-aggregating every review. ``Product.rating`` is
+kept equal to the mean rating, so listings read it as a plain column.
+
+``rebuild()`` (``manage.py rebuild_ratings``) recomputes everything from the
+Review table in one GROUP BY query.
+"""
+from django.db import transaction
+from django.db.models import Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce
+
+from . import page_cache
+from .models import Product, ProductRating, Review
+
+
+FIT_FIELDS = {value: f'fit_{value}' for value, _ in Review.TRUE_TO_SIZE_CHOICES}
+WIDTH_FIELDS = {value: f'width_{value}' for value, _ in Review.WIDTH_CHOICES}
+
+COUNTERS = ['review_count', 'rating_sum', 'comfort_sum', 'recommend_count',
+            *FIT_FIELDS.values(), *WIDTH_FIELDS.values()]
+
+BATCH_SIZE = 500
+
+
+def contribution(rating, comfort_rating, would_recommend, true_to_size, width_feedback):
+    """What one review adds to its product's counters."""
+    delta = {
+        'review_count': 1,
+        'rating_sum': rating,
+        'comfort_sum': comfort_rating,
+        'recommend_count': int(would_recommend),
+    }
+    if true_to_size in FIT_FIELDS:
+        delta[FIT_FIELDS[true_to_size]] = 1
+    if width_feedback in WIDTH_FIELDS:
+        delta[WIDTH_FIELDS[width_feedback]] = 1
+    return delta
+
+
+def _review_contribution(review):
+    return contribution(review.rating, review.comfort_rating, review.would_recommend,
+                        review.true_to_size, review.width_feedback)
+
+
+def _sync_product_rating(product_ids):
+    mean = ProductRating.objects.filter(pk=OuterRef('pk'), review_count__gt=0).annotate(
+        mean=Cast('rating_sum', FloatField()) / F('review_count')
+    ).values('mean')
+    Product.objects.filter(pk__in=product_ids).update(rating=Coalesce(Subquery(mean), Value(0.0)))
+
+
+def apply(product_id, delta, sign=1):
+    """Add (sign=1) or remove (sign=-1) a review's contribution."""
+    changes = {field: F(field) + sign * amount for field, amount in delta.items() if amount}
+    with transaction.atomic():
+        if not ProductRating.objects.filter(pk=product_id).update(**changes):
+            # No row yet: the review table already reflects the change
+            rebuild([product_id])
+            return
+        _sync_product_rating([product_id])
+    page_cache.invalidate(f'product:{product_id}')
+
+
+def rebuild(product_ids=None):
+    """
+    Recompute aggregates from the Review table.
+
+    Args:
+        product_ids: Products to rebuild (default: every product)
+
+    Returns:
+        int: number of products written
+    """
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    ids = list(products.values_list('pk', flat=True))
+
+    for start in range(0, len(ids), BATCH_SIZE):
+        _rebuild_batch(ids[start:start + BATCH_SIZE])
+    page_cache.invalidate(*[f'product:{pk}' for pk in ids] if product_ids is not None else ['product:*'])
+    return len(ids)
+
+
+def _rebuild_batch(product_ids):
+    aggregates = {
+        'review_count': Count('pk'),
+        'rating_sum': Sum('rating'),
+        'comfort_sum': Sum('comfort_rating'),
+        'recommend_count': Count('pk', filter=Q(would_recommend=True)),
+    }
+    for value, field in FIT_FIELDS.items():
+        aggregates[field] = Count('pk', filter=Q(true_to_size=value))
+    for value, field in WIDTH_FIELDS.items():
+        aggregates[field] = Count('pk', filter=Q(width_feedback=value))
+
+    totals = {
+        row['product_id']: row
+        for row in Review.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(**aggregates).order_by()
+    }
+
+    rows = [
+        ProductRating(product_id=pk, **{
+            field: totals[pk][field] if pk in totals else 0 for field in COUNTERS
+        })
+        for pk in product_ids
+    ]
+    with transaction.atomic():
+        ProductRating.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['product'], update_fields=COUNTERS,
+        )
+        _sync_product_rating(product_ids)
+
+
+def review_pre_save(sender, instance, raw=False, **kwargs):
+    """Remember what an edited review contributed before the edit."""
+    instance._rating_before = None
+    if raw or instance.pk is None:
+        return
+    previous = Review.objects.filter(pk=instance.pk).values_list(
+        'product_id', 'rating', 'comfort_rating', 'would_recommend', 'true_to_size', 'width_feedback'
+    ).first()
+    if previous is not None:
+        instance._rating_before = (previous[0], contribution(*previous[1:]))
+
+
+def review_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    after = _review_contribution(instance)
+    before = getattr(instance, '_rating_before', None)
+
+    if before is None:
+        changes = [(instance.product_id, after, 1)]
+    elif before[0] != instance.product_id:
+        changes = [(before[0], before[1], -1), (instance.product_id, after, 1)]
+    else:
+        delta = {field: after.get(field, 0) - before[1].get(field, 0) for field in COUNTERS}
+        changes = [(instance.product_id, delta, 1)] if any(delta.values()) else []
+    # Deferred like deletes, so a save that is rolled back leaves the summary alone
+    for product_id, delta, sign in changes:
+        transaction.on_commit(lambda product_id=product_id, delta=delta, sign=sign: apply(product_id, delta, sign))
+
+
+def review_deleted(sender, instance, **kwargs):
+    product_id, delta = instance.product_id, _review_contribution(instance)
+    # Deferred so that when the product is deleted with its reviews, both
+    # rows are gone and apply() finds nothing to update or rebuild
+    transaction.on_commit(lambda: apply(product_id, delta, sign=-1))
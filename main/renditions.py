@@ -0,0 +1,181 @@
+"""
+Resized WebP and JPEG renditions of product media.
+
+Every uploaded image (``Product.image``, ``ProductImage.image`` and
+``ProductVariant.color_image``) gets a copy per configured width and format,
+stored next to the other media under a name derived from the original:
+
+    products/chelsea_boots.png -> renditions/products/chelsea_boots.png/400w.webp
+
+Names are deterministic, so templates can build a ``srcset`` from the field
+value alone (see the ``product_images`` template tags) and regenerating is
+idempotent. Widths at or above the original's width are not produced: the
+original is always the largest candidate.
+
+Which widths exist is kept in the default cache per image (written when
+renditions are generated), so rendering a listing does not stat a file per
+width and image; another process may see a new image's renditions up to
+``CACHE_TIMEOUT`` seconds late.
+
+Renditions are made when a model with a new image is saved and in bulk by
+``manage.py generate_renditions``.
+"""
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Product, ProductImage, ProductVariant
+
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = tuple(getattr(settings, 'IMAGE_RENDITION_WIDTHS', (200, 400, 800, 1200)))
+
+# extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+PREFIX = 'renditions'
+
+CACHE_TIMEOUT = getattr(settings, 'IMAGE_RENDITION_CACHE_SECONDS', 60 * 60)
+
+# (model, field name) of every image field that gets renditions
+IMAGE_FIELDS = [
+    (Product, 'image'),
+    (ProductImage, 'image'),
+    (ProductVariant, 'color_image'),
+]
+
+
+def rendition_name(name, width, ext):
+    return posixpath.join(PREFIX, name, f'{width}w.{ext}')
+
+
+def _widths_key(name):
+    # Image names may hold characters cache backends reject in keys
+    return f'renditions:{hashlib.md5(name.encode()).hexdigest()}'
+
+
+def stored_widths(name, storage=default_storage):
+    """Widths whose renditions of ``name`` are in storage, smallest first."""
+    # Widths are generated smallest first, so stop at the first gap
+    widths = []
+    for width in WIDTHS:
+        if not storage.exists(rendition_name(name, width, 'webp')):
+            break
+        widths.append(width)
+    return widths
+
+
+def available_widths(name, storage=default_storage):
+    """Widths that have been generated for ``name``, smallest first, from the cache when known."""
+    key = _widths_key(name)
+    widths = cache.get(key)
+    if widths is None:
+        widths = stored_widths(name, storage)
+        cache.set(key, widths, CACHE_TIMEOUT)
+    return widths
+
+
+def srcset(name, ext='webp', storage=default_storage, widths=None):
+    """
+    ``srcset`` value listing the renditions of ``name`` ('' if there are none).
+
+    Args:
+        widths: Result of available_widths(name), when the caller has it already
+    """
+    if not name:
+        return ''
+    if widths is None:
+        widths = available_widths(name, storage)
+    return ', '.join(f'{storage.url(rendition_name(name, width, ext))} {width}w' for width in widths)
+
+
+def encode(image, fmt, options):
+    if fmt == 'JPEG' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent areas onto white
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif fmt == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, fmt, **options)
+    return buffer.getvalue()
+
+
+def generate(name, force=False, storage=default_storage):
+    """
+    Write every missing rendition of one stored image.
+
+    Args:
+        name: Storage name of the original (the image field's value)
+        force: Re-encode renditions that already exist
+
+    Returns:
+        tuple: (number of files written, total bytes written)
+    """
+    if not name or not storage.exists(name):
+        return 0, 0
+    try:
+        with storage.open(name, 'rb') as source:
+            original = ImageOps.exif_transpose(Image.open(source))
+            original.load()
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f'Cannot make renditions of {name}: {str(e)}')
+        return 0, 0
+
+    written = size = 0
+    for width in WIDTHS:
+        if width >= original.width:
+            break
+        resized = None
+        for ext, (fmt, options) in FORMATS.items():
+            target = rendition_name(name, width, ext)
+            if storage.exists(target):
+                if not force:
+                    continue
+                storage.delete(target)
+            if resized is None:
+                height = round(original.height * width / original.width)
+                resized = original.resize((width, height), Image.LANCZOS)
+            data = encode(resized, fmt, options)
+            storage.save(target, ContentFile(data))
+            written += 1
+            size += len(data)
+    cache.set(_widths_key(name), [width for width in WIDTHS if width < original.width], CACHE_TIMEOUT)
+    return written, size
+
+
+def stored_names():
+    """Distinct image names referenced by any model, sorted."""
+    names = set()
+    for model, field in IMAGE_FIELDS:
+        names.update(
+            model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+            .values_list(field, flat=True).distinct()
+        )
+    return sorted(names)
+
+
+def image_saved(sender, instance, raw=False, **kwargs):
+    """post_save receiver for Product, ProductImage and ProductVariant"""
+    if raw:
+        return
+    for model, field in IMAGE_FIELDS:
+        if sender is model:
+            name = getattr(instance, field).name
+            if name and not available_widths(name):
+                # After commit, so a failed save never leaves files behind
+                transaction.on_commit(lambda name=name: generate(name))
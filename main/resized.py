@@ -0,0 +1,154 @@
+"""
+On-demand resizing of media images for ``/media/resized/<w>x<h>/<path>``.
+
+Only the sizes in ``ALLOWED_SIZES`` are served, so a client cannot make the
+server encode (and store) an unbounded number of variants of each image.
+
+Results live in a content-addressed disk cache: the file name is a hash of
+the source image's bytes and the requested size, so re-uploading the same
+picture under another name reuses the cached result, and that hash doubles
+as a strong ETag. The source hash is memoized per (name, mtime, size) so a
+cache hit reads no image data besides the result itself.
+
+The cache is capped at ``MAX_BYTES``. Hits refresh a file's mtime; when the
+running total goes over the cap the least recently used files are removed
+until it is back under 90% of it.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .renditions import FORMATS, encode
+
+
+ALLOWED_SIZES = {tuple(size) for size in getattr(settings, 'RESIZED_IMAGE_SIZES', [
+    (64, 64), (120, 120), (240, 240), (400, 400), (600, 300),
+])}
+CACHE_DIR = getattr(settings, 'RESIZED_IMAGE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'resized'))
+MAX_BYTES = getattr(settings, 'RESIZED_IMAGE_CACHE_BYTES', 256 * 1024 * 1024)
+MAX_AGE = getattr(settings, 'RESIZED_IMAGE_MAX_AGE', 365 * 24 * 60 * 60)
+
+EXT = 'jpg'
+CONTENT_TYPE = 'image/jpeg'
+TOTAL_KEY = 'resized:total-bytes'
+
+
+class ResizeError(Exception):
+    """The source image is missing or cannot be decoded"""
+
+
+def _source_digest(name):
+    """sha256 of a stored image's bytes, memoized until the file changes."""
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, NotImplementedError, OSError) as e:
+        raise ResizeError(name) from e
+
+    key = 'resized:digest:' + hashlib.md5(f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        cache.set(key, digest, None)
+    return digest
+
+
+def cache_path(digest):
+    return os.path.join(CACHE_DIR, digest[:2], f'{digest}.{EXT}')
+
+
+def _render(name, width, height):
+    try:
+        with default_storage.open(name, 'rb') as source:
+            image = ImageOps.exif_transpose(Image.open(source))
+            # Cover the box and crop the overflow, centered
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ResizeError(name) from e
+    fmt, options = FORMATS[EXT]
+    return encode(image, fmt, options)
+
+
+def _store(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so a concurrent reader never sees a partial file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    cache.add(TOTAL_KEY, 0, None)
+    try:
+        total = cache.incr(TOTAL_KEY, len(data))
+    except ValueError:
+        total = MAX_BYTES + 1
+    if total > MAX_BYTES:
+        prune()
+
+
+def prune(max_bytes=None):
+    """
+    Remove least recently used files until the cache is under 90% of its cap.
+
+    Returns:
+        tuple: (files removed, bytes left in the cache)
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    for root, _, files in os.walk(CACHE_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    target = int(max_bytes * 0.9)
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    cache.set(TOTAL_KEY, total, None)
+    return removed, total
+
+
+def resized(name, width, height):
+    """
+    Path and ETag of ``name`` resized to ``width`` x ``height``.
+
+    Args:
+        name: Storage name of the source image
+        width, height: One of ``ALLOWED_SIZES``
+
+    Returns:
+        tuple: (path of the cached file, etag)
+
+    Raises:
+        ResizeError: the source does not exist or is not an image
+    """
+    digest = hashlib.sha256(f'{_source_digest(name)}:{width}x{height}:{EXT}'.encode()).hexdigest()
+    path = cache_path(digest)
+    try:
+        # Mark as recently used for prune()
+        os.utime(path)
+    except FileNotFoundError:
+        _store(path, _render(name, width, height))
+    return path, f'"{digest}"'
@@ -0,0 +1,180 @@
+"""
+Full-text product search backed by an SQLite FTS5 index.
+
+``main_product_fts`` is an external-content FTS5 table over the name,
+description and material of ``main_product``; triggers on the product table
+keep it in sync, so bulk inserts and queryset updates are indexed too. A
+search asks the index for the best matching product ids ordered by bm25 and
+the rest of the query (filters, pagination) runs against ``Product`` as usual.
+
+Results ordered by relevance are capped at ``MAX_RESULTS``; any other
+ordering (price, name) sees every match.
+
+On databases without FTS5 the search falls back to ``icontains`` lookups.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Concat, StrIndex
+from rest_framework import filters
+
+
+FTS_TABLE = 'main_product_fts'
+
+# Name of the annotation ordering search results, best match first
+SEARCH_RANK = 'search_rank'
+
+# Ranked results are capped; nobody pages past the first few hundred hits
+MAX_RESULTS = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 500)
+
+# bm25 column weights for name, description, material
+WEIGHTS = (10.0, 1.0, 5.0)
+
+_COLUMNS = 'name, description, material'
+
+SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_COLUMNS}, content='main_product', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+]
+
+# Triggers live on main_product, so a migration that rebuilds that table
+# drops them; install_triggers() recreates them after every migrate.
+TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON main_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS})
+        VALUES (new.id, new.name, new.description, new.material);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON main_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS})
+        VALUES ('delete', old.id, old.name, old.description, old.material);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au
+    AFTER UPDATE OF name, description, material ON main_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMNS})
+        VALUES ('delete', old.id, old.name, old.description, old.material);
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMNS})
+        VALUES (new.id, new.name, new.description, new.material);
+    END""",
+]
+
+DROP = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+# Whether the SQLite library of each connection alias was built with FTS5
+_fts5 = {}
+
+
+def fts_available(conn=None):
+    conn = conn or connection
+    if conn.vendor != 'sqlite':
+        return False
+    if conn.alias not in _fts5:
+        with conn.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            _fts5[conn.alias] = 'ENABLE_FTS5' in {row[0] for row in cursor.fetchall()}
+    return _fts5[conn.alias]
+
+
+def install_triggers(conn=None):
+    conn = conn or connection
+    if not fts_available(conn) or FTS_TABLE not in conn.introspection.table_names():
+        return
+    with conn.cursor() as cursor:
+        for statement in TRIGGERS:
+            cursor.execute(statement)
+
+
+def rebuild_index():
+    """Recreate the index and its triggers and re-read every product."""
+    with connection.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+        install_triggers()
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def build_match(terms):
+    """
+    Build an FTS5 MATCH expression requiring every term.
+
+    Terms are quoted so user input can never be read as FTS5 syntax, and the
+    last one is a prefix match so results appear while the shopper types.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def ranked_ids(query, limit=None):
+    """Return ids of the ``limit`` (default: MAX_RESULTS) products matching ``query`` best, best first."""
+    limit = limit or MAX_RESULTS
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    weights = ', '.join(str(weight) for weight in WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+            [build_match(terms), limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(queryset, query, ranked=True):
+    """
+    Restrict a Product queryset to ``query`` matches.
+
+    The result is annotated with ``search_rank`` (lower is a better match),
+    which can be used as an ordering. Pass ``ranked=False`` when the results
+    are ordered some other way; the rank is then 0 for every match and the
+    ``MAX_RESULTS`` cap does not apply.
+    """
+    if not fts_available():
+        condition = Q()
+        for term in search_terms(query):
+            condition &= Q(name__icontains=term) | Q(description__icontains=term) | Q(material__icontains=term)
+        return queryset.filter(condition).annotate(**{SEARCH_RANK: Value(0)})
+
+    terms = search_terms(query)
+    if terms and not ranked:
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [build_match(terms)])
+        return queryset.filter(pk__in=matches).annotate(**{SEARCH_RANK: Value(0)})
+
+    ids = ranked_ids(query)
+    if not ids:
+        return queryset.none().annotate(**{SEARCH_RANK: Value(0)})
+
+    # The rank is the offset of ",<id>," in the comma-joined ranking. One
+    # INSTR() is far cheaper to build and run than a CASE with a branch per id.
+    ranking = Value(',' + ','.join(map(str, ids)) + ',')
+    rank = StrIndex(ranking, Concat(Value(','), Cast('pk', CharField()), Value(',')))
+    return queryset.filter(pk__in=ids).annotate(**{SEARCH_RANK: rank})
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """DRF filter backend answering the ``search`` parameter from the FTS index"""
+
+    def filter_queryset(self, request, queryset, view):
+        query = ' '.join(self.get_search_terms(request))
+        if not query:
+            return queryset
+        # The same test KeysetPagination uses to pick an explicit ordering
+        ordering = request.query_params.get('ordering', '')
+        ranked = ordering.lstrip('-') not in getattr(view, 'ordering_fields', [])
+        return search_products(queryset, query, ranked=ranked)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from . import renditions
 from .models import (
     Category, Product, Cart, Order, OrderItem, 
     Review, NewsletterSubscription, Page, SocialMediaLink
@@ -17,15 +18,21 @@ class ProductSerializer(serializers.ModelSerializer):
     """Serializer for Product model with category details"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_slug = serializers.CharField(source='category.slug', read_only=True)
+    review_count = serializers.IntegerField(source='rating_summary.review_count', read_only=True, default=0)
+    image_srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'price', 'category', 
             'category_name', 'category_slug', 'image', 'featured', 
-            'rating', 'created_at'
+            'rating', 'review_count', 'image_srcset', 'created_at'
         ]
-        read_only_fields = ['created_at']
+        read_only_fields = ['created_at', 'rating']
+
+    def get_image_srcset(self, obj):
+        """WebP renditions of the main image, for <img srcset> on product cards"""
+        return renditions.srcset(obj.image.name)
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -47,6 +54,21 @@ class CartItemSerializer(serializers.ModelSerializer):
         return obj.product.price * obj.quantity
 
 
+class CartLineSerializer(serializers.Serializer):
+    """Serializer for hydrated cart lines from either the database or the session cart"""
+    id = serializers.IntegerField(read_only=True, allow_null=True)
+    product = serializers.IntegerField(source='product_id', read_only=True)
+    product_id = serializers.IntegerField(read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    product_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
+    product_image = serializers.ImageField(source='product.image', read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    size = serializers.CharField(read_only=True)
+    color = serializers.CharField(read_only=True)
+    subtotal = serializers.DecimalField(source='total_price', max_digits=10, decimal_places=2, read_only=True)
+    created_at = serializers.DateTimeField(read_only=True, allow_null=True)
+
+
 class CartCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating/updating cart items"""
     class Meta:
@@ -6,7 +6,7 @@ class ProductManager {
     constructor() {
         // API Configuration
         this.apiBaseUrl = '/api/products/';
-        this.currentPage = 1;
+        this.cursor = null;
         this.currentFilters = {
             search: '',
             category: '',
@@ -54,7 +54,7 @@ class ProductManager {
             this.applyPriceBtn.addEventListener('click', () => {
                 this.currentFilters.minPrice = this.minPriceInput.value;
                 this.currentFilters.maxPrice = this.maxPriceInput.value;
-                this.currentPage = 1;
+                this.cursor = null;
                 this.loadProducts();
             });
         }
@@ -63,7 +63,7 @@ class ProductManager {
         if (this.sortSelect) {
             this.sortSelect.addEventListener('change', (e) => {
                 this.currentFilters.ordering = e.target.value;
-                this.currentPage = 1;
+                this.cursor = null;
                 this.loadProducts();
             });
         }
@@ -73,7 +73,7 @@ class ProductManager {
         sizeCheckboxes.forEach(checkbox => {
             checkbox.addEventListener('change', () => {
                 this.updateArrayFilter('size', checkbox.value, checkbox.checked);
-                this.currentPage = 1;
+                this.cursor = null;
                 this.loadProducts();
             });
         });
@@ -83,7 +83,7 @@ class ProductManager {
         colorCheckboxes.forEach(checkbox => {
             checkbox.addEventListener('change', () => {
                 this.updateArrayFilter('color', checkbox.value, checkbox.checked);
-                this.currentPage = 1;
+                this.cursor = null;
                 this.loadProducts();
             });
         });
@@ -99,10 +99,17 @@ class ProductManager {
     checkUrlParams() {
         const urlParams = new URLSearchParams(window.location.search);
         const category = urlParams.get('category');
+        const search = urlParams.get('search');
 
         if (category) {
             this.currentFilters.category = category;
         }
+        if (search) {
+            // Search results default to relevance order
+            this.currentFilters.search = search;
+            this.currentFilters.ordering = urlParams.get('ordering') || '';
+            if (this.sortSelect) this.sortSelect.value = this.currentFilters.ordering;
+        }
     }
 
     resetFilters() {
@@ -130,7 +137,7 @@ class ProductManager {
             item.classList.remove('active');
         });
 
-        this.currentPage = 1;
+        this.cursor = null;
         this.loadProducts();
     }
 
@@ -180,6 +187,7 @@ class ProductManager {
         });
 
         this.categoryListElement.innerHTML = html;
+        this.renderFacetCounts();
 
         // Add click listeners
         document.querySelectorAll('.category-item').forEach(item => {
@@ -190,7 +198,7 @@ class ProductManager {
 
                 // Update filter
                 this.currentFilters.category = item.dataset.slug;
-                this.currentPage = 1;
+                this.cursor = null;
                 this.loadProducts();
             });
         });
@@ -203,7 +211,7 @@ class ProductManager {
         try {
             // Build query string
             const params = new URLSearchParams();
-            params.append('page', this.currentPage);
+            if (this.cursor) params.append('cursor', this.cursor);
 
             if (this.currentFilters.search) params.append('search', this.currentFilters.search);
             if (this.currentFilters.category) params.append('category__slug', this.currentFilters.category);
@@ -211,15 +219,9 @@ class ProductManager {
             if (this.currentFilters.minPrice) params.append('min_price', this.currentFilters.minPrice);
             if (this.currentFilters.maxPrice) params.append('max_price', this.currentFilters.maxPrice);
 
-            // Add size filter (only first selected size for now)
-            if (this.currentFilters.size.length > 0) {
-                params.append('size', this.currentFilters.size[0]);
-            }
-
-            // Add color filter (only first selected color for now)
-            if (this.currentFilters.color.length > 0) {
-                params.append('color', this.currentFilters.color[0]);
-            }
+            // Selected sizes and colors (a product matches any of them)
+            this.currentFilters.size.forEach(size => params.append('size', size));
+            this.currentFilters.color.forEach(color => params.append('color', color));
 
             const url = `${this.apiBaseUrl}?${params.toString()}`;
             const response = await fetch(url);
@@ -236,9 +238,13 @@ class ProductManager {
 
             this.renderProducts(data.results);
             this.renderPagination(data);
+            if (data.facets) {
+                this.facets = data.facets;
+                this.renderFacetCounts();
+            }
 
             if (this.countElement) {
-                this.countElement.textContent = `Showing ${data.results.length} of ${data.count} products`;
+                this.countElement.textContent = `Showing ${data.results.length} products`;
             }
 
         } catch (error) {
@@ -252,6 +258,39 @@ class ProductManager {
         }
     }
 
+    renderFacetCounts() {
+        if (!this.facets) return;
+
+        const setCount = (element, count) => {
+            let badge = element.querySelector('.facet-count');
+            if (!badge) {
+                badge = document.createElement('span');
+                badge.className = 'facet-count';
+                element.appendChild(badge);
+            }
+            badge.textContent = ` (${count})`;
+        };
+
+        ['size', 'color'].forEach(name => {
+            const counts = {};
+            this.facets[`${name}s`].forEach(facet => counts[facet.value] = facet.count);
+            document.querySelectorAll(`input[name="${name}"]`).forEach(checkbox => {
+                const count = counts[checkbox.value] || 0;
+                const label = checkbox.closest('label');
+                if (label) {
+                    setCount(label, count);
+                    label.classList.toggle('is-empty', count === 0 && !checkbox.checked);
+                }
+            });
+        });
+
+        const categoryCounts = {};
+        this.facets.categories.forEach(facet => categoryCounts[facet.slug] = facet.count);
+        document.querySelectorAll('.category-item').forEach(item => {
+            if (item.dataset.slug) setCount(item, categoryCounts[item.dataset.slug] || 0);
+        });
+    }
+
     showLoading() {
         this.gridElement.innerHTML = `
             <div class="loading-spinner">
@@ -290,13 +329,17 @@ class ProductManager {
     clearFilter(type) {
         if (type === 'search') {
             this.currentFilters.search = '';
+            if (!this.currentFilters.ordering) {
+                this.currentFilters.ordering = '-created_at';
+                if (this.sortSelect) this.sortSelect.value = '-created_at';
+            }
         } else if (type === 'price') {
             this.currentFilters.minPrice = '';
             this.currentFilters.maxPrice = '';
             if (this.minPriceInput) this.minPriceInput.value = '';
             if (this.maxPriceInput) this.maxPriceInput.value = '';
         }
-        this.currentPage = 1;
+        this.cursor = null;
         this.loadProducts();
     }
 
@@ -374,7 +417,8 @@ class ProductManager {
                 <div class="product-image-wrapper">
                     ${discountBadge}
                     <a href="/product/${product.id}/" class="product-card-link">
-                        <img src="${product.image || '/static/images/placeholder.png'}" alt="${product.name}" class="product-image">
+                        <img src="${product.image || '/static/images/placeholder.png'}" alt="${product.name}" class="product-image" loading="lazy"
+                            ${product.image_srcset ? `srcset="${product.image_srcset}" sizes="(max-width: 600px) 50vw, (max-width: 1024px) 33vw, 300px"` : ''}>
                     </a>
                     <button class="quick-add-btn" data-id="${product.id}">Quick Add</button>
                 </div>
@@ -384,6 +428,7 @@ class ProductManager {
                         <p class="product-color-variant">${product.color_name || product.category_name || 'Classic Color'}</p>
                     </a>
                     ${colorSwatches}
+                    ${product.review_count ? `<div class="product-card-rating"><i class="fas fa-star"></i> ${Number(product.rating).toFixed(1)} (${product.review_count})</div>` : ''}
                     <div class="product-footer">
                         ${priceHTML}
                     </div>
@@ -398,46 +443,31 @@ class ProductManager {
             return;
         }
 
-        let html = '';
+        // The API pages with opaque cursors, so only previous/next navigation is possible
+        this.previousCursor = this.cursorFromUrl(data.previous);
+        this.nextCursor = this.cursorFromUrl(data.next);
 
-        // Previous Button
-        html += `
+        this.paginationElement.innerHTML = `
         <button class="pagination-btn" 
-                ${!data.previous ? 'disabled' : ''}
-                onclick="productManager.changePage(${this.currentPage - 1})">
+                ${!this.previousCursor ? 'disabled' : ''}
+                onclick="productManager.changePage(productManager.previousCursor)">
             <i class="fas fa-chevron-left"></i>
         </button>
-        `;
-
-        // Page Numbers (Simplified)
-        const totalPages = Math.ceil(data.count / 20); // Assuming page size 20
-        for (let i = 1; i <= totalPages; i++) {
-            if (i === 1 || i === totalPages || (i >= this.currentPage - 1 && i <= this.currentPage + 1)) {
-                html += `
-                <button class="pagination-btn ${i === this.currentPage ? 'active' : ''}"
-                        onclick="productManager.changePage(${i})">
-                    ${i}
-                </button>
-                `;
-            } else if (i === this.currentPage - 2 || i === this.currentPage + 2) {
-                html += `<span class="pagination-dots">...</span>`;
-            }
-        }
-
-        // Next Button
-        html += `
         <button class="pagination-btn" 
-                ${!data.next ? 'disabled' : ''}
-                onclick="productManager.changePage(${this.currentPage + 1})">
+                ${!this.nextCursor ? 'disabled' : ''}
+                onclick="productManager.changePage(productManager.nextCursor)">
             <i class="fas fa-chevron-right"></i>
         </button>
         `;
+    }
 
-        this.paginationElement.innerHTML = html;
+    cursorFromUrl(url) {
+        return url ? new URL(url, window.location.origin).searchParams.get('cursor') : null;
     }
 
-    changePage(page) {
-        this.currentPage = page;
+    changePage(cursor) {
+        if (!cursor) return;
+        this.cursor = cursor;
         this.loadProducts();
         window.scrollTo({ top: 0, behavior: 'smooth' });
     }
@@ -0,0 +1,49 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import format_html
+
+from main import renditions
+
+
+register = template.Library()
+
+
+@register.filter
+def srcset(image, ext='webp'):
+    """
+    ``srcset`` value listing the renditions of an image field.
+
+    Usage: <img src="{{ product.image.url }}" srcset="{{ product.image|srcset:'jpg' }}">
+    """
+    return renditions.srcset(getattr(image, 'name', image), ext)
+
+
+@register.simple_tag
+def picture(image, alt='', sizes='100vw', css_class='', loading='lazy'):
+    """
+    ``<picture>`` offering WebP and JPEG renditions, with the original as fallback.
+
+    Usage: {% picture product.image alt=product.name sizes="(max-width: 600px) 50vw, 300px" %}
+    """
+    if not image:
+        return ''
+    widths = renditions.available_widths(image.name)
+    if not widths:
+        return format_html('<img src="{}" alt="{}" class="{}" loading="{}">', image.url, alt, css_class, loading)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" class="{}" loading="{}"></picture>',
+        renditions.srcset(image.name, 'webp', widths=widths), sizes, image.url,
+        renditions.srcset(image.name, 'jpg', widths=widths), sizes, alt, css_class, loading,
+    )
+
+
+@register.filter
+def resized(image, size):
+    """
+    URL of an image cropped to an allowed size (see main.resized).
+
+    Usage: <img src="{{ item.product.image|resized:'120x120' }}">
+    """
+    width, _, height = size.partition('x')
+    return reverse('resized_image', args=[int(width), int(height), image.name])
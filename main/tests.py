@@ -1,3 +1,1661 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, modify_settings, override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    carts, email_utils, facets, inventory, order_export, page_cache, profiling, query_stats, ratings, renditions, resized,
+    search, variant_matrix,
+)
+from .cart_utils import CartLine
+from .catalog_import import Importer, read_rows
+from .models import (
+    Address, Cart, Category, EmailOTP, EmailOutbox, Order, OrderItem, Product, ProductFacet, ProductImage,
+    ProductRating, ProductVariant, QueryFingerprint, Review, StockReservation, Wishlist,
+)
+from .orders import OutOfStockError, place_order
+from .pagination import InvalidCursor, encode_cursor, keyset_page
+from .urls import urlpatterns
+
+
+SHIPPING = {
+    'full_name': 'Jane Doe',
+    'email': 'jane@example.com',
+    'phone': '555-0100',
+    'address': '1 High Street',
+    'city': 'London',
+    'state': 'London',
+    'zip_code': 'N1',
+}
+
+
+def make_product(category, name='Runner', price='50.00', description='', **kwargs):
+    return Product.objects.create(name=name, description=description, price=price, category=category, **kwargs)
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(self.category, name=f'Shoe {i}') for i in range(3)]
+        self.variants = [
+            ProductVariant.objects.create(product=p, color='black', size='9', stock=5, sku=f'sku-{p.id}')
+            for p in self.products
+        ]
+
+    def add_lines(self, quantity=1, session_key='guest'):
+        for product in self.products:
+            Cart.objects.create(session_key=session_key, product=product, quantity=quantity,
+                                color='black', size='9')
+        return Cart.objects.filter(session_key=session_key).select_related('product')
+
+    def test_creates_items_and_decrements_stock(self):
+        order = place_order(self.add_lines(quantity=2), **SHIPPING)
+
+        self.assertTrue(order.is_guest)
+        self.assertEqual(order.total_amount, Decimal('300.00'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertEqual(
+            list(ProductVariant.objects.values_list('stock', flat=True)), [3, 3, 3]
+        )
+        self.assertFalse(Cart.objects.exists())
+
+    def test_refuses_to_oversell(self):
+        ProductVariant.objects.filter(pk=self.variants[-1].pk).update(stock=1)
+
+        with self.assertRaises(OutOfStockError) as ctx:
+            place_order(self.add_lines(quantity=2), **SHIPPING)
+
+        self.assertEqual(ctx.exception.variant.stock, 1)
+        # Nothing from the failed attempt is kept
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(
+            list(ProductVariant.objects.values_list('stock', flat=True)), [5, 5, 1]
+        )
+        self.assertEqual(Cart.objects.count(), 3)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        cart_items = list(self.add_lines())
+        # variants, stock UPDATE, sold-out check, order, bulk items, cart
+        # delete, plus savepoint
+        with self.assertNumQueries(8):
+            place_order(cart_items, **SHIPPING)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        self.product = make_product(category)
+        self.variant = ProductVariant.objects.create(
+            product=self.product, color='black', size='9', stock=3, sku='hot-sku'
+        )
+
+    def cart(self, session_key, quantity):
+        Cart.objects.create(session_key=session_key, product=self.product, quantity=quantity,
+                            color='black', size='9')
+        return Cart.objects.filter(session_key=session_key).select_related('product')
+
+    def test_holds_reduce_available_stock(self):
+        inventory.reserve_cart(self.cart('a', 2), session_key='a')
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.available_stock, 1)
+        with self.assertRaises(OutOfStockError):
+            inventory.reserve_cart(self.cart('b', 2), session_key='b')
+
+    def test_reserving_again_replaces_previous_hold(self):
+        inventory.reserve_cart(self.cart('a', 2), session_key='a')
+        inventory.reserve_cart(Cart.objects.filter(session_key='a'), session_key='a')
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 2)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_expired_holds_are_released(self):
+        inventory.reserve_cart(self.cart('a', 3), session_key='a')
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        # Another shopper can take the units straight away ...
+        inventory.reserve_cart(self.cart('b', 3), session_key='b')
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 3)
+
+        # ... and the sweeper frees whatever is left over
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(inventory.release_expired(), 3)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 0)
+
+    def test_deleting_a_user_does_not_lose_held_units(self):
+        user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        Cart.objects.create(user=user, product=self.product, quantity=2, color='black', size='9')
+        inventory.reserve_cart(Cart.objects.filter(user=user).select_related('product'), user=user)
+
+        user.delete()
+        self.assertEqual(StockReservation.objects.get().user, None)
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(inventory.release_expired(), 2)
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock - self.variant.reserved, 3)
+
+    def test_reconcile_resets_drifted_counters(self):
+        inventory.reserve_cart(self.cart('a', 2), session_key='a')
+        ProductVariant.objects.filter(pk=self.variant.pk).update(reserved=3)
+
+        out = StringIO()
+        call_command('sweep_reservations', reconcile=True, stdout=out)
+        self.assertIn('Reconciled the reserved count of 1 variants', out.getvalue())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.reserved, 2)
+        self.assertEqual(inventory.reconcile_reserved(), 0)
+
+    def test_checkout_consumes_own_hold(self):
+        cart_items = self.cart('a', 3)
+        inventory.reserve_cart(cart_items, session_key='a')
+
+        place_order(cart_items, session_key='a', **SHIPPING)
+
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (0, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_cannot_buy_units_held_by_others(self):
+        inventory.reserve_cart(self.cart('a', 2), session_key='a')
+
+        with self.assertRaises(OutOfStockError):
+            place_order(self.cart('b', 2), session_key='b', **SHIPPING)
+
+
+class HotSkuConcurrencyTests(TransactionTestCase):
+    threads = 20
+
+    def test_many_shoppers_never_overbook_one_sku(self):
+        category = Category.objects.create(name='Men', slug='men')
+        product = make_product(category)
+        variant = ProductVariant.objects.create(
+            product=product, color='black', size='9', stock=5, sku='hot-sku'
+        )
+        for n in range(self.threads):
+            Cart.objects.create(session_key=f's{n}', product=product, quantity=1,
+                                color='black', size='9')
+
+        results = []
+        start = threading.Barrier(self.threads)
+
+        def shopper(n):
+            session_key = f's{n}'
+            start.wait()
+            try:
+                while True:
+                    try:
+                        inventory.reserve_cart(
+                            Cart.objects.filter(session_key=session_key), session_key=session_key
+                        )
+                        results.append(True)
+                        return
+                    except OutOfStockError:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting; try again
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=shopper, args=(n,)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        variant.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(variant.reserved, 5)
+        self.assertEqual(StockReservation.objects.count(), 5)
+
+
+class FlakySMTPBackend(EmailBackend):
+    """locmem backend that refuses the first message it is given."""
+    refused = 0
+
+    def send_messages(self, messages):
+        if not FlakySMTPBackend.refused:
+            FlakySMTPBackend.refused += 1
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        return super().send_messages(messages)
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+
+    def test_emails_are_queued_not_sent(self):
+        self.assertTrue(email_utils.send_welcome_email(self.user))
+
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual((queued.status, queued.recipients), ('pending', ['jane@example.com']))
+
+    def test_worker_drains_outbox(self):
+        for _ in range(3):
+            email_utils.send_welcome_email(self.user)
+
+        self.assertEqual(email_utils.deliver_queued_emails(batch_size=2), (2, 0))
+        self.assertEqual(email_utils.deliver_queued_emails(batch_size=2), (1, 0))
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].content_subtype, 'html')
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+
+    @override_settings(EMAIL_BACKEND='main.tests.FlakySMTPBackend')
+    def test_failed_send_is_retried_with_backoff(self):
+        FlakySMTPBackend.refused = 0
+        email_utils.send_welcome_email(self.user)
+
+        self.assertEqual(email_utils.deliver_queued_emails(), (0, 1))
+        queued = EmailOutbox.objects.get()
+        self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+        self.assertGreater(queued.next_attempt_at, timezone.now())
+
+        # Not due yet, so nothing happens until the backoff has passed
+        self.assertEqual(email_utils.deliver_queued_emails(), (0, 0))
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(email_utils.deliver_queued_emails(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        email_utils.send_welcome_email(self.user)
+        EmailOutbox.objects.update(attempts=email_utils.OUTBOX_MAX_ATTEMPTS - 1)
+
+        with override_settings(EMAIL_BACKEND='main.tests.FlakySMTPBackend'):
+            FlakySMTPBackend.refused = 0
+            email_utils.deliver_queued_emails()
+
+        self.assertEqual(EmailOutbox.objects.get().status, 'failed')
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CartAPIGetTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(category, name=f'Shoe {i}') for i in range(20)]
+
+    def set_session_cart(self, cart):
+        session = self.client.session
+        session['cart'] = cart
+        session.save()
+
+    def guest_cart(self, count):
+        return {
+            f'{p.id}_9_black': {'product_id': p.id, 'quantity': 2, 'size': '9', 'color': 'black'}
+            for p in self.products[:count]
+        }
+
+    def get_cart(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('api_cart'))
+        return response.json(), len(queries)
+
+    def test_guest_cart_query_count_is_constant(self):
+        self.set_session_cart(self.guest_cart(2))
+        small, small_queries = self.get_cart()
+
+        self.set_session_cart(self.guest_cart(20))
+        large, large_queries = self.get_cart()
+
+        self.assertEqual((small['count'], large['count']), (2, 20))
+        self.assertEqual(small_queries, large_queries)
+
+    def test_legacy_and_stale_session_entries(self):
+        product = self.products[0]
+        self.set_session_cart({str(product.id): 3, '999999': 1})
+
+        data, _ = self.get_cart()
+
+        self.assertEqual(data['count'], 1)
+        item = data['items'][0]
+        self.assertEqual((item['product_id'], item['quantity'], item['size']), (product.id, 3, ''))
+        self.assertEqual(item['subtotal'], '150.00')
+
+    def test_user_cart_uses_same_payload(self):
+        user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        for product in self.products[:5]:
+            Cart.objects.create(user=user, product=product, quantity=1, size='9', color='black')
+        self.client.force_login(user)
+
+        data, _ = self.get_cart()
+
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(set(data['items'][0]), {
+            'id', 'product', 'product_id', 'product_name', 'product_price', 'product_image',
+            'quantity', 'size', 'color', 'subtotal', 'created_at',
+        })
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        # Repeated prices make sure ties are broken on id
+        self.products = [
+            make_product(category, name=f'Shoe {i:02d}', price=f'{40 + i % 3}.00')
+            for i in range(25)
+        ]
+
+    def walk(self, ordering, page_size=4):
+        pages, cursor = [], None
+        while True:
+            page = keyset_page(Product.objects.all(), ordering, cursor=cursor, page_size=page_size)
+            pages.append(page)
+            if page.next_cursor is None:
+                return pages
+            cursor = page.next_cursor
+
+    def test_forward_walk_matches_full_ordering(self):
+        for ordering in ['price', '-price', 'name', '-created_at']:
+            with self.subTest(ordering=ordering):
+                seen = [p.pk for page in self.walk(ordering) for p in page]
+                prefix = '-' if ordering.startswith('-') else ''
+                expected = list(Product.objects.order_by(ordering, f'{prefix}pk').values_list('pk', flat=True))
+                self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        pages = self.walk('price')
+        for earlier, later in zip(pages, pages[1:]):
+            back = keyset_page(Product.objects.all(), 'price', cursor=later.previous_cursor, page_size=4)
+            self.assertEqual([p.pk for p in back], [p.pk for p in earlier])
+        self.assertIsNone(pages[0].previous_cursor)
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursor):
+            keyset_page(Product.objects.all(), 'price', cursor='not-a-cursor')
+
+    def test_tampered_cursor(self):
+        for value in ['abc', '', '1.2.3']:
+            with self.subTest(value=value), self.assertRaises(InvalidCursor):
+                keyset_page(Product.objects.all(), 'price', cursor=encode_cursor('price', value, 1))
+
+    def test_cursor_of_another_ordering(self):
+        cursor = self.walk('name')[0].next_cursor
+        with self.assertRaises(InvalidCursor):
+            keyset_page(Product.objects.all(), 'price', cursor=cursor)
+
+        response = self.client.get(reverse('api_products'), {'ordering': 'price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+        # The storefront falls back to the first page
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            response = self.client.get(reverse('products'), {'ordering': 'price', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+
+    def test_api_follows_next_links(self):
+        url, seen = reverse('api_products') + '?ordering=price', []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen += [item['id'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(sorted(seen), sorted(p.pk for p in self.products))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_api_bad_cursor_is_404(self):
+        response = self.client.get(reverse('api_products') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.category = Category.objects.create(name='Men', slug='men')
+        self.cruiser = make_product(self.category, name='Wool Cruiser', material='Merino Wool')
+        self.runner = make_product(self.category, name='Tree Runner', description='Wool lining for cold days')
+        self.dasher = make_product(self.category, name='Trail Dasher', material='Mesh')
+
+    def ids(self, query):
+        return list(search.search_products(Product.objects.all(), query)
+                    .order_by(search.SEARCH_RANK, 'pk').values_list('pk', flat=True))
+
+    def test_name_match_ranks_above_description_match(self):
+        self.assertEqual(self.ids('wool'), [self.cruiser.pk, self.runner.pk])
+
+    def test_material_prefix_and_stemming(self):
+        self.assertEqual(self.ids('mesh'), [self.dasher.pk])
+        self.assertEqual(self.ids('cruis'), [self.cruiser.pk])
+        self.assertEqual(self.ids('runners'), [self.runner.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(pk=self.dasher.pk).update(name='Trail Lounger')
+        self.assertEqual(self.ids('dasher'), [])
+        self.assertEqual(self.ids('lounger'), [self.dasher.pk])
+
+        self.cruiser.delete()
+        self.assertEqual(self.ids('wool'), [self.runner.pk])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.ids('wool AND "'), [])
+        self.assertEqual(self.ids('***'), [])
+
+    def test_rebuild_index(self):
+        search.rebuild_index()
+        self.assertEqual(self.ids('wool'), [self.cruiser.pk, self.runner.pk])
+
+    def test_api_orders_search_by_relevance(self):
+        data = self.client.get(reverse('api_products'), {'search': 'wool'}).json()
+        self.assertEqual([item['id'] for item in data['results']], [self.cruiser.pk, self.runner.pk])
+
+        data = self.client.get(reverse('api_products'), {'search': 'wool', 'ordering': '-created_at'}).json()
+        self.assertEqual([item['id'] for item in data['results']], [self.runner.pk, self.cruiser.pk])
+
+    def test_api_pages_through_ranked_results(self):
+        for i in range(15):
+            make_product(self.category, name=f'Wool Piper {i}')
+        url, seen = reverse('api_products') + '?search=wool', []
+        while url:
+            data = self.client.get(url).json()
+            seen += [item['id'] for item in data['results']]
+            url = data['next']
+        self.assertEqual(len(seen), 17)
+        self.assertEqual(len(set(seen)), 17)
+
+    def test_result_cap_applies_to_relevance_only(self):
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            self.assertEqual(self.ids('wool'), [self.cruiser.pk])
+            data = self.client.get(reverse('api_products'), {'search': 'wool', 'ordering': 'name'}).json()
+        self.assertEqual([item['id'] for item in data['results']], [self.runner.pk, self.cruiser.pk])
+
+    def test_falls_back_without_fts5(self):
+        self.assertTrue(search.fts_available())
+        with mock.patch.dict(search._fts5, {connection.alias: False}):
+            self.assertFalse(search.fts_available())
+            self.assertEqual(self.ids('merino'), [self.cruiser.pk])
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_products_page_search(self):
+        response = self.client.get(reverse('products'), {'search': 'wool'})
+        self.assertEqual(list(response.context['products']), [self.cruiser, self.runner])
+
+        response = self.client.get(reverse('products'), {'search': 'nothing'})
+        self.assertEqual(list(response.context['products']), [])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class FacetTests(TestCase):
+    def setUp(self):
+        men = Category.objects.create(name='Men', slug='men')
+        women = Category.objects.create(name='Women', slug='women')
+        self.runner = make_product(men, name='Runner', price='40.00')
+        self.loafer = make_product(men, name='Loafer', price='120.00')
+        self.flat = make_product(women, name='Flat', price='60.00')
+        stock = [
+            (self.runner, 'black', '8', 3), (self.runner, 'white', '9', 2),
+            (self.loafer, 'brown', '9', 1), (self.loafer, 'black', '10', 0),
+            (self.flat, 'white', '6', 4),
+        ]
+        for product, color, size, units in stock:
+            ProductVariant.objects.create(product=product, color=color, size=size, stock=units,
+                                          sku=f'{product.pk}-{color}-{size}')
+        facets.rebuild()
+
+    def counts(self, **selected):
+        result = facets.facet_counts(facets.FacetFilters(**selected))
+        by_value = lambda name: {f['value']: f['count'] for f in result[name] if f['count']}
+        return result, by_value('sizes'), by_value('colors')
+
+    def test_counts_without_filters(self):
+        result, sizes, colors = self.counts()
+        self.assertEqual(result['total'], 3)
+        self.assertEqual(sizes, {'6': 1, '8': 1, '9': 2})  # UK 10 has no stock
+        self.assertEqual(colors, {'black': 1, 'brown': 1, 'white': 2})
+        self.assertEqual({c['slug']: c['count'] for c in result['categories']}, {'men': 2, 'women': 1})
+        self.assertEqual([p['count'] for p in result['price']], [1, 1, 1, 0])
+
+    def test_counts_ignore_own_facet(self):
+        result, sizes, colors = self.counts(sizes=['9'], category='men')
+        self.assertEqual(result['total'], 2)
+        # Other sizes are still counted within the selected category
+        self.assertEqual(sizes, {'8': 1, '9': 2})
+        self.assertEqual(colors, {'black': 1, 'brown': 1, 'white': 1})
+        self.assertEqual({c['slug']: c['count'] for c in result['categories']}, {'men': 2})
+
+    def test_query_count_is_constant(self):
+        for i in range(20):
+            make_product(Category.objects.first(), name=f'Extra {i}')
+        facets.rebuild()
+        with self.assertNumQueries(2):
+            self.counts(sizes=['9'], colors=['white', 'black'], min_price=Decimal('10'))
+
+    def test_variant_changes_refresh_index(self):
+        variant = ProductVariant.objects.get(product=self.loafer, size='10')
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.stock = 5
+            variant.save()
+        self.assertEqual(self.counts()[1]['10'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.delete()
+        self.assertNotIn('10', self.counts()[1])
+
+    def test_selling_last_unit_clears_size(self):
+        Cart.objects.create(session_key='guest', product=self.loafer, quantity=1, color='brown', size='9')
+        place_order(Cart.objects.filter(session_key='guest').select_related('product'), **SHIPPING)
+        self.assertEqual(self.counts()[1], {'6': 1, '8': 1, '9': 1})
+
+    def test_api_filters_and_returns_facets(self):
+        response = self.client.get(reverse('api_products') + '?size=6&size=8')
+        data = response.json()
+        self.assertEqual({item['id'] for item in data['results']}, {self.runner.pk, self.flat.pk})
+        self.assertEqual(data['facets']['total'], 2)
+        self.assertEqual({f['value']: f['count'] for f in data['facets']['sizes']}['9'], 2)
+
+    def test_api_facets_match_category_filter(self):
+        for params, total in [({'category__slug': 'men'}, 2), ({'category': 'men'}, 3)]:
+            with self.subTest(params=params):
+                data = self.client.get(reverse('api_products'), params).json()
+                self.assertEqual(len(data['results']), total)
+                self.assertEqual(data['facets']['total'], total)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class VariantMatrixTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product(Category.objects.create(name='Men', slug='men'), image='products/a.jpg')
+        for color in ['black', 'white']:
+            for size in ['8', '9', '10']:
+                ProductVariant.objects.create(product=self.product, color=color, size=size, stock=3,
+                                              sku=f'{color}-{size}')
+        self.url = reverse('product_detail', args=[self.product.pk])
+
+    def test_cached_page_needs_one_query(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.context['available_colors'], ['black', 'white'])
+        variants = json.loads(response.context['variants_json'])
+        self.assertEqual(variants['white']['9'], {
+            'stock': 3, 'sku': 'white-9', 'is_in_stock': True, 'is_low_stock': True, 'image': None,
+        })
+
+    def test_variant_and_image_changes_invalidate(self):
+        variant_matrix.get(self.product.pk)
+        ProductVariant.objects.filter(sku='black-8').get().delete()
+        variants = json.loads(variant_matrix.get(self.product.pk)['variants_json'])
+        self.assertEqual(list(variants['black']), ['10', '9'])
+
+        ProductImage.objects.create(product=self.product, image='products/gallery/a.jpg', alt_text='Side')
+        self.assertEqual(
+            [(i['url'], i['alt_text']) for i in variant_matrix.get(self.product.pk)['images']],
+            [('/media/products/gallery/a.jpg', 'Side')],
+        )
+
+    def test_checkout_invalidates(self):
+        variant_matrix.get(self.product.pk)
+        Cart.objects.create(session_key='guest', product=self.product, quantity=3, color='white', size='10')
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(Cart.objects.filter(session_key='guest').select_related('product'), **SHIPPING)
+
+        variants = json.loads(variant_matrix.get(self.product.pk)['variants_json'])
+        self.assertFalse(variants['white']['10']['is_in_stock'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PageCacheTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        self.men = Category.objects.create(name='Men', slug='men')
+        self.women = Category.objects.create(name='Women', slug='women')
+        self.runner = make_product(self.men, name='Runner', image='products/a.jpg')
+        make_product(self.women, name='Flat', image='products/b.jpg')
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.get('X-Page-Cache')
+
+    def test_anonymous_hit_needs_no_queries(self):
+        self.assertEqual(self.get(reverse('home')), 'miss')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(reverse('home')), 'hit')
+        self.assertEqual(page_cache.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_key_uses_only_relevant_params(self):
+        url = reverse('products')
+        self.get(url, category='men', utm_source='mail')
+        self.assertEqual(self.get(url, category='men'), 'hit')
+        self.assertEqual(self.get(url, category='women'), 'miss')
+
+    def test_logged_in_visitors_are_not_cached(self):
+        self.client.force_login(User.objects.create_user('jane', 'jane@example.com', 'pw'))
+        self.get(reverse('about'))
+        self.assertIsNone(self.get(reverse('about')))
+
+    def test_product_change_invalidates_its_category_and_listing(self):
+        url = reverse('products')
+        for params in [{}, {'category': 'men'}, {'category': 'women'}]:
+            self.get(url, **params)
+
+        self.runner.price = '10.00'
+        self.runner.save()
+
+        self.assertEqual(self.get(url), 'miss')
+        self.assertEqual(self.get(url, category='men'), 'miss')
+        self.assertEqual(self.get(url, category='women'), 'hit')
+        self.assertEqual(self.get(reverse('about')), 'miss')
+
+    def test_wildcard_invalidation(self):
+        for name in ['about', 'size_guide', 'return_policy']:
+            self.get(reverse(name))
+        page_cache.invalidate('page:about')
+        self.assertEqual(self.get(reverse('about')), 'miss')
+        self.assertEqual(self.get(reverse('size_guide')), 'hit')
+
+        page_cache.invalidate('page:*')
+        self.assertEqual(self.get(reverse('size_guide')), 'miss')
+        self.assertEqual(self.get(reverse('return_policy')), 'miss')
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Men', slug='men')
+        self.product = make_product(self.category, image='products/a.jpg')
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+
+    def review(self, rating, **kwargs):
+        kwargs.setdefault('product', self.product)
+        with self.captureOnCommitCallbacks(execute=True):
+            return Review.objects.create(user=self.user, rating=rating, comment='', **kwargs)
+
+    def save(self, review):
+        with self.captureOnCommitCallbacks(execute=True):
+            review.save()
+
+    def summary(self, product=None):
+        return ProductRating.objects.get(pk=(product or self.product).pk)
+
+    def test_create_and_edit_update_aggregates(self):
+        first = self.review(5, comfort_rating=4, true_to_size='small', width_feedback='perfect')
+        self.review(2, comfort_rating=2, would_recommend=False, true_to_size='true')
+
+        summary = self.summary()
+        self.assertEqual((summary.review_count, summary.mean_rating, summary.mean_comfort), (2, 3.5, 3.0))
+        self.assertEqual(summary.recommend_ratio, 0.5)
+        self.assertEqual([bar['count'] for bar in summary.fit_histogram()], [1, 1, 0])
+        self.assertEqual([bar['percent'] for bar in summary.width_histogram()], [0, 100, 0])
+
+        first.rating = 3
+        first.true_to_size = 'large'
+        self.save(first)
+        summary = self.summary()
+        self.assertEqual((summary.review_count, summary.rating_sum), (2, 5))
+        self.assertEqual((summary.fit_small, summary.fit_true, summary.fit_large), (0, 1, 1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating, 2.5)
+
+    def test_moving_and_deleting_reviews(self):
+        other = make_product(self.category, name='Walker')
+        review = self.review(4)
+        review.product = other
+        self.save(review)
+        self.assertEqual(self.summary().review_count, 0)
+        self.assertEqual(self.summary(other).rating_sum, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertEqual(self.summary(other).review_count, 0)
+        other.refresh_from_db()
+        self.assertEqual(other.rating, 0.0)
+
+    def test_rolled_back_save_leaves_summary_alone(self):
+        review = self.review(4)
+        with self.captureOnCommitCallbacks(execute=True), mock.patch.object(ratings, 'apply') as apply:
+            try:
+                with transaction.atomic():
+                    review.rating = 1
+                    review.save()
+                    Review.objects.create(user=self.user, product=self.product, rating=2, comment='')
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        apply.assert_not_called()
+        summary = self.summary()
+        self.assertEqual((summary.review_count, summary.rating_sum), (1, 4))
+
+    def test_rebuild_matches_incremental_updates(self):
+        self.review(5, true_to_size='true')
+        self.review(1, would_recommend=False)
+        expected = {field: getattr(self.summary(), field) for field in ratings.COUNTERS}
+
+        ProductRating.objects.all().delete()
+        self.assertEqual(ratings.rebuild(), 1)
+        self.assertEqual({field: getattr(self.summary(), field) for field in ratings.COUNTERS}, expected)
+
+    @override_settings(SECURE_SSL_REDIRECT=False,
+                       STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_detail_page_reads_summary_with_product(self):
+        cache.clear()
+        self.review(4)
+        self.review(5)
+        url = reverse('product_detail', args=[self.product.pk])
+        self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertContains(response, '4.5/5 (2 reviews)')
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = make_product(Category.objects.create(name='Men', slug='men'))
+
+    def png(self, width, height, mode='RGB'):
+        buffer = BytesIO()
+        Image.new(mode, (width, height)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='shoe.png')
+
+    def test_generates_each_width_below_the_original(self):
+        name = default_storage.save('products/shoe.png', self.png(500, 250, mode='RGBA'))
+
+        self.assertEqual(renditions.generate(name)[0], 4)
+        self.assertEqual(renditions.available_widths(name), [200, 400])
+        with default_storage.open(renditions.rendition_name(name, 400, 'jpg')) as f:
+            self.assertEqual(Image.open(f).size, (400, 200))
+        # Deterministic names: a second run finds everything in place
+        self.assertEqual(renditions.generate(name), (0, 0))
+
+    def test_upload_generates_renditions_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=self.png(900, 900))
+        self.assertEqual(renditions.available_widths(image.image.name), [200, 400, 800])
+
+    def test_picture_tag(self):
+        template = Template('{% load product_images %}{% picture product.image alt="Shoe" %}')
+        self.product.image = 'products/missing.png'
+        self.assertEqual(
+            template.render(Context({'product': self.product})),
+            '<img src="/media/products/missing.png" alt="Shoe" class="" loading="lazy">',
+        )
+
+        self.product.image.save('shoe.png', self.png(300, 300))
+        renditions.generate(self.product.image.name)
+        html = template.render(Context({'product': self.product}))
+        self.assertIn(f'srcset="/media/renditions/{self.product.image.name}/200w.webp 200w"', html)
+        self.assertIn(f'/media/renditions/{self.product.image.name}/200w.jpg 200w', html)
+
+    def test_listings_read_generated_widths_from_the_cache(self):
+        name = default_storage.save('products/shoe.png', self.png(500, 250))
+        renditions.generate(name)
+        with mock.patch.object(default_storage, 'exists') as exists:
+            self.assertEqual(renditions.available_widths(name), [200, 400])
+            self.assertIn('400w.webp 400w', renditions.srcset(name))
+        exists.assert_not_called()
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ResizedImageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(resized, 'CACHE_DIR', os.path.join(media_root, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+        buffer = BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+        self.name = default_storage.save('products/shoe.png', ContentFile(self.png))
+
+    def get(self, size, name=None, **headers):
+        return self.client.get(f'/media/resized/{size}/{name or self.name}', **headers)
+
+    def test_only_allowed_sizes_and_existing_images(self):
+        self.assertEqual(self.get('121x120').status_code, 404)
+        self.assertEqual(self.get('120x120', name='products/missing.png').status_code, 404)
+        self.assertEqual(self.get('120x120', name='../settings.py').status_code, 404)
+
+    def test_hit_is_served_with_strong_etag(self):
+        response = self.get('120x120')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (120, 120))
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        self.assertEqual(self.get('120x120')['ETag'], etag)
+        self.assertEqual(self.get('120x120', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_cache_is_content_addressed(self):
+        copy = default_storage.save('products/copy.png', ContentFile(self.png))
+        self.assertEqual(self.get('120x120')['ETag'], self.get('120x120', name=copy)['ETag'])
+        files = [f for _, _, names in os.walk(resized.CACHE_DIR) for f in names]
+        self.assertEqual(len(files), 1)
+
+    def test_file_pruned_before_it_is_opened_is_rendered_again(self):
+        render, calls = resized.resized, []
+
+        def render_then_prune(*args):
+            path, etag = render(*args)
+            if not calls:
+                os.remove(path)
+            calls.append(args)
+            return path, etag
+
+        with mock.patch.object(resized, 'resized', render_then_prune):
+            response = self.get('120x120')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (120, 120))
+        self.assertEqual(len(calls), 2)
+
+    def test_prune_removes_least_recently_used(self):
+        old, _ = resized.resized(self.name, 64, 64)
+        new, _ = resized.resized(self.name, 120, 120)
+        os.utime(old, (1, 1))
+
+        # Room for one file only: 90% of the cap is just over its size
+        removed, left = resized.prune(max_bytes=os.path.getsize(new) * 10 // 9 + 1)
+        self.assertEqual((removed, left), (1, os.path.getsize(new)))
+        self.assertFalse(os.path.exists(old))
+
+
+class CatalogSeedTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def seed(self):
+        call_command('create_variants', scale=2, stdout=StringIO())
+        return (
+            Product.objects.count(), ProductVariant.objects.count(),
+            ProductImage.objects.count(), ProductFacet.objects.exclude(size_mask=0).count(),
+        )
+
+    def test_scaled_seed_is_idempotent(self):
+        counts = self.seed()
+        self.assertEqual(counts[0], 20)
+        self.assertEqual(counts[2], 40)
+        self.assertEqual(counts[3], 20)
+        self.assertTrue(20 * 14 <= counts[1] <= 20 * 21)
+        self.assertEqual(len(os.listdir(os.path.join(default_storage.location, 'products'))), 10)
+
+        self.assertEqual(self.seed(), counts)
+
+
+class ImportCatalogTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Men', slug='men')
+
+    def run_import(self, text, fmt='csv'):
+        importer = Importer(batch_size=2)
+        importer.run(read_rows(StringIO(text), fmt))
+        return importer
+
+    def test_csv_upsert_keyed_on_sku(self):
+        feed = (
+            'sku,product,category,color,size,stock,price\n'
+            'R-1,Runner,men,Navy Blue,UK 9,4,59.99\n'
+            'R-2,Runner,men,navy,10,0,\n'
+            'R-3,Runner,men,purple,10,1,\n'
+            'R-4,Runner,women,navy,11,1,\n'
+            'W-1,Walker,men,black,9,1,\n'
+        )
+        importer = self.run_import(feed)
+
+        product = Product.objects.get(name='Runner')
+        self.assertEqual(product.price, Decimal('59.99'))
+        self.assertEqual(
+            list(product.variants.values_list('sku', 'color', 'size', 'stock')),
+            [('R-2', 'navy', '10', 0), ('R-1', 'navy', '9', 4)],
+        )
+        self.assertEqual((importer.rows, importer.created, importer.products_created), (5, 2, 1))
+        self.assertEqual([line for line, _ in importer.errors], [4, 5, 6])
+        self.assertEqual(ProductFacet.objects.get(product=product).size_mask, facets.bits(['9'], facets.SIZES))
+
+        importer = self.run_import(
+            '{"sku": "R-1", "product": "Runner", "category": "men", "color": "navy", "size": "9", "stock": 0}\n'
+            '{"sku": "R-9", "product": "Runner", "category": "men", "color": "navy", "size": "10", "stock": 3}\n'
+            'not json\n',
+            fmt='jsonl',
+        )
+        self.assertEqual((importer.created, importer.updated, importer.error_count), (0, 1, 2))
+        self.assertIn('already has SKU R-2', importer.errors[0][1])
+        self.assertEqual(ProductVariant.objects.get(sku='R-1').stock, 0)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class OrderExportTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        runner, walker = make_product(category, name='Runner'), make_product(category, name='Walker')
+        self.order = Order.objects.create(order_number='ORD-1', total_amount='150.00', **SHIPPING)
+        OrderItem.objects.create(order=self.order, product=runner, quantity=2, price='50.00', size='9', color='black')
+        OrderItem.objects.create(order=self.order, product=walker, quantity=1, price='50.00', size='8', color='navy')
+        old = Order.objects.create(order_number='ORD-0', total_amount='50.00', **SHIPPING)
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+    def test_csv_has_a_line_per_item_from_one_query(self):
+        orders = order_export.filter_orders(date_from=timezone.localdate() - timedelta(days=1))
+        with self.assertNumQueries(1):
+            lines = list(order_export.csv_lines(orders, chunk_size=1))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith('ORD-1,'))
+        self.assertTrue(lines[2].rstrip().endswith('Walker,8,navy,1,50.00'))
+
+    def test_jsonl_nests_items_per_order(self):
+        orders = order_export.filter_orders(date_to=timezone.localdate())
+        records = [json.loads(line) for line in order_export.jsonl_lines(orders)]
+        self.assertEqual([r['order_number'] for r in records], ['ORD-0', 'ORD-1'])
+        self.assertEqual(records[0]['items'], [])
+        self.assertEqual([item['product_name'] for item in records[1]['items']], ['Runner', 'Walker'])
+
+    def test_admin_action_streams(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pw'))
+        response = self.client.post(reverse('admin:main_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.order.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+
+class LoadDataTests(TestCase):
+    def generate(self, prefix):
+        call_command('generate_load_data', prefix=prefix, categories=3, products=40, users=10, carts=10,
+                     orders=20, reviews=30, wishlists=15, stdout=StringIO())
+
+    def test_volumes_are_reproducible(self):
+        self.generate('a')
+        self.assertEqual(Product.objects.filter(category__slug__startswith='a-').count(), 40)
+        self.assertEqual(Order.objects.filter(order_number__startswith='a-').count(), 20)
+        self.assertEqual(ProductRating.objects.aggregate(n=Sum('review_count'))['n'], 30)
+        with self.assertRaises(CommandError):
+            self.generate('a')
+
+        self.generate('b')
+        self.assertEqual(self.products('a'), self.products('b'))
+
+    def products(self, prefix):
+        return list(
+            Product.objects.filter(category__slug__startswith=f'{prefix}-').order_by('pk').values_list('name', 'price')
+        )
+
+
+class StorefrontBenchmarkTests(TestCase):
+    def test_every_scenario_runs_and_is_rolled_back(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command('bench_storefront', products=30, iterations=2, output=output, stdout=StringIO())
+
+        with open(output) as f:
+            scenarios = json.load(f)['scenarios']
+        self.assertIn('checkout POST', scenarios)
+        self.assertEqual(scenarios['home (anonymous, page cache)']['queries'], 0)
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+                   EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class QueryCountGuardTests(TestCase):
+    """
+    Every URL in main/urls.py makes the same number of queries with a small
+    and a large data set (more products, variants, reviews, cart lines,
+    orders, order items, wishlist entries and addresses).
+    """
+
+    SMALL, LARGE = 2, 12
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Men', slug='men')
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        self.products = []
+        self.order = None
+        self.grow(self.SMALL)
+
+    def grow(self, size):
+        """Add rows until every relation of the fixture has ``size`` members."""
+        while len(self.products) < size:
+            n = len(self.products)
+            product = make_product(self.category, name=f'Runner {n}', image='products/a.jpg')
+            self.products.append(product)
+            for color in ['black', 'white']:
+                ProductVariant.objects.create(product=product, color=color, size='9', stock=1000,
+                                              sku=f'guard-{n}-{color}')
+            ProductImage.objects.create(product=product, image='products/gallery/a.jpg', order=n)
+            Review.objects.create(user=self.user, product=self.products[0], rating=4, comment='')
+            Cart.objects.create(user=self.user, product=product, quantity=1, color='black', size='9')
+            Cart.objects.create(session_key='guest', product=product, quantity=1, color='black', size='9')
+            Wishlist.objects.create(user=self.user, product=product)
+            Address.objects.create(user=self.user, name=f'Home {n}', phone='0', address_line1='1 Street',
+                                   city='London', state='London', zip_code='N1')
+            order = Order.objects.create(user=self.user, order_number=f'GUARD-{n}', total_amount='10.00',
+                                         **SHIPPING)
+            self.order = self.order or order
+            for product in self.products:
+                OrderItem.objects.create(order=self.order, product=product, quantity=1, price='10.00')
+
+    def cases(self):
+        """URL name (plus the method, for names served with several) -> (method, args, data, signed in)"""
+        product = self.products[0].pk
+        line = {'product_id': product, 'size': '9', 'color': 'black'}
+        return {
+            'home': ('get', [], None, False),
+            'products': ('get', [], None, False),
+            'product_detail': ('get', [product], None, True),
+            'resized_image': ('get', [120, 120, 'products/a.jpg'], None, False),
+            'cart': ('get', [], None, True),
+            'add_to_cart': ('post', [product], {'quantity': 1}, True),
+            'checkout': ('get', [], None, True),
+            'order_success': ('get', [self.order.pk], None, True),
+            'signup': ('get', [], None, False),
+            'login': ('get', [], None, False),
+            'logout': ('get', [], None, True),
+            'men': ('get', [], None, False),
+            'size_guide': ('get', [], None, False),
+            'profile': ('get', [], None, True),
+            'contact': ('get', [], None, False),
+            'about': ('get', [], None, False),
+            'return_policy': ('get', [], None, False),
+            'toggle_wishlist': ('post', [product], None, True),
+            'request_email_otp': ('post', [], {'email': 'otp@example.com'}, False),
+            'verify_email_otp': ('post', [], {'email': 'otp@example.com', 'otp': '123456'}, False),
+            'login_otp': ('get', [], None, False),
+            'api_products': ('get', [], {'size': '9', 'color': 'black'}, False),
+            'api_categories': ('get', [], None, False),
+            'api_cart': ('get', [], None, True),
+            'api_cart post': ('post', [], {'product': product, 'quantity': 1, 'size': '9', 'color': 'black'}, True),
+            'api_cart patch': ('patch', [], {**line, 'quantity': 2}, True),
+            'api_cart delete': ('delete', [], line, True),
+            'api_cart_summary': ('get', [], None, True),
+        }
+
+    def measure(self):
+        """Queries per URL name, with caches cleared so that nothing is served warm."""
+        captured = {}
+        for label, (method, args, data, signed_in) in self.cases().items():
+            name = label.split()[0]
+            # Every request starts from the same state, so only the data
+            # size differs between the two runs
+            cache.clear()
+            caches['pages'].clear()
+            EmailOTP.objects.filter(email='otp@example.com').delete()
+            EmailOTP.objects.create(email='otp@example.com', otp='123456')
+            Wishlist.objects.get_or_create(user=self.user, product=self.products[0])
+            Cart.objects.update_or_create(user=self.user, product=self.products[0], size='9', color='black',
+                                          defaults={'quantity': 1})
+            inventory.release_holds(self.user, None)
+            self.client.logout()
+            if signed_in:
+                self.client.force_login(self.user)
+
+            url = reverse(name, args=args)
+            # The OTP endpoints and API writes take JSON bodies
+            json_body = name.endswith('email_otp') or (name.startswith('api_') and method != 'get')
+            kwargs = {'content_type': 'application/json'} if json_body else {}
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(self.client, method)(url, data, **kwargs)
+            self.assertLess(response.status_code, 400 if name.startswith('api_') else 500, f'{label} failed')
+            captured[label] = [query['sql'] for query in queries.captured_queries]
+        return captured
+
+    def test_every_url_is_covered(self):
+        names = {pattern.name for pattern in urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names, {label.split()[0] for label in self.cases()})
+
+    def test_query_count_does_not_grow_with_data(self):
+        small = self.measure()
+        self.grow(self.LARGE)
+        large = self.measure()
+
+        failures = []
+        for name, queries in large.items():
+            if len(queries) > len(small[name]):
+                before = {}
+                for sql in small[name]:
+                    before[query_stats.fingerprint(sql)] = before.get(query_stats.fingerprint(sql), 0) + 1
+                extra = {}
+                for sql in queries:
+                    shape = query_stats.fingerprint(sql)
+                    if before.get(shape, 0):
+                        before[shape] -= 1
+                    else:
+                        extra.setdefault(shape, sql)
+                lines = '\n'.join(f'      {sql}' for sql in extra.values())
+                failures.append(f'{name}: {len(small[name])} -> {len(queries)} queries; extra SQL:\n{lines}')
+        self.assertFalse(failures, '\n' + '\n'.join(failures))
+
+
+@override_settings(SECURE_SSL_REDIRECT=False,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+@modify_settings(MIDDLEWARE={'append': 'main.profiling.RequestProfilingMiddleware'})
+class RequestProfilingTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        category = Category.objects.create(name='Men', slug='men')
+        self.product = make_product(category, image='products/a.jpg')
+        self.url = reverse('product_detail', args=[self.product.pk])
+
+    def timings(self, response):
+        return {
+            metric.split(';')[0]: metric
+            for metric in response['Server-Timing'].split(', ')
+        }
+
+    def test_server_timing_reports_db_templates_and_total(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'tpl', 'app', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timings['db'])
+        template_ms = float(timings['tpl'].split('dur=')[1].split(';')[0])
+        self.assertGreater(template_ms, 0)
+
+    def test_sampled_requests_are_logged_as_json(self):
+        with mock.patch.object(profiling, 'SAMPLE_RATE', 1.0), \
+                self.assertLogs('main.profiling', 'INFO') as logs:
+            self.client.get(self.url)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'product_detail')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+
+        with mock.patch.object(profiling, 'SAMPLE_RATE', 0.0), self.assertNoLogs('main.profiling'):
+            self.client.get(self.url)
+
+    def test_profile_param_is_for_staff_only(self):
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        patch = mock.patch.object(profiling, 'PROFILE_DIR', profile_dir)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        user = User.objects.create_user('shopper', password='pw')
+        self.client.force_login(user)
+        response = self.client.get(self.url, {'_profile': 1})
+        self.assertNotIn('X-Profile', response)
+        self.assertEqual(os.listdir(profile_dir), [])
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(self.url, {'_profile': 1})
+        self.assertEqual(os.listdir(profile_dir), [response['X-Profile']])
+        self.assertIn('-product_detail-', response['X-Profile'])
+
+
+@override_settings(SECURE_SSL_REDIRECT=False,
+                   STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+@modify_settings(MIDDLEWARE={'prepend': 'main.query_stats.QueryStatsMiddleware'})
+class QueryStatsTests(TestCase):
+    def setUp(self):
+        caches['pages'].clear()
+        query_stats.collector.stats.clear()
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(category, name=f'Runner {i}', image='products/a.jpg') for i in range(2)]
+
+    def test_fingerprint_normalizes_literals_and_lists(self):
+        self.assertEqual(
+            query_stats.fingerprint("SELECT * FROM t WHERE id = %s AND name = 'x''y' AND pk IN (1, 2,  3) LIMIT 21"),
+            'SELECT * FROM t WHERE id = ? AND name = ? AND pk IN (...) LIMIT ?',
+        )
+        self.assertEqual(
+            query_stats.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s), (%s, %s)'),
+            query_stats.fingerprint('INSERT INTO t (a, b) VALUES (%s, %s)'),
+        )
+        self.assertEqual(query_stats.fingerprint('SAVEPOINT "s1401_x63"'), 'SAVEPOINT "s?"')
+
+    def test_queries_are_aggregated_per_view_and_fingerprint(self):
+        for product in self.products:
+            self.client.get(reverse('product_detail', args=[product.pk]))
+        self.client.get(reverse('products'))
+        self.assertEqual(query_stats.collector.flush(), QueryFingerprint.objects.count())
+
+        detail = QueryFingerprint.objects.filter(view='product_detail')
+        self.assertTrue(detail.exists())
+        product_lookup = detail.get(fingerprint__contains='FROM "main_product" LEFT OUTER JOIN "main_productrating"')
+        self.assertEqual(product_lookup.count, 2)
+        self.assertEqual(len(product_lookup.samples), 2)
+        self.assertTrue(QueryFingerprint.objects.filter(view='products').exists())
+
+        # A later flush adds to the same rows
+        self.client.get(reverse('product_detail', args=[self.products[0].pk]))
+        query_stats.collector.flush()
+        product_lookup.refresh_from_db()
+        self.assertEqual(product_lookup.count, 3)
+
+    def test_flush_retries_when_another_process_creates_a_row(self):
+        query_stats.collector.add('products', 'SELECT 1', 5.0)
+        bulk_create, calls = QueryFingerprint.objects.bulk_create, []
+
+        def racing_bulk_create(objs, *args, **kwargs):
+            calls.append(objs)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_create(objs, *args, **kwargs)
+
+        with mock.patch.object(QueryFingerprint.objects, 'bulk_create', racing_bulk_create):
+            self.assertEqual(query_stats.collector.flush(), 1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(QueryFingerprint.objects.get(view='products').count, 1)
+
+    def test_slow_queries_are_logged_with_their_call_site(self):
+        with mock.patch.object(query_stats, 'SLOW_QUERY_MS', 0), \
+                self.assertLogs('main.query_stats', 'WARNING') as logs:
+            self.client.get(reverse('product_detail', args=[self.products[0].pk]))
+        self.assertTrue(any(
+            'in product_detail at main/views.py:' in line and '(product_detail)' in line for line in logs.output
+        ))
+
+    def test_command_prints_top_offenders(self):
+        QueryFingerprint.objects.create(view='products', digest='a', fingerprint='SELECT slow', count=10,
+                                        total_ms=900, max_ms=200, samples=[50, 90, 200])
+        QueryFingerprint.objects.create(view='cart', digest='b', fingerprint='SELECT often', count=1000,
+                                        total_ms=100, max_ms=1, samples=[0.1] * 10)
+
+        out = StringIO()
+        call_command('query_stats', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn('SELECT slow', lines[1])
+        self.assertIn('200.00', lines[1])
+
+        out = StringIO()
+        call_command('query_stats', sort='count', limit=1, reset=True, stdout=out)
+        self.assertIn('SELECT often', out.getvalue().splitlines()[1])
+        self.assertNotIn('SELECT slow', out.getvalue())
+        self.assertFalse(QueryFingerprint.objects.exists())
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CartUpsertTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        self.product = make_product(category)
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+
+    def test_adds_increment_one_line_per_owner_and_variant(self):
+        carts.add(self.product.pk, 1, '9', 'black', user=self.user)
+        carts.add(self.product.pk, 2, '9', 'black', user=self.user)
+        carts.add(self.product.pk, 1, '10', 'black', user=self.user)
+        carts.add(self.product.pk, 5, '9', 'black', session_key='guest')
+
+        self.assertCountEqual(
+            Cart.objects.values_list('user_id', 'session_key', 'size', 'quantity'),
+            [(self.user.pk, None, '9', 3), (self.user.pk, None, '10', 1), (None, 'guest', '9', 5)],
+        )
+
+    def test_fallback_without_upsert_support(self):
+        with mock.patch.object(type(connection.features), 'supports_update_conflicts_with_target', False):
+            for _ in range(3):
+                carts.add(self.product.pk, 2, session_key='guest')
+        self.assertEqual(Cart.objects.get().quantity, 6)
+
+    def test_duplicate_lines_are_rejected(self):
+        Cart.objects.create(user=self.user, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(user=self.user, product=self.product, quantity=1)
+
+    def test_views_add_through_the_upsert(self):
+        self.client.force_login(self.user)
+        for _ in range(2):
+            self.client.post(reverse('add_to_cart', args=[self.product.pk]), {'quantity': 2})
+            self.client.post(reverse('api_cart'), {'product': self.product.pk, 'quantity': 1, 'size': '9',
+                                                  'color': 'black'}, content_type='application/json')
+        self.assertEqual(
+            sorted(Cart.objects.values_list('size', 'color', 'quantity')),
+            [('', '', 4), ('9', 'black', 2)],
+        )
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    adds = 100
+
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        self.product = make_product(category)
+
+    def concurrent_adds(self, **owner):
+        product = self.product
+        start = threading.Barrier(self.adds)
+
+        def shopper():
+            start.wait()
+            try:
+                while True:
+                    try:
+                        carts.add(product.pk, 1, '9', 'black', **owner)
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting; try again
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=shopper) for _ in range(self.adds)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return Cart.objects.get(product=product)
+
+    def test_concurrent_adds_are_exact(self):
+        line = self.concurrent_adds(session_key='guest')
+        self.assertEqual(line.quantity, self.adds)
+
+    def test_concurrent_adds_are_exact_without_upsert(self):
+        user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        with mock.patch.object(type(connection.features), 'supports_update_conflicts_with_target', False):
+            line = self.concurrent_adds(user=user)
+        self.assertEqual(line.quantity, self.adds)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class CartStoreTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(category, name=f'Shoe {i}') for i in range(3)]
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+
+    def stores(self):
+        session = self.client.session
+        return {
+            'db (user)': carts.DbCartStore(user=self.user),
+            'db (guest)': carts.DbCartStore(session=session),
+            'session': carts.SessionCartStore(session),
+            'cache': carts.CacheCartStore(session=session),
+        }
+
+    def test_every_store_behaves_the_same(self):
+        first, second, third = [p.pk for p in self.products]
+        for name, store in self.stores().items():
+            with self.subTest(name):
+                self.assertEqual(store.get_lines(), [])
+                store.add(first, 1, '9', 'black')
+                store.add(first, 2, '9', 'black')
+                store.add(second, 1)
+                store.add_lines([CartLine(third, 4, '10', 'white'), CartLine(third, 1, '10', 'white')])
+
+                self.assertTrue(store.set_quantity(second, 7))
+                self.assertFalse(store.set_quantity(second, 7, '9'))
+                self.assertTrue(store.remove(first, '9', 'black'))
+                self.assertFalse(store.remove(first, '9', 'black'))
+
+                lines = store.get_lines()
+                self.assertEqual([(line.product.name, line.quantity, line.size, line.color) for line in lines],
+                                 [('Shoe 1', 7, '', ''), ('Shoe 2', 5, '10', 'white')])
+                self.assertEqual(lines[1].total_price, Decimal('250.00'))
+
+                store.discard(lines[:1])
+                self.assertEqual([line.product_id for line in store.get_lines()], [third])
+
+    def test_get_lines_query_count_is_constant(self):
+        store = carts.DbCartStore(user=self.user)
+        store.add_lines([CartLine(p.pk, 1) for p in self.products])
+        with self.assertNumQueries(2):
+            lines = store.get_lines()
+            [line.product.category.name for line in lines]
+
+    def test_summary_matches_the_lines_in_one_query(self):
+        first, second, third = [p.pk for p in self.products]
+        for name, store in self.stores().items():
+            with self.subTest(name):
+                self.assertEqual(store.summary(), carts.CartSummary())
+                store.add_lines([CartLine(first, 2, '9', 'black'), CartLine(second, 1), CartLine(third, 3)])
+                Product.objects.filter(pk=third).update(price='10.50')
+
+                with self.assertNumQueries(1):
+                    summary = store.summary()
+                lines = store.get_lines()
+                self.assertEqual(summary, carts.CartSummary(3, 6, sum(line.total_price for line in lines)))
+                self.assertEqual(summary.total, Decimal('181.50'))
+                store.discard(lines)
+
+    def test_summary_endpoint(self):
+        response = self.client.get(reverse('api_cart_summary'))
+        self.assertEqual(response.json(), {'lines': 0, 'items': 0, 'total': '0.00'})
+
+        for product in self.products[:2]:
+            self.client.post(reverse('api_cart'), {'product': product.pk, 'quantity': 2},
+                             content_type='application/json')
+        self.products[1].delete()
+        with self.assertNumQueries(2):  # session, summary
+            response = self.client.get(reverse('api_cart_summary'))
+        self.assertEqual(response.json(), {'lines': 1, 'items': 2, 'total': '100.00'})
+
+    def test_legacy_session_formats_are_read(self):
+        product = self.products[0]
+        session = self.client.session
+        session['cart'] = {
+            str(product.pk): 3,
+            f'{product.pk}_9_black': {'product_id': product.pk, 'quantity': 2, 'size': '9', 'color': 'black'},
+        }
+        store = carts.SessionCartStore(session)
+        store.add(product.pk, 1)
+
+        self.assertEqual(session['cart'], {f'[{product.pk}, "", ""]': 4, f'[{product.pk}, "9", "black"]': 2})
+
+    def test_any_size_and_color_survive_keyed_stores(self):
+        product = self.products[0]
+        for store in [carts.SessionCartStore(self.client.session), carts.CacheCartStore(self.client.session)]:
+            with self.subTest(type(store).__name__):
+                store.add(product.pk, 1, '9:1', '1:red')
+                store.add(product.pk, 1, '9', '1:1:red')
+                self.assertEqual(sorted((line.size, line.color) for line in store.get_lines()),
+                                 [('9', '1:1:red'), ('9:1', '1:red')])
+                self.assertTrue(store.remove(product.pk, '9:1', '1:red'))
+
+    def test_guest_store_follows_the_setting(self):
+        self.client.post(reverse('add_to_cart', args=[self.products[0].pk]), {'quantity': 2})
+        self.assertEqual(Cart.objects.get().quantity, 2)
+
+        with mock.patch.object(carts, 'GUEST_STORE', 'cache'):
+            self.client.post(reverse('api_cart'), {'product': self.products[1].pk, 'quantity': 1},
+                             content_type='application/json')
+            data = self.client.get(reverse('api_cart')).json()
+        self.assertEqual([item['product_id'] for item in data['items']], [self.products[1].pk])
+        self.assertEqual(Cart.objects.count(), 1)
+
+    def test_session_cart_of_older_guests_moves_to_the_store(self):
+        session = self.client.session
+        session['cart'] = {str(self.products[0].pk): 3, '999999': 1}
+        session.save()
+
+        data = self.client.get(reverse('api_cart')).json()
+
+        self.assertEqual([(item['product_id'], item['quantity']) for item in data['items']],
+                         [(self.products[0].pk, 3)])
+        self.assertNotIn('cart', self.client.session)
+        self.assertEqual(Cart.objects.get().session_key, self.client.session.session_key)
+
+    def test_cart_page_and_api_share_one_guest_cart(self):
+        product = self.products[0]
+        self.client.post(reverse('api_cart'), {'product': product.pk, 'quantity': 1, 'size': '9', 'color': 'black'},
+                         content_type='application/json')
+        response = self.client.patch(reverse('api_cart'), {'product_id': product.pk, 'quantity': 5, 'size': '9',
+                                                           'color': 'black'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        with override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'):
+            page = self.client.get(reverse('cart'))
+        self.assertEqual([(item.product_id, item.quantity) for item in page.context['cart_items']],
+                         [(product.pk, 5)])
+        self.assertEqual(page.context['summary'], carts.CartSummary(1, 5, Decimal('250.00')))
+
+        self.client.delete(reverse('api_cart'), {'product_id': product.pk, 'size': '9', 'color': 'black'},
+                           content_type='application/json')
+        self.assertFalse(Cart.objects.exists())
+
+    def test_benchmark_rolls_back(self):
+        out = StringIO()
+        call_command('bench_cart', lines=[2], repeat=2, stdout=out)
+        self.assertIn('session', out.getvalue())
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(Product.objects.count(), 3)
+
+
+@override_settings(SECURE_SSL_REDIRECT=False)
+class GuestCartMergeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(category, name=f'Shoe {i}') for i in range(3)]
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        carts.add(self.products[0].pk, 2, '9', 'black', user=self.user)
+
+    def add_as_guest(self, product, quantity, size='9', color='black'):
+        self.client.post(reverse('api_cart'), {'product': product.pk, 'quantity': quantity, 'size': size,
+                                               'color': color}, content_type='application/json')
+
+    def user_cart(self):
+        return sorted(
+            Cart.objects.filter(user=self.user).values_list('product__name', 'size', 'quantity')
+        )
+
+    def test_login_merges_guest_lines_with_one_upsert_and_one_delete(self):
+        self.add_as_guest(self.products[0], 1)
+        self.add_as_guest(self.products[1], 3, size='10')
+        session = self.client.session
+        guest_key = session[carts.GUEST_KEY]
+
+        with CaptureQueriesContext(connection) as queries:
+            carts.merge_guest_cart(session, self.user)
+        statements = [q['sql'] for q in queries.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(len(statements), 2)
+
+        self.assertEqual(self.user_cart(), [('Shoe 0', '9', 3), ('Shoe 1', '10', 3)])
+        self.assertFalse(Cart.objects.filter(session_key=guest_key).exists())
+
+    def test_login_view_and_otp_login_merge(self):
+        self.add_as_guest(self.products[0], 1)
+        self.client.post(reverse('login'), {'username': 'jane', 'password': 'pw'})
+        self.assertEqual(self.user_cart(), [('Shoe 0', '9', 3)])
+        self.assertFalse(Cart.objects.filter(user=None).exists())
+
+        self.client.logout()
+        self.add_as_guest(self.products[2], 1)
+        EmailOTP.objects.create(email='jane@example.com', otp='123456')
+        self.client.post(reverse('verify_email_otp'), {'email': 'jane@example.com', 'otp': '123456'},
+                         content_type='application/json')
+        self.assertEqual(self.user_cart(), [('Shoe 0', '9', 3), ('Shoe 2', '9', 1)])
+
+    def test_lines_added_before_the_guest_key_are_merged(self):
+        session = self.client.session
+        session.save()
+        Cart.objects.create(session_key=session.session_key, product=self.products[1], quantity=2)
+        self.assertNotIn(carts.GUEST_KEY, session)
+
+        self.client.get(reverse('api_cart'))
+        self.client.post(reverse('login'), {'username': 'jane', 'password': 'pw'})
+
+        self.assertEqual(self.user_cart(), [('Shoe 0', '9', 2), ('Shoe 1', '', 2)])
+        self.assertFalse(Cart.objects.filter(user=None).exists())
+
+    def test_session_and_cache_carts_are_merged(self):
+        for guest_store in ['session', 'cache']:
+            with self.subTest(guest_store), mock.patch.object(carts, 'GUEST_STORE', guest_store):
+                self.client.logout()
+                self.add_as_guest(self.products[0], 1)
+                self.add_as_guest(self.products[1], 1)
+                self.products[1].delete()
+
+                self.client.post(reverse('login'), {'username': 'jane', 'password': 'pw'})
+
+                self.assertEqual(self.user_cart()[0], ('Shoe 0', '9', 3))
+                self.assertEqual(len(self.user_cart()), 1)
+                self.assertNotIn('cart', self.client.session)
+                Cart.objects.filter(user=self.user).update(quantity=2)
+                self.products[1] = make_product(self.products[0].category, name='Shoe 1')
+
+
+
+class PurgeStaleCartsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Men', slug='men')
+        self.products = [make_product(category, name=f'Shoe {i}') for i in range(2)]
+        self.user = User.objects.create_user('jane', 'jane@example.com', 'pw')
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key='live', session_data='', expire_date=now + timedelta(days=1)),
+            Session(session_key='expired', session_data='', expire_date=now - timedelta(days=1)),
+        ])
+        for session_key in ['live', 'expired', 'gone']:
+            carts.add(self.products[0].pk, 1, session_key=session_key)
+        carts.add(self.products[1].pk, 1, session_key='live')
+        carts.add(self.products[0].pk, 1, user=self.user)
+
+    def remaining(self):
+        return sorted(Cart.objects.values_list('session_key', 'user', 'product__name'), key=str)
+
+    def test_purge_keeps_live_carts(self):
+        stale = timezone.now() - timedelta(days=carts.STALE_DAYS + 1)
+        Cart.objects.filter(session_key='live').update(created_at=stale, updated_at=stale)
+        # Added long ago, but still being changed
+        carts.add(self.products[0].pk, 1, session_key='live')
+        carts.add(self.products[1].pk, 1, user=self.user)
+        # A product deleted without the ORM leaves its cart lines behind
+        with connection.cursor() as cursor:
+            for model in [ProductFacet, Product]:
+                cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {model._meta.pk.column} = %s',
+                               [self.products[1].pk])
+
+        results = carts.purge_stale(batch_size=1)
+
+        self.assertEqual([(what, deleted) for what, deleted, _ in results], [
+            ('expired sessions', 1),
+            ('orphaned guest lines', 2),
+            ('abandoned guest lines', 1),
+            ('lines of deleted products', 1),
+        ])
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+        self.assertEqual(self.remaining(), [('live', None, 'Shoe 0'), (None, self.user.pk, 'Shoe 0')])
+        self.assertEqual(Cart.objects.get(session_key='live').quantity, 2)
+
+    def test_command_deletes_in_batches_and_reports_rate(self):
+        Cart.objects.filter(session_key='live').delete()
+        with CaptureQueriesContext(connection) as queries:
+            out = StringIO()
+            call_command('purge_stale_carts', batch_size=1, stdout=out)
+        deletes = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('DELETE')]
+
+        # One row per statement: the expired session and the two orphaned lines
+        self.assertEqual(len(deletes), 3)
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertIn('Deleted 3 rows', out.getvalue())
+        self.assertEqual(self.remaining(), [(None, self.user.pk, 'Shoe 0')])
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('products/', views.products, name='products'),
     path('product/<int:product_id>/', views.product_detail, name='product_detail'),
+    path('media/resized/<int:width>x<int:height>/<path:name>', views.resized_image, name='resized_image'),
     path('cart/', views.cart, name='cart'),
     path('add-to-cart/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('checkout/', views.checkout, name='checkout'),
@@ -29,4 +30,5 @@ urlpatterns = [
     path('api/products/', api_views.ProductListAPIView.as_view(), name='api_products'),
     path('api/categories/', api_views.CategoryListAPIView.as_view(), name='api_categories'),
     path('api/cart/', api_views.CartAPIView.as_view(), name='api_cart'),
+    path('api/cart/summary/', api_views.CartSummaryAPIView.as_view(), name='api_cart_summary'),
 ]
\ No newline at end of file
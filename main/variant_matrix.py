@@ -0,0 +1,83 @@
+"""
+Cached color x size availability matrix for the product detail page.
+
+Everything the page needs besides the Product row itself (colors, per-size
+stock flags, SKUs, color images and the gallery) is built with two queries
+and kept in the cache, so a detail page view is one cache hit plus the
+product lookup.
+
+Entries are dropped when a variant or gallery image is saved or deleted,
+and when checkout changes stock or reservations for the product.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ProductImage, ProductVariant
+
+
+TIMEOUT = getattr(settings, 'VARIANT_MATRIX_CACHE_SECONDS', 10 * 60)
+
+
+def cache_key(product_id):
+    return f'variant-matrix:{product_id}'
+
+
+def build(product_id):
+    """
+    Read variants and gallery images of a product into a cacheable dict.
+
+    Returns:
+        dict with 'colors' (ordered list), 'variants_json' (color -> size ->
+        stock, sku, is_in_stock, is_low_stock, image) and 'images' (url,
+        alt_text, order)
+    """
+    color_storage = ProductVariant._meta.get_field('color_image').storage
+    variants = {}
+    for color, size, stock, reserved, sku, color_image in ProductVariant.objects.filter(
+        product_id=product_id
+    ).order_by('color', 'size').values_list('color', 'size', 'stock', 'reserved', 'sku', 'color_image'):
+        # Same rules as ProductVariant.available_stock / is_in_stock / is_low_stock
+        available = max(stock - reserved, 0)
+        variants.setdefault(color, {})[size] = {
+            'stock': stock,
+            'sku': sku,
+            'is_in_stock': available > 0,
+            'is_low_stock': 0 < available <= 5,
+            'image': color_storage.url(color_image) if color_image else None,
+        }
+
+    image_storage = ProductImage._meta.get_field('image').storage
+    images = [
+        {'url': image_storage.url(image), 'alt_text': alt_text, 'order': order}
+        for image, alt_text, order in ProductImage.objects.filter(
+            product_id=product_id
+        ).values_list('image', 'alt_text', 'order')
+    ]
+
+    return {
+        'colors': list(variants),
+        'variants_json': json.dumps(variants),
+        'images': images,
+    }
+
+
+def get(product_id):
+    """Return the matrix for a product, building and caching it on a miss."""
+    key = cache_key(product_id)
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = build(product_id)
+        cache.set(key, matrix, TIMEOUT)
+    return matrix
+
+
+def invalidate(product_ids):
+    cache.delete_many([cache_key(product_id) for product_id in set(product_ids)])
+
+
+def variant_changed(sender, instance, raw=False, **kwargs):
+    """post_save / post_delete receiver for ProductVariant and ProductImage"""
+    if not raw:
+        invalidate([instance.product_id])
@@ -1,16 +1,23 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.utils.http import parse_etags
+from django.urls import reverse
+from django.views.decorators.http import require_safe
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
 from django.contrib import messages
-from .models import Product, Category, Cart, Order, OrderItem, Address, ProductVariant, Wishlist
-from . import email_utils
+from django.db.models import Prefetch
+from .models import Product, Category, Order, OrderItem, Address, Wishlist
+from . import carts, email_utils, inventory, orders, page_cache, resized, search, variant_matrix
+from .pagination import InvalidCursor, keyset_page
 import json
-import random
-import string
 
+# Order items with their products, for pages that list what was ordered
+ORDER_ITEMS = Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product'))
+
+@page_cache.cache_anonymous(tags=['page:home', 'category:*'])
 def home(request):
     featured_products = Product.objects.filter(featured=True)[:4]
     categories = Category.objects.all()
@@ -21,9 +28,12 @@ def home(request):
     }
     return render(request, 'home.html', context)
 
+PRODUCT_ORDERINGS = ['-created_at', 'created_at', 'price', '-price', 'name', '-name']
+
+@page_cache.cache_anonymous(tags=['page:products'], params=['category', 'ordering', 'cursor', 'search'])
 def products(request):
     category_slug = request.GET.get('category')
-    products = Product.objects.all()
+    products = Product.objects.select_related('rating_summary')
     selected_category = None
     
     if category_slug:
@@ -35,52 +45,45 @@ def products(request):
             # If category doesn't exist, just show all products
             pass
     
+    query = request.GET.get('search', '').strip()
+    ordering = request.GET.get('ordering')
+    if ordering not in PRODUCT_ORDERINGS:
+        ordering = search.SEARCH_RANK if query else PRODUCT_ORDERINGS[0]
+    if query:
+        products = search.search_products(products, query, ranked=ordering == search.SEARCH_RANK)
+    
+    # Keyset pagination keeps deep pages as cheap as the first one
+    try:
+        page = keyset_page(products, ordering, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        page = keyset_page(products, ordering)
+    
     categories = Category.objects.all()
     
+    page_cache.add_tags(
+        request,
+        f'category:{selected_category}' if selected_category else 'category:*',
+        *[f'product:{product.pk}' for product in page.items],
+    )
+    
     context = {
-        'products': products,
+        'products': page.items,
+        'page': page,
+        'ordering': ordering,
         'categories': categories,
         'selected_category': selected_category,
+        'search_query': query,
     }
     return render(request, 'products.html', context)
 
 
 
-def get_cart_items(request):
-    """Helper function to get cart items for both logged-in and guest users"""
-    if request.user.is_authenticated:
-        return Cart.objects.filter(user=request.user).select_related('product', 'product__category')
-    else:
-        # Guest user - use session
-        if not request.session.session_key:
-            request.session.create()
-        session_key = request.session.session_key
-        return Cart.objects.filter(session_key=session_key).select_related('product', 'product__category')
-
-
 def product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    
-    # Get all variants for this product
-    variants = product.variants.all()
+    # Review aggregates are denormalized, so they come with the product row
+    product = get_object_or_404(Product.objects.select_related('rating_summary'), id=product_id)
     
-    # Get unique colors available
-    available_colors = product.get_available_colors()
-    
-    # Create variant data structure for JavaScript
-    variant_data = {}
-    for variant in variants:
-        color = variant.color
-        if color not in variant_data:
-            variant_data[color] = {}
-        
-        variant_data[color][variant.size] = {
-            'stock': variant.stock,
-            'sku': variant.sku,
-            'is_in_stock': variant.is_in_stock(),
-            'is_low_stock': variant.is_low_stock(),
-            'image': variant.color_image.url if variant.color_image else None
-        }
+    # Colors, sizes, stock flags and images come from one cache entry
+    matrix = variant_matrix.get(product.id)
     
     # Check if product is in wishlist
     is_in_wishlist = False
@@ -89,21 +92,51 @@ def product_detail(request, product_id):
     
     context = {
         'product': product,
-        'available_colors': available_colors,
-        'variants_json': json.dumps(variant_data),
+        'available_colors': matrix['colors'],
+        'images': matrix['images'],
+        'variants_json': matrix['variants_json'],
         'is_in_wishlist': is_in_wishlist,
     }
     return render(request, 'product_detail.html', context)
 
 
+@require_safe
+def resized_image(request, width, height, name):
+    """Media image cropped to one of the allowed sizes, e.g. for emails and the cart panel"""
+    if (width, height) not in resized.ALLOWED_SIZES:
+        raise Http404('Size not allowed')
+    try:
+        path, etag = resized.resized(name, width, height)
+    except resized.ResizeError:
+        raise Http404('Image not found')
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            source = open(path, 'rb')
+        except FileNotFoundError:
+            # prune() removed the file after resized() looked; render it again
+            try:
+                path, etag = resized.resized(name, width, height)
+                source = open(path, 'rb')
+            except (resized.ResizeError, FileNotFoundError):
+                raise Http404('Image not found')
+        response = FileResponse(source, content_type=resized.CONTENT_TYPE)
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={resized.MAX_AGE}'
+    return response
+
+
 def cart(request):
     """Cart view - works for both logged-in and guest users"""
-    cart_items = get_cart_items(request)
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    cart_items = carts.for_request(request).get_lines()
+    summary = carts.CartSummary.from_lines(cart_items)
     
     context = {
         'cart_items': cart_items,
-        'total': total,
+        'summary': summary,
+        'total': summary.total,
     }
     return render(request, 'cart.html', context)
 
@@ -113,28 +146,7 @@ def add_to_cart(request, product_id):
         product = get_object_or_404(Product, id=product_id)
         quantity = int(request.POST.get('quantity', 1))
         
-        if request.user.is_authenticated:
-            # Logged-in user
-            cart_item, created = Cart.objects.get_or_create(
-                user=request.user,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-        else:
-            # Guest user - use session
-            if not request.session.session_key:
-                request.session.create()
-            session_key = request.session.session_key
-            
-            cart_item, created = Cart.objects.get_or_create(
-                session_key=session_key,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        carts.for_request(request).add(product.id, quantity)
         
         return JsonResponse({'success': True, 'message': 'Product added to cart'})
     
@@ -142,12 +154,19 @@ def add_to_cart(request, product_id):
 
 def checkout(request):
     """Checkout view - works for both logged-in and guest users"""
-    cart_items = get_cart_items(request)
+    store = carts.for_request(request)
+    cart_items = store.get_lines()
     
     if not cart_items:
         return redirect('cart')
     
-    total = sum(item.product.price * item.quantity for item in cart_items)
+    total = carts.CartSummary.from_lines(cart_items).total
+    
+    if request.user.is_authenticated:
+        user, session_key = request.user, None
+    else:
+        # Guest checkout - stock is held against the session
+        user, session_key = None, request.session.session_key
     
     if request.method == 'POST':
         # Combine first and last name
@@ -155,61 +174,24 @@ def checkout(request):
         last_name = request.POST.get('last_name', '')
         full_name = f"{first_name} {last_name}".strip()
         
-        # Generate order number
-        if request.user.is_authenticated:
-            order_num_prefix = f"ORD-{request.user.id}"
-            is_guest = False
-            user = request.user
-        else:
-            # Guest order
-            order_num_prefix = "ORD-GUEST"
-            is_guest = True
-            user = None
-        
-        order_number = f"{order_num_prefix}-{''.join(random.choices(string.ascii_uppercase + string.digits, k=8))}"
-        
-        # Process order
-        order = Order.objects.create(
-            user=user,
-            is_guest=is_guest,
-            order_number=order_number,
-            total_amount=total,
-            full_name=full_name,
-            email=request.POST.get('email'),
-            phone=request.POST.get('phone'),
-            address=request.POST.get('address'),
-            city=request.POST.get('city'),
-            state=request.POST.get('state'),
-            zip_code=request.POST.get('zip_code'),
-            payment_method=request.POST.get('payment_method', 'credit-card'),
-        )
-        
-        # Create order items and update stock
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                price=cart_item.product.price,
-                size=cart_item.size,
-                color=cart_item.color
+        try:
+            order = orders.place_order(
+                cart_items,
+                user=user,
+                session_key=session_key,
+                store=store,
+                full_name=full_name,
+                email=request.POST.get('email'),
+                phone=request.POST.get('phone'),
+                address=request.POST.get('address'),
+                city=request.POST.get('city'),
+                state=request.POST.get('state'),
+                zip_code=request.POST.get('zip_code'),
+                payment_method=request.POST.get('payment_method', 'credit-card'),
             )
-            
-            # Decrease stock for the specific variant
-            try:
-                variant = ProductVariant.objects.get(
-                    product=cart_item.product,
-                    size=cart_item.size,
-                    color=cart_item.color
-                )
-                variant.stock -= cart_item.quantity
-                variant.save()
-            except ProductVariant.DoesNotExist:
-                # If variant doesn't exist, skip stock update
-                pass
-        
-        # Clear cart
-        cart_items.delete()
+        except orders.OutOfStockError as e:
+            messages.error(request, f'Sorry, only {e.variant.available_stock} left of {e.variant}. Please update your cart.')
+            return redirect('cart')
         
         # Send order confirmation email
         try:
@@ -219,6 +201,13 @@ def checkout(request):
         
         return redirect('order_success', order_id=order.id)
     
+    # Hold the stock while the shopper fills in the form
+    try:
+        inventory.reserve_cart(cart_items, user=user, session_key=session_key)
+    except inventory.OutOfStockError as e:
+        messages.error(request, f'Sorry, only {e.variant.available_stock} left of {e.variant}. Please update your cart.')
+        return redirect('cart')
+    
     # Get user's saved addresses (only for logged-in users)
     addresses = []
     if request.user.is_authenticated:
@@ -233,7 +222,7 @@ def checkout(request):
 
 @login_required
 def order_success(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_object_or_404(Order.objects.prefetch_related(ORDER_ITEMS), id=order_id, user=request.user)
     
     context = {
         'order': order,
@@ -290,9 +279,11 @@ def logout_view(request):
     return redirect('home')
 
 def men_page(request):
-    """Dedicated page for men's jewelry collection"""
-    return render(request, 'men.html')
+    """The men's collection: the product listing filtered to the men category"""
+    # There is no men.html; the listing already renders a category
+    return redirect(f"{reverse('products')}?category=men")
 
+@page_cache.cache_anonymous(tags=['page:size-guide'])
 def size_guide(request):
     """Size guide page for footwear sizing"""
     return render(request, 'size_guide.html')
@@ -358,7 +349,7 @@ def profile(request):
         return redirect('profile')
     
     # Get user's orders, addresses, and wishlist
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = Order.objects.filter(user=request.user).prefetch_related(ORDER_ITEMS).order_by('-created_at')
     addresses = Address.objects.filter(user=request.user).order_by('-is_default', '-created_at')
     wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product')
     
@@ -384,10 +375,12 @@ def contact(request):
     
     return render(request, 'contact.html')
 
+@page_cache.cache_anonymous(tags=['page:about'])
 def about(request):
     """About us page"""
     return render(request, 'about.html')
 
+@page_cache.cache_anonymous(tags=['page:return-policy'])
 def return_policy(request):
     """Return and exchange policy page"""
     return render(request, 'return_policy.html')
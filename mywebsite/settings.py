@@ -50,6 +50,20 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Server-Timing headers, sampled timing logs and ?_profile=1 for staff
+# (see main/profiling.py)
+if config('REQUEST_PROFILING', default=False, cast=bool):
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.contrib.auth.middleware.AuthenticationMiddleware') + 1,
+        'main.profiling.RequestProfilingMiddleware',
+    )
+
+# Per-view SQL statistics (manage.py query_stats) and the slow-query log
+# (see main/query_stats.py)
+if config('QUERY_STATS', default=False, cast=bool):
+    MIDDLEWARE.insert(0, 'main.query_stats.QueryStatsMiddleware')
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=100, cast=int)
+
 ROOT_URLCONF = 'mywebsite.urls'
 
 TEMPLATES = [
@@ -115,6 +129,24 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Caches - 'pages' holds full pages for anonymous visitors (main/page_cache.py).
+# Any Django cache backend works, e.g. FileBasedCache to share it between
+# workers on one machine or Redis across machines.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+PAGE_CACHE_SECONDS = 10 * 60
+
+# Where guest carts live: 'db', 'session' or 'cache' (see main/carts.py)
+CART_GUEST_STORE = config('CART_GUEST_STORE', default='db')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -189,6 +221,16 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': os.path.join(BASE_DIR, 'django_errors.log'),
         },
+        'profiling': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'level': 'WARNING',
+            'class': 'logging.FileHandler',
+            'filename': os.path.join(BASE_DIR, 'slow_queries.log'),
+            'delay': True,
+        },
     },
     'loggers': {
         'django': {
@@ -196,5 +238,15 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'main.profiling': {
+            'handlers': ['profiling'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'main.query_stats': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
\ No newline at end of file